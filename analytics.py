@@ -0,0 +1,151 @@
+# analytics.py — agrégats de ventes tenus à jour commande par commande
+# Source : le journal local des commandes (orders.py). Seules les commandes pas encore vues sont agrégées
+# (curseur "seen"), puis l'état est sauvegardé en JSON compact (ANALYTICS_PATH, défaut analytics.json).
+# Lecture (/stats, GET /admin/stats) : coût proportionnel à la taille du catalogue vendu, pas à l'historique ;
+# appelée via asyncio.to_thread (relecture du stock pour l'écoulement).
+# Agrégats par boutique (tenants.py : analytics.<nom>.json).
+import json
+import logging
+import os
+import threading
+import time
+
+import orders
+import tenants
+from sheets import _load_stock, _norm, on_order
+
+PATH = os.getenv("ANALYTICS_PATH", "analytics.json")
+HOURS = int(os.getenv("ANALYTICS_HOURS", "168"))  # historique horaire conservé (7 jours)
+DAYS = int(os.getenv("ANALYTICS_DAYS", "90"))     # historique journalier conservé
+
+log = logging.getLogger("analytics")
+_lock = threading.Lock()
+
+
+def _empty() -> dict:
+    return {
+        "seen": 0,                 # commandes du journal déjà agrégées
+        "orders": 0, "units": 0, "revenue": 0,
+        "by_club": {},             # club -> [unités, CA]
+        "by_item": {},             # "id|coloris|variante|taille" -> [unités, CA]
+        "by_day": {},              # "AAAA-MM-JJ" -> [commandes, CA] (DAYS derniers jours)
+        "by_hour": {},             # "AAAA-MM-JJTHH" -> commandes (HOURS dernières heures)
+        "hour_of_day": [0] * 24,   # commandes par heure de la journée (tout l'historique)
+    }
+
+
+def _load() -> dict:
+    path = tenants.path(PATH)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _empty()
+    except Exception:
+        log.exception("agrégats illisibles (%s) : reconstruction depuis le journal", path)
+        return _empty()
+
+
+_agg = tenants.scoped(_load)  # chargé au premier accès de chaque boutique
+
+
+def _save():
+    path = tenants.path(PATH)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_agg.unwrap(), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _add(o: dict):
+    a = _agg
+    ts = str(o.get("timestamp") or "")
+    day, hour = ts[:10], ts[:13].replace(" ", "T")
+    total = int(o.get("total_cents") or 0)
+    a["orders"] += 1
+    a["revenue"] += total
+    d = a["by_day"].setdefault(day, [0, 0])
+    d[0] += 1
+    d[1] += total
+    a["by_hour"][hour] = a["by_hour"].get(hour, 0) + 1
+    if len(ts) >= 13 and ts[11:13].isdigit():
+        a["hour_of_day"][int(ts[11:13]) % 24] += 1
+    for it in o.get("items_json") or []:
+        qty = int(it.get("qty", 1))
+        rev = int(it.get("price_cents", 0)) * qty
+        a["units"] += qty
+        c = a["by_club"].setdefault(it.get("club") or "?", [0, 0])
+        c[0] += qty
+        c[1] += rev
+        key = "|".join(str(it.get(k) or "") for k in ("id", "color", "variant", "size"))
+        i = a["by_item"].setdefault(key, [0, 0])
+        i[0] += qty
+        i[1] += rev
+
+
+def _catch_up():
+    """Agrège les commandes du journal pas encore vues (toutes celles écrites par n'importe quel worker)."""
+    orders._sync()
+    n = len(orders._orders)
+    if n == _agg["seen"]:
+        return
+    with _lock:
+        if _agg["seen"] > n:  # journal remplacé / tronqué : on repart de zéro
+            _agg.swap(_empty())
+        for o in orders._orders[_agg["seen"]:n]:
+            _add(o)
+        _agg["seen"] = n
+        for h in sorted(_agg["by_hour"])[:-HOURS]:
+            del _agg["by_hour"][h]
+        for d in sorted(_agg["by_day"])[:-DAYS]:
+            del _agg["by_day"][d]
+        try:
+            _save()
+        except OSError:
+            log.exception("sauvegarde %s", tenants.path(PATH))
+
+
+@on_order
+def _on_order(order: dict):
+    # enregistré après orders.record (import d'orders ci-dessus) : la commande est déjà dans le journal
+    _catch_up()
+
+
+# -------- Lecture --------
+def _sell_through(items: list, top: int) -> list[dict]:
+    """Taux d'écoulement des déclinaisons vendues : vendu / (vendu + stock actuel)."""
+    stock_map, _ = _load_stock()
+    out = []
+    for key, (units, rev) in items:
+        pid, color, variant, size = key.split("|")
+        try:
+            left = int(stock_map.get((int(pid), _norm(color), _norm(variant)), {}).get(size, 0))
+        except ValueError:
+            continue
+        out.append({"item": key, "sold": units, "stock": left, "sell_through": round(units / ((units + left) or 1), 3)})
+    out.sort(key=lambda r: (-r["sell_through"], -r["sold"]))
+    return out[:top]
+
+
+def _top(d: dict, n: int) -> list:
+    return sorted(([k, *v] for k, v in d.items()), key=lambda r: -r[2])[:n]
+
+
+def summary(top: int = 10) -> dict:
+    """Bloquant (stock relu si le cache a expiré) : à appeler hors de la boucle."""
+    _catch_up()
+    today = time.strftime("%Y-%m-%d")
+    with _lock:  # dans un thread : une commande peut être agrégée en même temps par la boucle
+        a = _agg
+        res = {
+            "orders": a["orders"], "units": a["units"], "revenue_cents": a["revenue"],
+            "today": dict(zip(("orders", "revenue_cents"), a["by_day"].get(today, [0, 0]))),
+            "clubs": _top(a["by_club"], top),     # [club, unités, CA]
+            "items": _top(a["by_item"], top),     # ["id|coloris|variante|taille", unités, CA]
+            "days": sorted(a["by_day"].items())[-30:],
+            "hours": sorted(a["by_hour"].items())[-24:],
+            "hour_of_day": list(a["hour_of_day"]),
+        }
+        items = list(a["by_item"].items())
+    res["sell_through"] = _sell_through(items, top)
+    return res
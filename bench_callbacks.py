@@ -0,0 +1,81 @@
+# bench_callbacks.py — coût de dispatch d'un callback selon le nombre de handlers
+# Compare la chaîne de filtres aiogram (F.data.startswith, évalués un par un) au routeur
+# (callbacks.CallbackRouter : un seul handler aiogram, décodage compact + table par code d'action).
+# Le coût du routeur ne dépend pas du nombre d'actions : il est mesuré sur la table réelle (ACTIONS).
+# Usage : python bench_callbacks.py [--updates 2000] [--sizes 10,50,200,1000]
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Update
+
+from callbacks import ACTIONS, CallbackRouter, Payload, pack, unpack
+
+FAKE_TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+def _update(i: int, data: str) -> Update:
+    return Update.model_validate({
+        "update_id": i,
+        "callback_query": {
+            "id": str(i), "chat_instance": "bench", "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+        },
+    })
+
+
+async def _noop(*_):
+    return None
+
+
+def build_filters(n: int) -> Dispatcher:
+    dp = Dispatcher()
+    for i in range(n):
+        dp.callback_query.register(_noop, F.data.startswith(f"a{i}:"))
+    return dp
+
+
+def build_router() -> Dispatcher:
+    dp = Dispatcher()
+    cbr = CallbackRouter(version=lambda: 7)
+    cbr.on(*ACTIONS)(_noop)
+    dp.callback_query.register(cbr.dispatch)
+    return dp
+
+
+async def _run(dp: Dispatcher, bot: Bot, updates: list[Update]) -> float:
+    t0 = time.perf_counter()
+    for u in updates:
+        await dp.feed_update(bot, u)
+    return (time.perf_counter() - t0) / len(updates) * 1e6
+
+
+async def main(n_updates: int, sizes: list[int]):
+    bot = Bot(FAKE_TOKEN)
+    data = pack(Payload("size_ok", 7, 1234, 2, 1, 5))
+    t0 = time.perf_counter()
+    for _ in range(100_000):
+        unpack(data)
+    print(f"décodage callback_data ({len(data)} car.) : {(time.perf_counter() - t0) * 10:.2f} µs\n")
+    rout = build_router()
+    rupdates = [_update(i, data) for i in range(n_updates)]
+    await _run(rout, bot, rupdates[:50])
+    print(f"{'handlers':>8} {'cible':>7} {'filtres µs':>11} {'routeur µs':>11} {'gain':>6}")
+    for n in sizes:
+        for label, target in (("1er", 0), ("milieu", n // 2), ("dernier", n - 1)):
+            updates = [_update(i, f"a{target}:42:7") for i in range(n_updates)]
+            filt = build_filters(n)
+            await _run(filt, bot, updates[:50])  # warm-up
+            a = await _run(filt, bot, updates)
+            b = await _run(rout, bot, rupdates)
+            print(f"{n:>8} {label:>7} {a:>11.1f} {b:>11.1f} {a / b:>5.1f}x")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--sizes", default="10,50,200,1000")
+    args = ap.parse_args()
+    asyncio.run(main(args.updates, [int(x) for x in args.sizes.split(",")]))
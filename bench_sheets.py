@@ -0,0 +1,160 @@
+# bench_sheets.py — micro-benchmarks des chemins chauds de sheets.py / models.py
+# Catalogues synthétiques (fakes.make_catalog : 20 tailles, plusieurs coloris/variantes) sur un classeur
+# en mémoire : aucune latence réseau, seul le coût CPU/mémoire du code est mesuré.
+# Par fonction : µs par appel (meilleur de --repeat), pic mémoire pendant une série (tracemalloc), pic par appel
+# (Ko tracés au plus haut pendant l'appel au-delà de l'état de départ : temporaires compris), mémoire retenue par
+# appel (blocs et Ko encore vivants au retour, résultat compris : différence de snapshots tracemalloc en gardant
+# les résultats ; ce n'est PAS un nombre d'allocations, les temporaires libérés n'y figurent pas) et fuite par
+# appel (blocs restant alloués une fois les résultats relâchés : caches qui grossissent).
+# Usage : python bench_sheets.py [--sizes 100,1000,10000] [--json out.json] [--compare base.json --tolerance 0.2]
+# Avec --compare, code de sortie 1 si une mesure est plus lente que la référence au-delà de la tolérance.
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SHEET_ID", "bench")
+
+import sheets
+from fakes import FakeSpreadsheet, install_sheets, make_catalog
+from models import add_to_cart, carts
+
+
+_OWN = (tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__))
+
+
+def measure(fn, number: int, repeat: int) -> dict:
+    """fn() appelé `number` fois par série ; renvoie µs/appel, pic Ko d'une série, pic Ko/appel, blocs et Ko
+    retenus/appel, blocs de fuite/appel."""
+    fn()  # warm-up (caches, imports)
+    best = min(_timed(fn, number) for _ in range(repeat))
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    peak = call_peak = 0
+    for _ in range(number):
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        top = tracemalloc.get_traced_memory()[1]
+        peak, call_peak = max(peak, top), call_peak + top - start
+    gc.collect()
+    leak = (sys.getallocatedblocks() - blocks) / number
+    # mémoire retenue : résultats gardés en vie pendant la série pour que la différence de snapshots les compte
+    keep = []
+    before = tracemalloc.take_snapshot().filter_traces(_OWN)
+    for _ in range(number):
+        keep.append(fn())
+    diff = tracemalloc.take_snapshot().filter_traces(_OWN).compare_to(before, "filename")
+    tracemalloc.stop()
+    del keep
+    gc.collect()
+    return {"us": best / number * 1e6, "peak_kb": peak / 1024, "call_peak_kb": call_peak / 1024 / number,
+            "retained": sum(d.count_diff for d in diff) / number,
+            "retained_kb": sum(d.size_diff for d in diff) / 1024 / number, "leak": leak}
+
+
+def _timed(fn, number: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - t0
+
+
+def bench_catalog(n: int, colors: int, variants: int, repeat: int) -> dict:
+    tabs = make_catalog(n, n_sizes=20, n_colors=colors, n_variants=variants)
+    install_sheets(FakeSpreadsheet(tabs))
+    listeners = list(sheets._snapshot_listeners)
+    sheets._snapshot_listeners.clear()  # index de recherche : mesuré à part (search.py), pas ici
+    rnd = random.Random(n)
+    head = tabs["Products"][0]
+    rows = [dict(zip(head, r)) for r in tabs["Products"][1:]]
+    out = {}
+    try:
+        # --- rafraîchissements complets (par appel = un rafraîchissement) ---
+        def refresh():
+            sheets._cache["digest"] = 0  # force la reconstruction même si le contenu est identique
+            return sheets.get_products(force=True)
+        reps = max(1, min(20, 20_000 // n))
+        out["get_products (refresh)"] = measure(refresh, reps, repeat)
+        out["get_products (inchangé)"] = measure(lambda: sheets.get_products(force=True), reps, repeat)
+        out["_load_stock (refresh)"] = measure(lambda: sheets._load_stock(force=True), reps, repeat)
+
+        prods = sheets.get_products()
+        p = prods[rnd.randrange(len(prods))]
+        color = p["colors"][-1]
+        variant = sheets.get_variants_for(p, color)[-1]
+        r = rnd.choice(rows)
+        url = r["image_url"]
+        price_json = r["color_variant_price_map_json"]
+        cmap = sheets._parse_nested_price_map(price_json)
+
+        # --- fonctions appelées par ligne ou par clic ---
+        out["_normalize_row_keys"] = measure(lambda: sheets._normalize_row_keys(r), 2000, repeat)
+        out["_parse_price_value"] = measure(lambda: sheets._parse_price_value("79,99 €"), 20000, repeat)
+        out["_extract_gdrive_id"] = measure(lambda: sheets._extract_gdrive_id(url), 20000, repeat)
+        out["_to_direct"] = measure(lambda: sheets._to_direct(url), 20000, repeat)
+        out["_parse_nested_price_map"] = measure(lambda: sheets._parse_nested_price_map(price_json), 2000, repeat)
+        out["_ci_get_map"] = measure(lambda: sheets._ci_get_map(cmap, color.upper()), 20000, repeat)
+        out["get_stock_for"] = measure(lambda: sheets.get_stock_for(p, color, variant), 5000, repeat)
+
+        item = {"id": p["id"], "name": p["name"], "club": p["club"], "color": color, "variant": variant,
+                "size": "M", "qty": 1, "price_cents": 7999}
+
+        def cart_add():
+            carts[-1].clear()
+            for s in ("S", "M", "L", "XL", "M", "S", "XXL", "M"):  # 8 ajouts, dont 3 fusions
+                add_to_cart(-1, dict(item, size=s))
+        out["add_to_cart (x8)"] = measure(cart_add, 2000, repeat)
+        carts.pop(-1, None)
+    finally:
+        sheets._snapshot_listeners[:] = listeners
+    return out
+
+
+def report(res: dict, base: dict|None, tolerance: float) -> int:
+    regressions = 0
+    for size, rows in res["catalogs"].items():
+        print(f"\n== {size} produits ==")
+        print(f"{'mesure':<28} {'µs/appel':>11} {'pic Ko':>9} {'pic Ko/appel':>13} {'blocs retenus/appel':>20}"
+              f" {'Ko retenus/appel':>17} {'fuite':>7}"
+              + ("   vs réf." if base else ""))
+        for name, m in rows.items():
+            line = (f"{name:<28} {m['us']:>11.2f} {m['peak_kb']:>9.1f} {m['call_peak_kb']:>13.2f}"
+                    f" {m['retained']:>20.1f} {m['retained_kb']:>17.2f} {m['leak']:>7.2f}")
+            ref = ((base or {}).get("catalogs", {}).get(size) or {}).get(name)
+            if ref:
+                ratio = m["us"] / ref["us"] if ref["us"] else 1.0
+                flag = "  ⚠️ régression" if ratio > 1 + tolerance else ""
+                regressions += bool(flag)
+                line += f"   {ratio:>5.2f}x{flag}"
+            print(line)
+    return regressions
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Micro-benchmarks sheets.py / models.py")
+    ap.add_argument("--sizes", default="100,1000,10000", help="tailles de catalogue (produits)")
+    ap.add_argument("--colors", type=int, default=3)
+    ap.add_argument("--variants", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", help="écrit les résultats dans ce fichier")
+    ap.add_argument("--compare", help="résultats JSON de référence")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="ralentissement toléré vs référence (0.2 = +20 %%)")
+    args = ap.parse_args()
+    res = {"python": sys.version.split()[0], "catalogs": {}}
+    for n in [int(x) for x in args.sizes.split(",")]:
+        res["catalogs"][str(n)] = bench_catalog(n, args.colors, args.variants, args.repeat)
+    base = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+    bad = report(res, base, args.tolerance)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if bad else 0)
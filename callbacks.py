@@ -0,0 +1,178 @@
+# callbacks.py — routage des callbacks : un seul handler aiogram, dispatch par code d'action
+# callback_data compact : 12 octets packés (action, version catalogue, index produit/coloris/variante/taille,
+# curseur de page) encodés en base64url sans padding (16 caractères, loin de la limite Telegram de 64 octets).
+# Décodage à coût fixe, aucun unquote ni recherche par nom ; un bouton issu d'une ancienne version
+# du catalogue est rejeté AVANT toute recherche.
+# Routes "render" (coalesce=True : elles ne font que redessiner le message du bouton) : callback acquitté tout de
+# suite, rendus sérialisés par message, et un rendu dépassé par un clic plus récent sur le même message est
+# sauté avant de commencer (seul l'état final est envoyé). Un rendu déjà parti n'est pas annulé : les éditions
+# arrivent ainsi à Telegram dans l'ordre des clics. Coalescence par worker (clics d'un message répartis sur
+# plusieurs workers : non regroupés). Callback déjà acquitté : une alerte (cb.answer(show_alert=True)) du
+# handler n'arriverait jamais, les erreurs sont affichées dans le message (main.render_error).
+import asyncio
+import base64
+import binascii
+import struct
+from typing import Awaitable, Callable, NamedTuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery
+
+import logconf
+import metrics
+
+# Codes d'action = position dans ce tuple : NE PAS réordonner, seulement ajouter à la fin
+# (les boutons déjà envoyés doivent continuer à désigner la même action).
+ACTIONS = (
+    "help", "clubs", "club",
+    "color", "color_change", "color_ok",
+    "variant", "variant_change", "variant_ok",
+    "size_na", "size_ok",
+    "cart:view", "cart:rm0", "cart:empty",
+    "checkout:start", "checkout:confirm", "order:new",
+    "notify",
+)
+_CODES = {a: i for i, a in enumerate(ACTIONS)}
+
+# action (B), version (H), pi (i : catalogues de plus de 32767 produits), ci/vi/si (B, 0..254 ; 255 = absent),
+# pg (H). Octet 255 = -1 en b signé : les boutons encodés avant le passage à B restent valides.
+_FMT = struct.Struct("!BHiBBBH")
+_NONE = 0xFF
+_LIMITS = {"pi": (-1, 2**31 - 1), "ci": (-1, _NONE - 1), "vi": (-1, _NONE - 1), "si": (-1, _NONE - 1),
+           "pg": (0, 0xFFFF)}
+_B64_LEN = (_FMT.size * 4 + 2) // 3  # longueur base64 sans padding
+_PAD = "=" * (-_B64_LEN % 4)
+
+
+class Payload(NamedTuple):
+    """Callback décodé. pi = index produit dans le snapshot (ou index club pour "club"),
+    ci/vi/si = index coloris/variante/taille (ci = index saison pour "club") ; -1 = absent.
+    pg = curseur de page. ver = 0 pour un bouton statique."""
+    action: str
+    ver: int = 0
+    pi: int = -1
+    ci: int = -1
+    vi: int = -1
+    si: int = -1
+    pg: int = 0
+
+
+INVALID = Payload("")
+
+
+def pack(p: Payload) -> str:
+    raw = _FMT.pack(_CODES[p.action], p.ver, p.pi, p.ci & _NONE, p.vi & _NONE, p.si & _NONE, p.pg)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def unpack(data: str|None) -> Payload:
+    if not data or len(data) != _B64_LEN:
+        return INVALID
+    try:
+        code, ver, pi, ci, vi, si, pg = _FMT.unpack(base64.urlsafe_b64decode(data + _PAD))
+    except (binascii.Error, struct.error, ValueError):
+        return INVALID
+    if code >= len(ACTIONS):
+        return INVALID
+    return Payload(ACTIONS[code], ver, pi, -1 if ci == _NONE else ci, -1 if vi == _NONE else vi,
+                   -1 if si == _NONE else si, pg)
+
+
+Handler = Callable[[CallbackQuery, Payload], Awaitable[None]]
+
+# callbacks déjà acquittés par le routeur (ids, ordre d'insertion) : voir middlewares.AnsweredCallbacks
+_acked: dict[str, None] = {}
+_ACKED_MAX = 1000
+
+
+def acked(callback_query_id: str) -> bool:
+    return callback_query_id in _acked
+
+
+class _Slot:
+    """Rendus d'un message : génération du dernier clic, verrou de sérialisation, rendus en cours/en attente."""
+    __slots__ = ("gen", "lock", "users")
+
+    def __init__(self):
+        self.gen, self.lock, self.users = 0, asyncio.Lock(), 0
+
+
+class CallbackRouter:
+    """Table code d'action -> handler. `version` renvoie la version courante du catalogue :
+    les boutons qui portent un index (pi >= 0) sont datés et rejetés s'ils sont périmés."""
+
+    def __init__(self, version: Callable[[], int] = lambda: 0):
+        self._routes: list[Handler|None] = [None] * len(ACTIONS)
+        self._coalesce = [False] * len(ACTIONS)
+        self._slots: dict[tuple, _Slot] = {}  # (bot_id, chat_id, message_id) -> rendus en cours
+        self._version = version
+
+    def on(self, *actions: str, coalesce: bool = False):
+        """coalesce=True : le handler ne fait que redessiner le message, sans effet de bord ; acquitté d'avance,
+        il affiche ses erreurs dans le message (pas de cb.answer(), ignoré)."""
+        def deco(fn: Handler) -> Handler:
+            for a in actions:
+                code = _CODES[a]
+                if self._routes[code] is not None:
+                    raise ValueError(f"callback déjà routé: {a}")
+                self._routes[code] = fn
+                self._coalesce[code] = coalesce
+            return fn
+        return deco
+
+    def data(self, action: str, pi: int = -1, ci: int = -1, vi: int = -1, si: int = -1, pg: int = 0) -> str:
+        for name, v in (("pi", pi), ("ci", ci), ("vi", vi), ("si", si), ("pg", pg)):
+            lo, hi = _LIMITS[name]
+            if not lo <= v <= hi:
+                raise ValueError(f"callback {action}: {name}={v} hors limites [{lo}, {hi}]")
+        ver = self._version() if pi >= 0 else 0
+        return pack(Payload(action, ver, pi, ci, vi, si, pg))
+
+    def resolve(self, data: str|None) -> tuple[Handler|None, Payload]:
+        p = unpack(data)
+        if not p.action:
+            return None, p
+        return self._routes[_CODES[p.action]], p
+
+    async def dispatch(self, cb: CallbackQuery):
+        h, p = self.resolve(cb.data)
+        if h is None or (p.ver and p.ver != self._version()):
+            metrics.inc("callbacks_rejected_total", reason="stale" if h else "invalid")
+            await cb.answer("Option expirée (catalogue mis à jour). Reviens aux clubs.", show_alert=True)
+            return
+        logconf.annotate(handler=h.__name__, action=p.action)
+        if self._coalesce[_CODES[p.action]] and cb.message:
+            await self._render(cb, p, h)
+            return
+        with metrics.timer("bot_handler_seconds", handler=h.__name__):
+            await h(cb, p)
+
+    async def _render(self, cb: CallbackQuery, p: Payload, h: Handler):
+        await _ack(cb)
+        key = (cb.bot.id if cb.bot else 0, cb.message.chat.id, cb.message.message_id)  # plusieurs bots : tenants.py
+        slot = self._slots.get(key) or self._slots.setdefault(key, _Slot())
+        slot.gen += 1
+        gen = slot.gen
+        slot.users += 1
+        try:
+            async with slot.lock:
+                if gen != slot.gen:  # un clic plus récent sur ce message sera rendu à la place
+                    metrics.inc("callbacks_coalesced_total", action=p.action)
+                    return
+                with metrics.timer("bot_handler_seconds", handler=h.__name__):
+                    await h(cb, p)
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self._slots[key]
+
+
+async def _ack(cb: CallbackQuery):
+    """Acquitte le callback (fin du sablier côté client) ; les cb.answer() suivants du handler sont ignorés."""
+    try:
+        await cb.answer()
+    except TelegramBadRequest:  # callback trop ancien : rien à acquitter
+        pass
+    _acked[cb.id] = None
+    if len(_acked) > _ACKED_MAX:
+        del _acked[next(iter(_acked))]
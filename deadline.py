@@ -0,0 +1,78 @@
+# deadline.py — budget de temps par update
+# Chaque update reçoit une échéance (UPDATE_BUDGET s après sa réception, middlewares.Deadline) portée par une
+# contextvar : les appels Sheets (pools.tune_sheets) et Bot API (pools.RetryMiddleware) bornent leur timeout
+# au temps restant, et les handlers choisissent une solution dégradée quand il n'en reste plus assez :
+#   UPDATE_BUDGET         s par update (défaut 10 ; 0 = pas d'échéance)
+#   DEADLINE_SHEETS_MIN   s minimum pour tenter une lecture Sheets, sinon cache périmé servi (défaut 2)
+#   DEADLINE_PHOTO_MIN    s minimum pour envoyer / remplacer une photo, sinon texte seul (défaut 3)
+#   DEADLINE_NOTIFY_MIN   s minimum pour notifier les admins dans l'update, sinon tâche de fond (défaut 5)
+#   DEADLINE_FLOOR        timeout minimal accordé à un appel même budget épuisé (défaut 0.5 : on répond quand même)
+# Chaque solution dégradée est comptée dans deadline_fallbacks_total{kind}.
+import asyncio
+import contextvars
+import os
+import time
+
+import metrics
+
+BUDGET = float(os.getenv("UPDATE_BUDGET", "10"))
+SHEETS_MIN = float(os.getenv("DEADLINE_SHEETS_MIN", "2"))
+PHOTO_MIN = float(os.getenv("DEADLINE_PHOTO_MIN", "3"))
+NOTIFY_MIN = float(os.getenv("DEADLINE_NOTIFY_MIN", "5"))
+FLOOR = float(os.getenv("DEADLINE_FLOOR", "0.5"))
+
+_deferred: set[asyncio.Task] = set()  # tâches reportées en cours (référence gardée jusqu'à la fin)
+
+# échéance (time.monotonic) de l'update en cours ; None hors update ou en tâche de fond
+_deadline: contextvars.ContextVar[float|None] = contextvars.ContextVar("deadline", default=None)
+
+
+def start(budget: float|None = BUDGET):
+    """Ouvre le budget de l'update courant (None ou 0 : pas d'échéance, ex. tâche de fond)."""
+    _deadline.set(time.monotonic() + budget if budget else None)
+
+
+def remaining() -> float|None:
+    """Secondes restantes (négatif si dépassé), None sans échéance."""
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+def expired() -> bool:
+    r = remaining()
+    return r is not None and r <= 0
+
+
+def enough(seconds: float) -> bool:
+    """Reste-t-il au moins `seconds` ? (toujours vrai sans échéance)"""
+    r = remaining()
+    return r is None or r >= seconds
+
+
+def timeout(default: float) -> float:
+    """Timeout à appliquer à un appel externe : `default`, borné par le temps restant (au moins FLOOR)."""
+    r = remaining()
+    return default if r is None else max(FLOOR, min(default, r))
+
+
+def fallback(kind: str):
+    metrics.inc("deadline_fallbacks_total", kind=kind)
+
+
+def defer(coro, kind: str|None = None) -> asyncio.Task:
+    """Sort `coro` du budget de l'update : tâche de fond sans échéance (contexte de log conservé).
+    `kind` : solution dégradée comptée dans deadline_fallbacks_total (None : report voulu, non compté)."""
+    if kind:
+        fallback(kind)
+    ctx = contextvars.copy_context()
+    ctx.run(_deadline.set, None)
+    t = asyncio.create_task(coro, context=ctx)
+    _deferred.add(t)
+    t.add_done_callback(_deferred.discard)
+    return t
+
+
+async def drain(timeout: float):
+    """Arrêt : laisse aux tâches reportées (notifications admin...) jusqu'à `timeout` s pour finir."""
+    if _deferred:
+        await asyncio.wait(list(_deferred), timeout=timeout)
@@ -0,0 +1,265 @@
+# fakes.py — doublures locales pour benchs / tests de charge (aucun appel réseau)
+# - FakeBotSession : session aiogram qui répond aux méthodes Bot API avec des objets synthétiques
+# - FakeSpreadsheet / FakeWorksheet : remplaçant en mémoire de gspread (latence et erreurs de quota injectables)
+# - make_catalog : onglets Products / Stock synthétiques
+# - asgi_post : POST direct sur une app ASGI (webhook_app.app) sans serveur HTTP
+# - isolate_files : journaux locaux (commandes, agrégats, réassort) dans un dossier temporaire
+# - fake_tenants : boutiques factices (TENANTS) pour rejouer un enregistrement multi-boutiques
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe
+from aiogram.types import Message, User
+from gspread.exceptions import APIError, WorksheetNotFound
+
+FAKE_TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+def isolate_files(prefix: str = "madsport-") -> str:
+    """Redirige ORDERS_LOG, ANALYTICS_PATH et RESTOCK_LOG vers un dossier temporaire (supprimé à la sortie)
+    et coupe l'enregistrement webhook : les commandes synthétiques ne rejoignent jamais l'historique réel.
+    À appeler avant d'importer main / orders / analytics / restock."""
+    d = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, d, ignore_errors=True)
+    os.environ.update(ORDERS_LOG=os.path.join(d, "orders.jsonl"), ANALYTICS_PATH=os.path.join(d, "analytics.json"),
+                      RESTOCK_LOG=os.path.join(d, "restock.jsonl"))
+    os.environ.pop("WEBHOOK_RECORD", None)
+    return d
+
+
+def fake_tenants(names: list[str]):
+    """TENANTS factice : une boutique par nom (token et secret de webhook factices, classeur "replay-<nom>").
+    Liste vide ou ["default"] : boutique unique décrite par BOT_TOKEN / SHEET_ID. Avant d'importer main."""
+    if not names or names == ["default"]:
+        os.environ["TENANTS"] = ""
+        return
+    secret = FAKE_TOKEN.partition(":")[2]
+    os.environ["TENANTS"] = json.dumps([{"name": n, "bot_token": f"{100001 + i}:{secret}", "sheet_id": f"replay-{n}",
+                                         "webhook_secret": f"replay-{n}"} for i, n in enumerate(names)])
+
+
+# -------- Bot API --------
+class FakeBotSession(BaseSession):
+    """Répond localement à toutes les méthodes. Garde, par chat, le dernier message envoyé/édité
+    (id, photo ou texte, clavier inline) pour que les utilisateurs synthétiques cliquent dessus."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency, self.jitter = latency, jitter
+        self.calls = 0
+        self.last: dict[int, dict] = {}  # chat_id -> {"message_id", "photo", "keyboard"}
+        self._ids = itertools.count(1000)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if isinstance(method, GetMe):
+            return User(id=int(bot.token.split(":")[0]), is_bot=True, first_name="Bot", username="fake_bot")
+        returning = str(getattr(method, "__returning__", ""))
+        if "Message" not in returning:
+            return True
+        return self._message(method)
+
+    def _message(self, method) -> Message:
+        chat_id = int(getattr(method, "chat_id", 0) or 0)
+        name = type(method).__name__
+        prev = self.last.get(chat_id, {})
+        edit = name.startswith("Edit")
+        mid = getattr(method, "message_id", None) if edit else next(self._ids)
+        photo = prev.get("photo", False) if edit else False
+        if name in ("SendPhoto", "EditMessageMedia"):
+            photo = True
+        elif name in ("SendMessage", "EditMessageText"):
+            photo = False
+        rm = getattr(method, "reply_markup", None)
+        kb = getattr(rm, "inline_keyboard", None)
+        if kb is None and name != "EditMessageReplyMarkup" and edit:
+            kb = prev.get("keyboard")  # edit_media sans clavier : Telegram garde l'ancien
+        self.last[chat_id] = {"message_id": mid, "photo": photo, "keyboard": kb}
+        body = {"message_id": mid or 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+        if photo:
+            body["photo"] = [{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]
+        else:
+            body["text"] = "…"
+        return Message.model_validate(body)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+def install_bot(bot, **kwargs) -> FakeBotSession:
+    """Remplace la session du bot en conservant ses middlewares (métriques, etc.)."""
+    fake = FakeBotSession(**kwargs)
+    for m in bot.session.middleware:
+        fake.middleware(m)
+    bot.session = fake
+    return fake
+
+
+# -------- gspread --------
+class _FakeResponse:
+    def __init__(self, code: int, message: str):
+        self.status_code, self.text = code, message
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+
+class FakeWorksheet:
+    def __init__(self, book: "FakeSpreadsheet", title: str, rows: list[list]):
+        self.book, self.title, self.rows = book, title, rows
+        self.row_count = max(len(rows) + 100, 2000)
+
+    def get_all_records(self):
+        self.book.api("get_all_records")
+        head = self.rows[0] if self.rows else []
+        return [dict(zip(head, r)) for r in self.rows[1:] if any(v not in ("", None) for v in r)]
+
+    def row_values(self, i: int):
+        self.book.api("row_values")
+        return list(self.rows[i - 1]) if i <= len(self.rows) else []
+
+    def get(self, rng: str, **_):
+        # seul usage : une colonne "A2:A501" (recherche de la première ligne vide)
+        self.book.api("get")
+        a, b = rng.split(":")
+        r0, r1 = int(a[1:]), int(b[1:])
+        return [[r[0] if r else "" for r in self.rows[r0 - 1:r1]]]
+
+    def add_rows(self, n: int):
+        self.book.api("add_rows")
+        self.row_count += n
+
+    def update(self, rng: str, values: list[list], **_):
+        self.book.api("update")
+        row = int(rng.split(":")[0][1:])
+        while len(self.rows) < row:
+            self.rows.append([])
+        self.rows[row - 1] = list(values[0])
+
+
+class FakeSpreadsheet:
+    """latency/jitter en secondes (bloquant, comme gspread) ; quota_error_rate = probabilité d'APIError 429."""
+
+    def __init__(self, tabs: dict[str, list[list]], latency: float = 0.0, jitter: float = 0.0, quota_error_rate: float = 0.0):
+        self.latency, self.jitter, self.quota_error_rate = latency, jitter, quota_error_rate
+        self.calls: dict[str, int] = {}
+        self.tabs = {name: FakeWorksheet(self, name, rows) for name, rows in tabs.items()}
+
+    def api(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+        if self.quota_error_rate and random.random() < self.quota_error_rate:
+            raise APIError(_FakeResponse(429, "Quota exceeded for quota metric 'Read requests'"))
+
+    def worksheet(self, name: str) -> FakeWorksheet:
+        self.api("worksheet")
+        if name not in self.tabs:
+            raise WorksheetNotFound(name)
+        return self.tabs[name]
+
+    def add_worksheet(self, title: str, rows: int = 100, cols: int = 26):
+        self.api("add_worksheet")
+        self.tabs[title] = FakeWorksheet(self, title, [])
+        return self.tabs[title]
+
+
+class FakeClient:
+    def __init__(self, book: FakeSpreadsheet):
+        self.book = book
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        return self.book
+
+
+def install_sheets(book: FakeSpreadsheet):
+    """Branche sheets.py sur le classeur en mémoire et vide ses caches."""
+    import sheets
+    sheets._gc = FakeClient(book)
+    sheets._cache["sh"] = book
+    sheets._cache["products"] = ([], 0)
+    sheets._cache["digest"] = sheets._cache["version"] = 0
+    sheets._cache["stock"] = ({}, [], 0)
+    return sheets
+
+
+# -------- Catalogue synthétique --------
+SIZES = ["XS", "S", "M", "L", "XL", "XXL", "3XL", "4XL", "6A", "8A", "10A", "12A", "14A", "16A",
+         "28", "30", "32", "34", "36", "38"]
+_CLUBS = ["PSG", "OM", "OL", "Real Madrid", "Barça", "Milan AC", "Inter", "Juventus", "Bayern", "Arsenal",
+          "Chelsea", "Liverpool", "Man City", "Man United", "Dortmund", "Ajax", "Benfica", "Porto", "Celtic", "Naples"]
+_COLORS = ["Domicile", "Extérieur", "Third", "Gardien", "Rétro", "Training"]
+_VARIANTS = ["Fan", "Player", "Enfant", "Manches longues", "Femme"]
+
+
+def make_catalog(n_products: int, n_sizes: int = 20, n_colors: int = 3, n_variants: int = 3,
+                 seed: int = 1, zero_rate: float = 0.2) -> dict[str, list[list]]:
+    """Onglets Products/Stock/Orders au format du vrai classeur (mêmes en-têtes)."""
+    rnd = random.Random(seed)
+    sizes = SIZES[:n_sizes]
+    products = [["ID", "name", "club", "season", "price_cents", "sizes", "colors", "image_url",
+                 "image_color_map_json", "color_variant_map_json", "color_variant_price_map_json",
+                 "image_color_variant_map_json", "stock", "active"]]
+    stock = [["ID", "club", "colors", "color_variant"] + sizes]
+    for pid in range(1, n_products + 1):
+        club = _CLUBS[pid % len(_CLUBS)]
+        season = str(2018 + pid % 7)
+        colors = _COLORS[:max(1, n_colors)]
+        variants = _VARIANTS[:max(1, n_variants)]
+        cv = {c: variants for c in colors}
+        prices = {c: {v: f"{59 + 10 * i},99" for i, v in enumerate(variants)} for c in colors}
+        img = lambda c, v="": f"https://drive.google.com/file/d/{pid:06d}{c[:3]}{v[:3]}XXXXXXXXXXXXXXXX/view"
+        products.append([
+            pid, f"Maillot {club} {season} #{pid}", club, season, "59,99", ",".join(sizes), ",".join(colors),
+            img("gen"), json.dumps({c: img(c) for c in colors}, ensure_ascii=False),
+            json.dumps(cv, ensure_ascii=False), json.dumps(prices, ensure_ascii=False),
+            json.dumps({c: {v: img(c, v) for v in variants} for c in colors}, ensure_ascii=False),
+            0, 1,
+        ])
+        for c in colors:
+            for v in variants:
+                stock.append([pid, club, c, v] + [0 if rnd.random() < zero_rate else rnd.randint(1, 20) for _ in sizes])
+    orders = [["order_id", "timestamp", "user_id", "name", "phone", "address", "items_json", "total_cents", "status"]]
+    return {"Products": products, "Stock": stock, "Orders": orders}
+
+
+# -------- ASGI --------
+async def asgi_post(app, path: str, body: bytes, headers: dict[str, str]|None = None) -> int:
+    """POST direct sur l'app ASGI ; renvoie le code HTTP."""
+    hdrs = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    hdrs += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": hdrs, "client": ("127.0.0.1", 0), "server": ("fake", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    status = []
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            status.append(msg["status"])
+
+    await app(scope, receive, send)
+    return status[0] if status else 0
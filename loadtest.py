@@ -0,0 +1,193 @@
+# loadtest.py — test de charge de bout en bout du tunnel d'achat
+# Des utilisateurs synthétiques parcourent : /start → clubs → club → coloris → validation → (variante → validation)
+# → taille → commander → confirmer → nom → téléphone → adresse (finalize_order), en cliquant sur les boutons
+# réellement renvoyés par le bot. Bot API et Google Sheets sont remplacés par les doublures de fakes.py
+# (latence et erreurs de quota injectables). Rien ne sort sur le réseau.
+#
+# Usage : python loadtest.py --users 50 --duration 30 --products 500 --sheets-latency 0.15 --quota-errors 0.01
+#         --via asgi (POST sur webhook_app.app, défaut) | dispatcher (dp.feed_update direct)
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+
+from fakes import FAKE_TOKEN, FakeSpreadsheet, asgi_post, install_bot, install_sheets, isolate_files, make_catalog
+
+# jamais de vrai token / vrai classeur ici (load_dotenv ne surcharge pas l'environnement existant)
+os.environ["BOT_TOKEN"] = FAKE_TOKEN
+os.environ["SHEET_ID"] = "loadtest"
+os.environ["TENANTS"] = ""  # ni celui du shell ni celui du .env (vrais tokens) ; replay.py le remplace
+os.environ.pop("WEBHOOK_BASE", None)
+os.environ.pop("RENDER_EXTERNAL_URL", None)
+isolate_files("loadtest-")  # commandes synthétiques hors de orders.jsonl / analytics.json
+
+_update_ids = itertools.count(1)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(q / 100 * len(s) + 0.5)) - 1))]
+
+
+class Driver:
+    """Envoie des updates au bot (via l'app FastAPI ou directement au Dispatcher)."""
+
+    def __init__(self, via: str):
+        import main
+        import webhook_app
+        self.main, self.app, self.via = main, webhook_app, via
+
+    async def feed(self, body: dict, tenant: str|None = None) -> bool:
+        """tenant : nom de la boutique destinataire (défaut : la première)."""
+        import tenants
+        t = tenants.get(tenant)
+        if t is None:
+            return False
+        if self.via == "asgi":
+            headers = {"X-Telegram-Bot-Api-Secret-Token": t.webhook_secret}
+            status = await asgi_post(self.app.app, f"/webhook/{t.webhook_secret}", json.dumps(body).encode(), headers)
+            return status == 200
+        from aiogram.types import Update
+        try:
+            await self.main.dp.feed_update(t.bot, Update.model_validate(body))
+            return True
+        except Exception:
+            return False
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}"}
+
+
+def message_update(uid: int, text: str) -> dict:
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": next(_update_ids), "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"}, "from": _user(uid), "text": text,
+    }}
+
+
+def callback_update(uid: int, last: dict, data: str) -> dict:
+    msg = {"message_id": last.get("message_id") or 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"}}
+    if last.get("photo"):
+        msg["photo"] = [{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]
+    else:
+        msg["text"] = "…"
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "chat_instance": str(uid), "data": data, "from": _user(uid), "message": msg,
+    }}
+
+
+class Stats:
+    def __init__(self):
+        self.lat: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.abandons: dict[str, int] = {}
+        self.funnels = 0
+        self.updates = 0
+
+
+async def shopper(uid: int, drv: Driver, session, stats: Stats, stop_at: float, rnd: random.Random):
+    from callbacks import unpack
+
+    async def send(step: str, body: dict) -> bool:
+        t0 = time.perf_counter()
+        ok = await drv.feed(body)
+        stats.lat.setdefault(step, []).append(time.perf_counter() - t0)
+        stats.updates += 1
+        if not ok:
+            stats.errors[step] = stats.errors.get(step, 0) + 1
+        return ok
+
+    async def click(step: str, action: str, optional: bool = False) -> bool|None:
+        last = session.last.get(uid, {})
+        choices = [b.callback_data for row in (last.get("keyboard") or []) for b in row
+                   if b.callback_data and unpack(b.callback_data).action == action]
+        if not choices:
+            if not optional:
+                stats.abandons[step] = stats.abandons.get(step, 0) + 1
+            return None
+        return await send(step, callback_update(uid, last, rnd.choice(choices)))
+
+    while time.monotonic() < stop_at:
+        await send("start", message_update(uid, "/start"))
+        if not await click("clubs", "clubs"): continue
+        if not await click("pick_club", "club"): continue
+        if not await click("pick_color", "color"): continue
+        if not await click("color_ok", "color_ok"): continue
+        picked = await click("variant_pick", "variant", optional=True)
+        if picked is False: continue
+        if picked and not await click("variant_ok", "variant_ok"): continue
+        if not await click("size_ok", "size_ok"): continue
+        if not await click("checkout", "checkout:start"): continue
+        if not await click("confirm", "checkout:confirm"): continue
+        if not await send("name", message_update(uid, f"Client {uid}")): continue
+        if not await send("phone", message_update(uid, "0612345678")): continue
+        if await send("finalize_order", message_update(uid, f"{uid} rue du Test, 75000 Paris")):
+            stats.funnels += 1
+
+
+async def run(args) -> dict:
+    book = FakeSpreadsheet(make_catalog(args.products, n_sizes=args.sizes, n_colors=args.colors, n_variants=args.variants),
+                           latency=args.sheets_latency, jitter=args.sheets_jitter, quota_error_rate=args.quota_errors)
+    install_sheets(book)
+    drv = Driver(args.via)
+    session = install_bot(drv.main.bot, latency=args.api_latency, jitter=args.api_jitter)
+    stats = Stats()
+    async with drv.app.lifespan(drv.app.app):
+        t0 = time.monotonic()
+        stop_at = t0 + args.duration
+        await asyncio.gather(*(shopper(10_000 + i, drv, session, stats, stop_at, random.Random(i))
+                               for i in range(args.users)))
+        elapsed = time.monotonic() - t0
+    steps = {}
+    for step, lat in stats.lat.items():
+        steps[step] = {
+            "n": len(lat), "errors": stats.errors.get(step, 0), "abandons": stats.abandons.get(step, 0),
+            "p50_ms": percentile(lat, 50) * 1e3, "p95_ms": percentile(lat, 95) * 1e3, "p99_ms": percentile(lat, 99) * 1e3,
+        }
+    return {
+        "config": vars(args), "elapsed_s": elapsed,
+        "updates": stats.updates, "updates_per_s": stats.updates / elapsed,
+        "funnels": stats.funnels, "funnels_per_s": stats.funnels / elapsed,
+        "bot_api_calls": session.calls, "sheets_calls": dict(book.calls), "steps": steps,
+    }
+
+
+def report(res: dict):
+    print(f"\n{res['updates']} updates en {res['elapsed_s']:.1f}s — {res['updates_per_s']:.1f} updates/s, "
+          f"{res['funnels']} commandes ({res['funnels_per_s']:.2f}/s)")
+    print(f"Bot API: {res['bot_api_calls']} appels — Sheets: {sum(res['sheets_calls'].values())} appels {res['sheets_calls']}\n")
+    print(f"{'étape':<16} {'n':>7} {'err':>5} {'aband.':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    order = ["start", "clubs", "pick_club", "pick_color", "color_ok", "variant_pick", "variant_ok",
+             "size_ok", "checkout", "confirm", "name", "phone", "finalize_order"]
+    for step in sorted(res["steps"], key=lambda s: order.index(s) if s in order else 99):
+        s = res["steps"][step]
+        print(f"{step:<16} {s['n']:>7} {s['errors']:>5} {s['abandons']:>6} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Test de charge du tunnel d'achat (doublures locales)")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=20.0, help="secondes")
+    ap.add_argument("--via", choices=("asgi", "dispatcher"), default="asgi")
+    ap.add_argument("--products", type=int, default=200)
+    ap.add_argument("--sizes", type=int, default=8)
+    ap.add_argument("--colors", type=int, default=2)
+    ap.add_argument("--variants", type=int, default=2)
+    ap.add_argument("--sheets-latency", type=float, default=0.0, help="latence bloquante par appel Sheets (s)")
+    ap.add_argument("--sheets-jitter", type=float, default=0.0)
+    ap.add_argument("--quota-errors", type=float, default=0.0, help="probabilité d'APIError 429 par appel Sheets")
+    ap.add_argument("--api-latency", type=float, default=0.0, help="latence par appel Bot API (s)")
+    ap.add_argument("--api-jitter", type=float, default=0.0)
+    ap.add_argument("--json", help="écrit le résultat brut dans ce fichier")
+    args = ap.parse_args()
+    res = asyncio.run(run(args))
+    report(res)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
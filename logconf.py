@@ -0,0 +1,149 @@
+# logconf.py — journalisation hors du chemin critique
+# Les handlers ne font que déposer l'enregistrement dans une file (QueueHandler) ; un thread (QueueListener)
+# formate et écrit. Enregistrements JSON (une ligne) enrichis du contexte de l'update en cours
+# (update_id, user_id, type, handler) et échantillonnés par type d'update.
+#   LOG_LEVEL        INFO (défaut)
+#   LOG_FORMAT       json (défaut) | text
+#   LOG_SAMPLE       taux par type d'update, ex: "callback_query=0.2,inline_query=0.05" (défaut inline_query=0.1)
+#                    (WARNING et plus : toujours gardés ; la décision est prise une fois par update)
+#   LOG_QUEUE_SIZE   taille max de la file (défaut 10000) ; file pleine => enregistrement abandonné, jamais bloquant
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+def _parse_rates(val: str) -> dict[str, float]:
+    out = {}
+    for part in val.split(","):
+        k, _, v = part.partition("=")
+        try:
+            out[k.strip()] = min(1.0, max(0.0, float(v)))
+        except ValueError:
+            continue
+    return out
+
+
+SAMPLE = _parse_rates(os.getenv("LOG_SAMPLE", "inline_query=0.1"))
+
+# contexte de l'update en cours (dict mutable : les middlewares y ajoutent le handler, l'utilisateur...)
+_ctx: contextvars.ContextVar[dict|None] = contextvars.ContextVar("log_ctx", default=None)
+
+
+def bind(**fields) -> dict:
+    """Ouvre le contexte d'un update (à appeler en tête de traitement). Décide ici de l'échantillonnage."""
+    t = fields.get("type")
+    ctx = dict(fields, _sampled=random.random() < SAMPLE.get(t, 1.0))
+    _ctx.set(ctx)
+    return ctx
+
+
+def current() -> dict|None:
+    return _ctx.get()
+
+
+def annotate(**fields):
+    """Complète le contexte courant (sans effet hors d'un update)."""
+    ctx = _ctx.get()
+    if ctx is not None:
+        ctx.update(fields)
+
+
+# -------- Filtre / format --------
+class _ContextFilter(logging.Filter):
+    """Copie le contexte sur l'enregistrement (côté appelant) et applique l'échantillonnage."""
+
+    def filter(self, record):
+        ctx = _ctx.get()
+        if ctx is None:
+            return True
+        if not ctx["_sampled"] and record.levelno < logging.WARNING:
+            metrics.inc("log_records_dropped_total", reason="sampled")
+            return False
+        record.ctx = {k: v for k, v in ctx.items() if k[0] != "_"}
+        return True
+
+
+_STD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "ctx", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        out.update(getattr(record, "ctx", None) or {})
+        out.update({k: v for k, v in vars(record).items() if k not in _STD})  # extra=...
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _Handler(QueueHandler):
+    """File bornée, jamais bloquante ; le message est figé mais le formatage (JSON, trace) reste au thread."""
+
+    def prepare(self, record):
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total", reason="queue_full")
+
+
+_listeners: list[QueueListener] = []
+
+
+def background(handler: logging.Handler, maxsize: int = QUEUE_SIZE) -> QueueHandler:
+    """Enveloppe un handler (fichier, flux...) : l'écriture se fait dans un thread dédié."""
+    q = queue.Queue(maxsize)
+    listener = QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    metrics.register_gauge("queue_depth", q.qsize, queue=f"log:{handler.__class__.__name__}")
+    return _Handler(q)
+
+
+def setup():
+    """Remplace les handlers du logger racine par la file + thread d'écriture (idempotent)."""
+    root = logging.getLogger()
+    if any(isinstance(h, _Handler) for h in root.handlers):
+        return
+    out = logging.StreamHandler(sys.stderr)
+    if FORMAT == "json":
+        out.setFormatter(JsonFormatter())
+    else:
+        out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s %(ctx)s", defaults={"ctx": ""}))
+    qh = background(out)
+    qh.addFilter(_ContextFilter())
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(LEVEL)
+    # "Update id=... is handled" : remplacé par l'enregistrement "update" de middlewares.LogContext
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+
+def shutdown():
+    """Vide les files et arrête les threads (appelé à l'arrêt, et via atexit)."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(shutdown)
@@ -4,70 +4,91 @@
 
 import os
 import asyncio
+import logging
 import time
-import urllib.parse
 from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, InlineQuery,
+    InlineQueryResultPhoto, InlineQueryResultArticle, InputTextMessageContent,
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton,
-    InputMediaPhoto
+    InputMediaPhoto, BufferedInputFile
 )
 from aiogram.exceptions import TelegramBadRequest
+from aiogram.utils.backoff import BackoffConfig
 from dotenv import load_dotenv
 
 from sheets import (
-    list_clubs, list_products, get_product,
+    list_clubs, list_seasons, list_products, get_product, get_product_at, catalog_version,
     get_image_for, get_price_for, get_variants_for,
     get_sizes_for, get_stock_for, get_stock_sizes, sum_stock_for,
     append_order
 )
 from models import carts, add_to_cart, remove_from_cart, empty_cart, cart_total_cents
+from callbacks import CallbackRouter, Payload, unpack
+from search import search
+from middlewares import (
+    HandlerMetrics, BotApiMetrics, LogContext, ConcurrencyLimit, UpdateCounter, Deadline, AnsweredCallbacks, TenantContext
+)
+import analytics
+import deadline
+import logconf
+import metrics
+import orders
+import restock
+import pools
+import profiler
+import sheets
+import tenants
 
 # ------------------ Config ------------------
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"))
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN manquant")
-
-def _parse_admins(s: str | None):
-    out = []
-    for x in (s or "").split(","):
-        x = x.strip()
-        if not x:
-            continue
-        try:
-            out.append(int(x))
-        except Exception:
-            pass
-    return out
-
-ADMINS = _parse_admins(os.getenv("ADMINS", ""))
-ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "").lstrip("@").strip()
+# Boutiques servies (tenants.py) : BOT_TOKEN, SHEET_ID, ADMINS, ADMIN_USERNAME, PAYPAL_ME, ou TENANTS (JSON).
+# Admins, lien PayPal, bot, classeur, paniers... sont ceux de la boutique de l'update en cours.
+TENANTS = tenants.all_tenants()
+for _t in TENANTS:
+    if not _t.bot_token:
+        raise RuntimeError("BOT_TOKEN manquant" + (f" (boutique {_t.name})" if len(TENANTS) > 1 else ""))
 
-PAYPAL_ME = os.getenv("PAYPAL_ME", "").strip().replace("https://paypal.me/", "").replace("paypal.me/", "").lstrip("/")
 def paypal_link(order_id: int, total_cents: int):
-    if not PAYPAL_ME:
+    paypal_me = tenants.current().paypal_me
+    if not paypal_me:
         return None
-    return f"https://www.paypal.me/{PAYPAL_ME}/{total_cents/100:.2f}"
+    return f"https://www.paypal.me/{paypal_me}/{total_cents/100:.2f}"
 
-bot = Bot(BOT_TOKEN)
+# un Bot par boutique sur une seule session HTTP (pool partagé) ; un seul Dispatcher pour tous
+_session = pools.bot_session()
+for _t in TENANTS:
+    _t.bot = Bot(_t.bot_token, session=_session)
+bot = TENANTS[0].bot  # boutique par défaut (mono-boutique, outils de test)
 dp = Dispatcher()
+cbr = CallbackRouter(version=catalog_version)  # tous les callbacks passent par ici (voir on_callback)
+dp.update.outer_middleware(TenantContext())  # en premier : tout le reste dépend de la boutique
+dp.update.outer_middleware(LogContext())
+dp.update.outer_middleware(Deadline())  # budget par update (deadline.py)
+dp.message.middleware(HandlerMetrics())
+dp.inline_query.middleware(HandlerMetrics())
+bot.session.middleware(BotApiMetrics())
+bot.session.middleware(AnsweredCallbacks())  # callbacks "render" acquittés d'avance par cbr
+
+# callback_data des boutons statiques (non datés)
+CB_HELP, CB_CLUBS, CB_CART, CB_CHECKOUT = (cbr.data(a) for a in ("help", "clubs", "cart:view", "checkout:start"))
 
 # État simple en mémoire pour le checkout
-checkout: dict[int, dict] = {}  # uid -> {"_active": True/False, "_stage": "confirm|name|phone|address", "name":..., "phone":..., "address":...}
+checkout = tenants.scoped(dict)  # uid -> {"_active": True/False, "_stage": "confirm|name|phone|address", "name":..., "phone":..., "address":...}
 
 # ------------------ Utils UI ------------------
 def money(cents: int) -> str:
     return f"{int(cents)/100:.2f} €"
 
 def support_url():
-    if ADMIN_USERNAME:
-        return f"https://t.me/{ADMIN_USERNAME}"
-    for a in ADMINS:
+    t = tenants.current()
+    if t.admin_username:
+        return f"https://t.me/{t.admin_username}"
+    for a in t.admins:
         if a > 0:
             return f"tg://user?id={a}"
     return None
@@ -76,7 +97,11 @@ def kb_support_row():
     url = support_url()
     if url:
         return [InlineKeyboardButton(text="🆘 Aide", url=url)]
-    return [InlineKeyboardButton(text="🆘 Aide", callback_data="help")]
+    return [InlineKeyboardButton(text="🆘 Aide", callback_data=CB_HELP)]
+
+def _not_modified(e: TelegramBadRequest) -> bool:
+    # double clic : le message affiche déjà cet état, ce n'est pas un échec
+    return "message is not modified" in str(e)
 
 async def safe_edit(ev, text: str, reply_markup=None, parse_mode="Markdown"):
     """Édite si possible, sinon envoie un nouveau message."""
@@ -89,12 +114,38 @@ async def safe_edit(ev, text: str, reply_markup=None, parse_mode="Markdown"):
             await m.edit_caption(caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
         else:
             await m.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
-    except TelegramBadRequest:
-        await m.answer(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if not _not_modified(e):
+            await m.answer(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+async def render_error(cb: CallbackQuery, text: str):
+    """Erreur d'une route "render" (coalesce=True) : le callback est déjà acquitté par le routeur, une alerte
+    cb.answer() serait ignorée (callbacks.py) ; le message du bouton l'affiche à la place."""
+    await safe_edit(cb, f"⚠️ {text}", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)], kb_support_row()]))
+
+async def show_card(ev, caption: str, kb, img: str|None = None):
+    """Affiche une fiche produit : remplace le média du message du callback (ou répond au Message).
+    Budget de l'update presque épuisé : texte seul (la photo est le plus lent des appels)."""
+    if img and not deadline.enough(deadline.PHOTO_MIN):
+        deadline.fallback("photo_as_text")
+        img = None
+    if isinstance(ev, Message):
+        if img:
+            try:
+                await ev.answer_photo(img, caption=caption, parse_mode="Markdown", reply_markup=kb); return
+            except TelegramBadRequest:
+                pass
+        await ev.answer(caption, parse_mode="Markdown", reply_markup=kb); return
+    try:
+        if img: await ev.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown"), reply_markup=kb)
+        else:   await safe_edit(ev, caption, kb)
+    except TelegramBadRequest as e:
+        if not _not_modified(e):
+            await safe_edit(ev, caption, kb)
 
 def clubs_kb():
-    rows = [[InlineKeyboardButton(text=c, callback_data=f"club:{urllib.parse.quote(c)}")] for c in list_clubs()]
-    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")])
+    rows = [[InlineKeyboardButton(text=c, callback_data=cbr.data("club", pi=i))] for i, c in enumerate(list_clubs())]
+    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)])
     rows.append(kb_support_row())
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
@@ -158,18 +209,38 @@ def _variant_total_stock(p, color, variant):
 def _sizes_for(p, color, variant):
     return get_sizes_for(p, color=color, variant=variant) or []
 
+# ------------------ Callbacks (point d'entrée unique) ------------------
+@dp.callback_query()
+async def on_callback(cb: CallbackQuery):
+    await cbr.dispatch(cb)
+
 # ------------------ Commands ------------------
+@dp.message(CommandStart(deep_link=True))
+async def start_deep_link(m: Message, command: CommandObject):
+    """/start <payload> : lien profond depuis la recherche inline, ouvre directement le choix de taille."""
+    cp = unpack(command.args)
+    p = get_product_at(cp.pi) if cp.action == "variant_ok" and cp.ver == catalog_version() else None
+    color = _color_by_index(p, cp.ci) if p else None
+    if not color:
+        await m.answer("Ce lien a expiré (catalogue mis à jour). Choisis ton *club* :", parse_mode="Markdown", reply_markup=clubs_kb())
+        return
+    variants = _variants_for_color(p, color)
+    variant = variants[cp.vi] if 0 <= cp.vi < len(variants) else None
+    if variants and not variant:
+        await ask_variant(m, p, color=color); return
+    await ask_size(m, p, color=color, variant=variant, vi=cp.vi if variant else None)
+
 @dp.message(CommandStart())
 async def start(m: Message):
-    if m.from_user.id in ADMINS:
+    if m.from_user.id in tenants.current().admins:
         await m.answer("✅ Admin reconnu. Vous recevrez les notifications.")
     await m.answer(
         "🏟️ *Bienvenue !*\nParcours : Club → Coloris → *Validation* → Variante → *Taille* → Panier → *Récap* → Paiement.\n\n"
         "• /catalogue — Clubs\n• /panier — Voir le panier\n• /commander — Finaliser",
         parse_mode="Markdown",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🛒 Ouvrir le catalogue", callback_data="clubs")],
-            [InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")],
+            [InlineKeyboardButton(text="🛒 Ouvrir le catalogue", callback_data=CB_CLUBS)],
+            [InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)],
             kb_support_row()
         ])
     )
@@ -186,8 +257,88 @@ async def cmd_cart(m: Message):
 async def cmd_order(m: Message):
     await start_checkout(m.from_user.id, m)
 
-@dp.callback_query(F.data == "help")
-async def cb_help(cb: CallbackQuery):
+@dp.message(Command("commande"))
+async def cmd_order_lookup(m: Message, command: CommandObject):
+    """Admin : /commande <id> — lu dans l'index local (orders.py), sans appel Sheets."""
+    if m.from_user.id not in tenants.current().admins:
+        return
+    oid = (command.args or "").strip().lstrip("#")
+    found = orders.get(oid) if oid else []
+    if not found:
+        await m.answer("Usage : /commande <id>" if not oid else f"Commande #{oid} introuvable.")
+        return
+    for o in found:
+        lines = [f"📦 Commande #{o['order_id']} — {o.get('timestamp', '')} — {o.get('status', '')}",
+                 f"{o.get('name', '')} — {o.get('phone', '')} (id {o.get('user_id', '')})",
+                 f"Adresse: {o.get('address', '')}"]
+        for it in o.get("items_json") or []:
+            qty = int(it.get("qty", 1))
+            lines.append(f"• {it.get('club', '')} • {it.get('color') or '—'} • {it.get('variant') or '—'} • "
+                         f"T.{it.get('size', '')} x{qty} — {money(int(it.get('price_cents', 0)) * qty)}")
+        lines.append(f"Total: {money(int(o.get('total_cents') or 0))}")
+        await m.answer("\n".join(lines))
+
+@dp.message(Command("stats"))
+async def cmd_stats(m: Message):
+    """Admin : agrégats de ventes (analytics.py)."""
+    if m.from_user.id not in tenants.current().admins:
+        return
+    s = await asyncio.to_thread(analytics.summary, 5)  # relit le stock (Sheets) : hors boucle
+    lines = [f"📊 {s['orders']} commandes — {s['units']} articles — {money(s['revenue_cents'])}",
+             f"Aujourd'hui : {s['today']['orders']} commandes — {money(s['today']['revenue_cents'])}", "", "Clubs :"]
+    lines += [f"• {club} — {units} u. — {money(rev)}" for club, units, rev in s["clubs"]]
+    lines += ["", "Déclinaisons (id|coloris|variante|taille) :"]
+    lines += [f"• {key} — {units} u. — {money(rev)}" for key, units, rev in s["items"]]
+    lines += ["", "Écoulement (vendu / vendu+stock) :"]
+    lines += [f"• {r['item']} — {r['sold']} vendus, {r['stock']} en stock — {r['sell_through']:.0%}" for r in s["sell_through"]]
+    if s["hours"]:
+        lines += ["", "Dernières heures : " + ", ".join(f"{h[11:]}h:{n}" for h, n in s["hours"][-8:])]
+    await m.answer("\n".join(lines))
+
+@dp.message(Command("profile"))
+async def cmd_profile(m: Message, command: CommandObject):
+    """Admin : /profile [sample|cprofile] [N | Ts] — profile les N prochains updates (ou T secondes), puis envoie
+    le résumé par handler et le fichier ; /profile stop pour arrêter avant (profiler.py)."""
+    t = tenants.current()
+    if m.from_user.id not in t.admins:
+        return
+    args = (command.args or "").lower().split()
+    if args[:1] == ["stop"]:
+        if profiler.stop() is None:
+            await m.answer("Aucun profilage en cours.")
+        return
+    mode = args.pop(0) if args and args[0] in profiler.MODES else "sample"
+    updates = seconds = None
+    try:
+        if args and args[0].endswith("s"):
+            seconds = float(args[0][:-1])
+        elif args:
+            updates = int(args[0])
+    except ValueError:
+        await m.answer("Usage : /profile [sample|cprofile] [N | Ts] — ou /profile stop")
+        return
+    uid = m.from_user.id
+    if not profiler.start(dp, mode, updates=updates, seconds=seconds,
+                          on_done=lambda res: deadline.defer(send_profile(t, uid, res))):
+        await m.answer("Un profilage est déjà en cours (/profile stop pour l'arrêter).")
+        return
+    st = profiler.status()["running"]
+    await m.answer(f"⏱ Profilage {mode} lancé : {st['max_updates'] or '∞'} updates, {st['max_seconds']:g} s max.")
+
+async def send_profile(t: tenants.Tenant, uid: int, res: dict):
+    """Fin de session : temps par handler + fichier (.prof ou piles repliées pour flamegraph)."""
+    lines = [f"⏱ Profil {res['mode']} — {res['updates']} updates en {res['seconds']:g} s (arrêt : {res['reason']})"]
+    lines += [f"• {h['handler']} — {h['count']}× — moy. {h['avg_ms']} ms, max {h['max_ms']} ms"
+              + (f", {h['samples']} éch." if "samples" in h else "") for h in res["handlers"][:15]]
+    try:
+        await t.bot.send_message(uid, "\n".join(lines))
+        if res["data"]:
+            await t.bot.send_document(uid, BufferedInputFile(res["data"], filename=res["filename"]))
+    except Exception as e:
+        logging.warning("envoi du profil impossible: %s", e)
+
+@cbr.on("help")
+async def cb_help(cb: CallbackQuery, cp: Payload):
     url = support_url()
     if url:
         await cb.message.answer("Besoin d’aide ? Ouvre la conversation :", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Contacter", url=url)]]))
@@ -195,52 +346,63 @@ async def cb_help(cb: CallbackQuery):
         await cb.message.answer("Besoin d’aide ? Utilise /help")
 
 # ------------------ Catalogue ------------------
-@dp.callback_query(F.data == "clubs")
-async def back_clubs(cb: CallbackQuery):
+@cbr.on("clubs")
+async def back_clubs(cb: CallbackQuery, cp: Payload):
     await cb.message.answer("Choisis ton *club* :", parse_mode="Markdown", reply_markup=clubs_kb())
 
-@dp.callback_query(F.data.startswith("club:"))
-async def pick_club(cb: CallbackQuery):
-    club = urllib.parse.unquote(cb.data.split(":", 1)[1])
-    prods = list_products(club=club)
+@cbr.on("club", coalesce=True)
+async def pick_club(cb: CallbackQuery, cp: Payload):
+    # pi = club, ci = saison (-1 = toutes), pg = maillot affiché dans la tranche club/saison
+    clubs = list_clubs()
+    club = clubs[cp.pi] if 0 <= cp.pi < len(clubs) else None
+    seasons = list_seasons(club) if club else []
+    season = seasons[cp.ci] if 0 <= cp.ci < len(seasons) else None
+    prods = list_products(club=club, season=season) if club else []
     if not prods:
-        await safe_edit(cb, "Aucun maillot trouvé pour ce club.", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")], kb_support_row()]))
+        await safe_edit(cb, "Aucun maillot trouvé pour ce club.", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)], kb_support_row()]))
         return
-    p = prods[0]
+    page = min(max(cp.pg, 0), len(prods) - 1)
+    p = prods[page]  # seule la fiche affichée est construite (prix, image)
     colors = _colors(p)
     minp = min_price_for_product(p)
     price_line = f"Prix: {money(minp)}" if minp == int(p.get("price_cents", 0)) else f"Prix: à partir de {money(minp)}"
     caption = (
-        f"*{p['name']}* — {p['club']}\n"
+        f"*{p['name']}* — {p['club']}{' ' + p['season'] if p.get('season') else ''}\n"
         f"{price_line}\n"
         f"Coloris: {', '.join(colors) if colors else '—'}"
+        + (f"\n\nMaillot {page + 1}/{len(prods)}" if len(prods) > 1 else "")
     )
-    rows = [[InlineKeyboardButton(text=c, callback_data=f"color:{p['id']}:{urllib.parse.quote(c)}")] for c in colors] \
-           or [[InlineKeyboardButton(text="Passer (pas de coloris)", callback_data=f"color:{p['id']}:")]]
-    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")])
-    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")])
+    rows = [[InlineKeyboardButton(text=c, callback_data=cbr.data("color", pi=p["idx"], ci=ci))] for ci, c in enumerate(colors)] \
+           or [[InlineKeyboardButton(text="Passer (pas de coloris)", callback_data=cbr.data("color", pi=p["idx"]))]]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Précédent", callback_data=cbr.data("club", pi=cp.pi, ci=cp.ci, pg=page - 1)))
+    if page + 1 < len(prods):
+        nav.append(InlineKeyboardButton(text="Suivant ▶️", callback_data=cbr.data("club", pi=cp.pi, ci=cp.ci, pg=page + 1)))
+    nav and rows.append(nav)
+    if len(seasons) > 1:
+        # filtres saison (la saison courante n'est pas proposée)
+        opts = [(si, s) for si, s in enumerate(seasons) if si != cp.ci]
+        if season:
+            opts.insert(0, (-1, "Toutes saisons"))
+        for chunk in _chunk(opts, 3):
+            rows.append([InlineKeyboardButton(text=f"📅 {s}", callback_data=cbr.data("club", pi=cp.pi, ci=si)) for si, s in chunk])
+    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)])
+    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)])
     rows.append(kb_support_row())
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
     img = get_image_for(p, None, None)
-    if img:
-        try:
-            await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        except TelegramBadRequest:
-            await safe_edit(cb, caption, kb)
-    else:
-        await safe_edit(cb, caption, kb)
+    await show_card(cb, caption, kb, img)
 
 # ---------- Étape Coloris -> Validation ----------
-@dp.callback_query(F.data.startswith("color:"))
-async def pick_color(cb: CallbackQuery):
-    _, pid_str, color_enc = cb.data.split(":")
-    pid = int(pid_str)
-    color = urllib.parse.unquote(color_enc) if color_enc else None
-    p = get_product(pid)
+@cbr.on("color", coalesce=True)
+async def pick_color(cb: CallbackQuery, cp: Payload):
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
+    color = _color_by_index(p, cp.ci)
     if not color:
-        await cb.answer("Choisis d’abord un coloris.", show_alert=True); return
+        await render_error(cb, "Choisis d’abord un coloris."); return
 
     caption = (
         f"*{p['name']}* ({p['club']})\n"
@@ -248,49 +410,39 @@ async def pick_color(cb: CallbackQuery):
         f"✔️ Valide le coloris ou change avant de continuer."
     )
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Valider ce coloris", callback_data=f"color_ok:{pid}:{urllib.parse.quote(color)}")],
-        [InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=f"color_change:{pid}")],
-        [InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")],
-        [InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")],
+        [InlineKeyboardButton(text="✅ Valider ce coloris", callback_data=cbr.data("color_ok", pi=cp.pi, ci=cp.ci))],
+        [InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=cbr.data("color_change", pi=cp.pi))],
+        [InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)],
+        [InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)],
         kb_support_row()
     ])
     img = get_image_for(p, color=color, variant=None)
-    try:
-        if img: await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        else:   await safe_edit(cb, caption, kb)
-    except TelegramBadRequest:
-        await safe_edit(cb, caption, kb)
-
-@dp.callback_query(F.data.startswith("color_change:"))
-async def color_change(cb: CallbackQuery):
-    _, pid_str = cb.data.split(":")
-    pid = int(pid_str)
-    p = get_product(pid)
+    await show_card(cb, caption, kb, img)
+
+@cbr.on("color_change", coalesce=True)
+async def color_change(cb: CallbackQuery, cp: Payload):
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
     colors = _colors(p)
     caption = f"*{p['name']}* — {p['club']}\nSélectionne un *coloris* :"
-    rows = [[InlineKeyboardButton(text=c, callback_data=f"color:{p['id']}:{urllib.parse.quote(c)}")] for c in colors] \
-           or [[InlineKeyboardButton(text="Passer (pas de coloris)", callback_data=f"color:{p['id']}:")]]
-    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")])
-    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")])
+    rows = [[InlineKeyboardButton(text=c, callback_data=cbr.data("color", pi=p["idx"], ci=ci))] for ci, c in enumerate(colors)] \
+           or [[InlineKeyboardButton(text="Passer (pas de coloris)", callback_data=cbr.data("color", pi=p["idx"]))]]
+    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)])
+    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)])
     rows.append(kb_support_row())
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
     img = get_image_for(p, None, None)
-    try:
-        if img: await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        else:   await safe_edit(cb, caption, kb)
-    except TelegramBadRequest:
-        await safe_edit(cb, caption, kb)
-
-@dp.callback_query(F.data.startswith("color_ok:"))
-async def color_ok(cb: CallbackQuery):
-    _, pid_str, color_enc = cb.data.split(":")
-    pid = int(pid_str)
-    color = urllib.parse.unquote(color_enc)
-    p = get_product(pid)
+    await show_card(cb, caption, kb, img)
+
+@cbr.on("color_ok", coalesce=True)
+async def color_ok(cb: CallbackQuery, cp: Payload):
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
+    color = _color_by_index(p, cp.ci)
+    if not color:
+        await render_error(cb, "Option expirée. Reviens au coloris."); return
 
     variants = _variants_for_color(p, color)
     if variants:
@@ -298,7 +450,7 @@ async def color_ok(cb: CallbackQuery):
     await ask_size(cb, p, color=color, variant=None)
 
 # ---------- Étape Variante (affiche stock total + prix) ----------
-async def ask_variant(cb: CallbackQuery, p: dict, color: str):
+async def ask_variant(ev: CallbackQuery | Message, p: dict, color: str):
     variants = _variants_for_color(p, color)
     caption = (
         f"*{p['name']}* — {p['club']}\n"
@@ -311,31 +463,26 @@ async def ask_variant(cb: CallbackQuery, p: dict, color: str):
         price = get_price_for(p, v, color)
         tot = _variant_total_stock(p, color, v)
         label = f"{v} — {money(price)} • Stock: {tot}"
-        rows.append([InlineKeyboardButton(text=label, callback_data=f"variant_i:{p['id']}:{ci}:{vi}")])
-    rows.append([InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=f"color_change:{p['id']}")])
-    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")])
-    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")])
+        rows.append([InlineKeyboardButton(text=label, callback_data=cbr.data("variant", pi=p["idx"], ci=ci, vi=vi))])
+    rows.append([InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=cbr.data("color_change", pi=p["idx"]))])
+    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)])
+    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)])
     rows.append(kb_support_row())
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
 
     img = get_image_for(p, color=color, variant=None)
-    try:
-        if img: await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        else:   await safe_edit(cb, caption, kb)
-    except TelegramBadRequest:
-        await safe_edit(cb, caption, kb)
-
-@dp.callback_query(F.data.startswith("variant_i:"))
-async def variant_pick(cb: CallbackQuery):
-    _, pid_str, ci_str, vi_str = cb.data.split(":")
-    pid = int(pid_str); ci = int(ci_str); vi = int(vi_str)
-    p = get_product(pid)
+    await show_card(ev, caption, kb, img)
+
+@cbr.on("variant", coalesce=True)
+async def variant_pick(cb: CallbackQuery, cp: Payload):
+    ci, vi = cp.ci, cp.vi
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
     color = _color_by_index(p, ci)
     variants = _variants_for_color(p, color)
     if not color or not (0 <= vi < len(variants)):
-        await cb.answer("Option expirée. Reviens au coloris.", show_alert=True); return
+        await render_error(cb, "Option expirée. Reviens au coloris."); return
     variant = variants[vi]
     price = get_price_for(p, variant, color)
     tot = _variant_total_stock(p, color, variant)
@@ -348,52 +495,46 @@ async def variant_pick(cb: CallbackQuery):
         f"✔️ Valide la variante ou change."
     )
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Valider cette variante", callback_data=f"variant_ok_i:{p['id']}:{ci}:{vi}")],
-        [InlineKeyboardButton(text="🔁 Changer de variante", callback_data=f"variant_change_i:{p['id']}:{ci}")],
-        [InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=f"color_change:{p['id']}")],
-        [InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")],
-        [InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")],
+        [InlineKeyboardButton(text="✅ Valider cette variante", callback_data=cbr.data("variant_ok", pi=p["idx"], ci=ci, vi=vi))],
+        [InlineKeyboardButton(text="🔁 Changer de variante", callback_data=cbr.data("variant_change", pi=p["idx"], ci=ci))],
+        [InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=cbr.data("color_change", pi=p["idx"]))],
+        [InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)],
+        [InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)],
         kb_support_row()
     ])
     img = get_image_for(p, color=color, variant=variant)
-    try:
-        if img: await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        else:   await safe_edit(cb, caption, kb)
-    except TelegramBadRequest:
-        await safe_edit(cb, caption, kb)
-
-@dp.callback_query(F.data.startswith("variant_change_i:"))
-async def variant_change(cb: CallbackQuery):
-    _, pid_str, ci_str = cb.data.split(":")
-    pid = int(pid_str); ci = int(ci_str)
-    p = get_product(pid)
+    await show_card(cb, caption, kb, img)
+
+@cbr.on("variant_change", coalesce=True)
+async def variant_change(cb: CallbackQuery, cp: Payload):
+    ci = cp.ci
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
     color = _color_by_index(p, ci)
     if not color:
-        await cb.answer("Option expirée. Reviens au coloris.", show_alert=True); return
+        await render_error(cb, "Option expirée. Reviens au coloris."); return
     await ask_variant(cb, p, color=color)
 
-@dp.callback_query(F.data.startswith("variant_ok_i:"))
-async def variant_ok(cb: CallbackQuery):
-    _, pid_str, ci_str, vi_str = cb.data.split(":")
-    pid = int(pid_str); ci = int(ci_str); vi = int(vi_str)
-    p = get_product(pid)
+@cbr.on("variant_ok", coalesce=True)
+async def variant_ok(cb: CallbackQuery, cp: Payload):
+    ci, vi = cp.ci, cp.vi
+    p = get_product_at(cp.pi)
     if not p:
-        await cb.answer("Indisponible", show_alert=True); return
+        await render_error(cb, "Indisponible"); return
     color = _color_by_index(p, ci)
     variants = _variants_for_color(p, color)
     if not color or not (0 <= vi < len(variants)):
-        await cb.answer("Option expirée. Reviens au coloris.", show_alert=True); return
+        await render_error(cb, "Option expirée. Reviens au coloris."); return
     variant = variants[vi]
     await ask_size(cb, p, color=color, variant=variant, vi=vi)
 
 # ---------- Étape TAILLE (boutons avec stock ; 0 => inactif) ----------
-async def ask_size(cb: CallbackQuery, p: dict, color: str, variant: str | None, vi: int | None = None):
+async def ask_size(ev: CallbackQuery | Message, p: dict, color: str, variant: str | None, vi: int | None = None):
     sizes = _sizes_for(p, color, variant)
     stock = get_stock_for(p, color, variant) if variant else {}
     if not sizes:
-        await cb.message.answer("Ce couple coloris/variante n'a pas de tailles configurées dans *Stock*.", parse_mode="Markdown")
+        await (ev.message if isinstance(ev, CallbackQuery) else ev).answer("Ce couple coloris/variante n'a pas de tailles configurées dans *Stock*.", parse_mode="Markdown")
         return
     caption = (
         f"*{p['name']}* — {p['club']}\n"
@@ -409,40 +550,78 @@ async def ask_size(cb: CallbackQuery, p: dict, color: str, variant: str | None,
     if vi is None:
         vi = -1  # pas de variante
 
-    # 3 colonnes max
+    # 3 colonnes max ; taille à 0 => 🔔 alerte de retour en stock (✅ si déjà demandée)
+    uid = ev.from_user.id
+    alerts = restock.subscribed([restock.key(p["id"], color, variant, s) for s in sizes if int(stock.get(s, 0)) <= 0],
+                                uid) if variant else set()
     for row in _chunk(list(enumerate(sizes)), 3):
         btns = []
         for si, s in row:
             q = int(stock.get(s, 0))
-            label = f"{s} ({q})" if q > 0 else f"{s} (0)"
-            cbdata = f"size_ok_i:{p['id']}:{ci}:{vi}:{si}" if q > 0 else f"size_na_i:{p['id']}:{ci}:{vi}:{si}"
+            if q > 0:
+                label, action = f"{s} ({q})", "size_ok"
+            elif variant:
+                subscribed = restock.key(p["id"], color, variant, s) in alerts
+                label, action = f"{s} (0) {'✅' if subscribed else '🔔'}", "notify"
+            else:
+                label, action = f"{s} (0)", "size_na"
+            cbdata = cbr.data(action, pi=p["idx"], ci=ci, vi=vi, si=si)
             btns.append(InlineKeyboardButton(text=label, callback_data=cbdata))
         btns and rows.append(btns)
 
     if vi >= 0:
-        rows.append([InlineKeyboardButton(text="🔁 Changer de variante", callback_data=f"variant_change_i:{p['id']}:{ci}")])
-    rows.append([InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=f"color_change:{p['id']}")])
-    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")])
-    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")])
+        rows.append([InlineKeyboardButton(text="🔁 Changer de variante", callback_data=cbr.data("variant_change", pi=p["idx"], ci=ci))])
+    rows.append([InlineKeyboardButton(text="🔁 Changer de coloris", callback_data=cbr.data("color_change", pi=p["idx"]))])
+    rows.append([InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)])
+    rows.append([InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)])
     rows.append(kb_support_row())
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
 
     img = get_image_for(p, color=color, variant=variant)
-    try:
-        if img: await cb.message.edit_media(InputMediaPhoto(media=img, caption=caption, parse_mode="Markdown")); await cb.message.edit_reply_markup(reply_markup=kb)
-        else:   await safe_edit(cb, caption, kb)
-    except TelegramBadRequest:
-        await safe_edit(cb, caption, kb)
+    await show_card(ev, caption, kb, img)
 
-@dp.callback_query(F.data.startswith("size_na_i:"))
-async def size_na(cb: CallbackQuery):
+@cbr.on("size_na")
+async def size_na(cb: CallbackQuery, cp: Payload):
     await cb.answer("Cette taille est en rupture (0).", show_alert=True)
 
-@dp.callback_query(F.data.startswith("size_ok_i:"))
-async def size_ok(cb: CallbackQuery):
-    _, pid_str, ci_str, vi_str, si_str = cb.data.split(":")
-    pid = int(pid_str); ci = int(ci_str); vi = int(vi_str); si = int(si_str)
+@cbr.on("notify")
+async def size_notify(cb: CallbackQuery, cp: Payload):
+    p = get_product_at(cp.pi)
+    color = _color_by_index(p, cp.ci) if p else None
+    variants = _variants_for_color(p, color) if color else []
+    variant = variants[cp.vi] if 0 <= cp.vi < len(variants) else None
+    sizes = _sizes_for(p, color, variant) if variant else []
+    if not (0 <= cp.si < len(sizes)):
+        await cb.answer("Option expirée. Reviens au coloris.", show_alert=True); return
+    size = sizes[cp.si]
+    if int(get_stock_for(p, color, variant).get(size, 0)) > 0:
+        await cb.answer(f"Bonne nouvelle : la taille {size} est de nouveau disponible !", show_alert=True)
+    else:
+        res = restock.toggle(restock.key(p["id"], color, variant, size), cb.from_user.id)
+        if res is None:
+            await cb.answer("Tu as déjà trop d'alertes en cours.", show_alert=True); return
+        await cb.answer(f"🔔 On te prévient dès que la taille {size} revient en stock." if res
+                        else "Alerte retirée.", show_alert=res)
+    await ask_size(cb, p, color=color, variant=variant, vi=cp.vi)
+
+async def send_restock(user_id: int, key: tuple, qty: int):
+    """Message d'alerte réassort (appelé par restock.py, à débit limité)."""
+    pid, color_n, variant_n, size = key
     p = get_product(pid)
+    color = next((c for c in _colors(p) if c.strip().lower() == color_n), None) if p else None
+    variants = _variants_for_color(p, color) if color else []
+    vi = next((i for i, v in enumerate(variants) if v.strip().lower() == variant_n), -1)
+    if not p or not color or vi < 0:
+        return  # produit retiré du catalogue entre-temps
+    text = f"🔔 De retour en stock : *{p['name']}* — {color} • {variants[vi]} • T.{size} ({qty} dispo)"
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text="📏 Voir les tailles", callback_data=cbr.data("variant_ok", pi=p["idx"], ci=_color_index(p, color), vi=vi))]])
+    await tenants.current().bot.send_message(user_id, text, parse_mode="Markdown", reply_markup=kb)
+
+@cbr.on("size_ok")
+async def size_ok(cb: CallbackQuery, cp: Payload):
+    ci, vi, si = cp.ci, cp.vi, cp.si
+    p = get_product_at(cp.pi)
     if not p:
         await cb.answer("Indisponible", show_alert=True); return
 
@@ -470,22 +649,48 @@ async def size_ok(cb: CallbackQuery):
 
     await cb.message.answer(f"✅ Ajouté: {item['club']} • {item['color']} • {item['variant'] or '—'} • T.{item['size']} — {money(item['price_cents'])}")
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Continuer", callback_data="clubs"), InlineKeyboardButton(text="📦 Panier", callback_data="cart:view")],
-        [InlineKeyboardButton(text="✅ Commander", callback_data="checkout:start")],
+        [InlineKeyboardButton(text="➕ Continuer", callback_data=CB_CLUBS), InlineKeyboardButton(text="📦 Panier", callback_data=CB_CART)],
+        [InlineKeyboardButton(text="✅ Commander", callback_data=CB_CHECKOUT)],
         kb_support_row()
     ])
     await cb.message.answer("Que souhaites-tu faire ?", reply_markup=kb)
 
+# ------------------ Recherche inline (@bot maillot psg bleu) ------------------
+@dp.inline_query()
+async def inline_search(q: InlineQuery):
+    offset = int(q.offset) if (q.offset or "").isdigit() else 0
+    docs, nxt = search(q.query, offset=offset)
+    me = await q.bot.me()
+    results = []
+    for d in docs:
+        link = f"https://t.me/{me.username}?start={cbr.data('variant_ok', pi=d.pi, ci=d.ci, vi=d.vi)}"
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📏 Choisir ma taille", url=link)]])
+        rid = f"{d.pi}-{d.ci}-{d.vi}"
+        text = f"*{d.title}*\n{d.description}"
+        if d.image:
+            results.append(InlineQueryResultPhoto(
+                id=rid, photo_url=d.image, thumbnail_url=d.thumb or d.image,
+                title=d.title, description=d.description,
+                caption=text, parse_mode="Markdown", reply_markup=kb
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=rid, title=d.title, description=d.description,
+                input_message_content=InputTextMessageContent(message_text=text, parse_mode="Markdown"),
+                reply_markup=kb
+            ))
+    await q.answer(results, cache_time=30, is_personal=False, next_offset=str(nxt) if nxt >= 0 else "")
+
 # ------------------ Panier ------------------
-@dp.callback_query(F.data == "cart:view")
-async def cart_view_cb(cb: CallbackQuery):
+@cbr.on("cart:view", coalesce=True)
+async def cart_view_cb(cb: CallbackQuery, cp: Payload):
     await cart_view(cb)
 
 async def cart_view(ev):
     uid = ev.from_user.id
     items = carts[uid]
     if not items:
-        await safe_edit(ev, "Panier vide.", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Clubs", callback_data="clubs")], kb_support_row()]))
+        await safe_edit(ev, "Panier vide.", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Clubs", callback_data=CB_CLUBS)], kb_support_row()]))
         return
     lines = ["🧺 *Panier*"]
     for i, it in enumerate(items, start=1):
@@ -495,19 +700,19 @@ async def cart_view(ev):
         lines.append(f"{base} x{qty} – {money(price)}")
     lines.append(f"\nTotal: *{money(cart_total_cents(uid))}*")
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➖ Retirer 1er", callback_data="cart:rm0"), InlineKeyboardButton(text="🗑 Vider", callback_data="cart:empty")],
-        [InlineKeyboardButton(text="➕ Continuer", callback_data="clubs"), InlineKeyboardButton(text="✅ Commander", callback_data="checkout:start")],
+        [InlineKeyboardButton(text="➖ Retirer 1er", callback_data=cbr.data("cart:rm0")), InlineKeyboardButton(text="🗑 Vider", callback_data=cbr.data("cart:empty"))],
+        [InlineKeyboardButton(text="➕ Continuer", callback_data=CB_CLUBS), InlineKeyboardButton(text="✅ Commander", callback_data=CB_CHECKOUT)],
         kb_support_row()
     ])
     await safe_edit(ev, "\n".join(lines), kb)
 
-@dp.callback_query(F.data == "cart:rm0")
-async def cart_rm0(cb: CallbackQuery):
+@cbr.on("cart:rm0")
+async def cart_rm0(cb: CallbackQuery, cp: Payload):
     remove_from_cart(cb.from_user.id, 0)
     await cart_view(cb)
 
-@dp.callback_query(F.data == "cart:empty")
-async def cart_empty(cb: CallbackQuery):
+@cbr.on("cart:empty")
+async def cart_empty(cb: CallbackQuery, cp: Payload):
     empty_cart(cb.from_user.id)
     await cart_view(cb)
 
@@ -517,20 +722,20 @@ async def start_checkout(uid: int, reply_target: Message):
         await reply_target.answer("Ton panier est vide.", reply_markup=clubs_kb()); return
     txt = order_summary_text(uid)
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Confirmer la commande", callback_data="checkout:confirm")],
-        [InlineKeyboardButton(text="🛒 Modifier le panier", callback_data="cart:view")],
-        [InlineKeyboardButton(text="⬅️ Continuer les achats", callback_data="clubs")],
+        [InlineKeyboardButton(text="✅ Confirmer la commande", callback_data=cbr.data("checkout:confirm"))],
+        [InlineKeyboardButton(text="🛒 Modifier le panier", callback_data=CB_CART)],
+        [InlineKeyboardButton(text="⬅️ Continuer les achats", callback_data=CB_CLUBS)],
         kb_support_row()
     ])
     await reply_target.answer(txt, parse_mode="Markdown", reply_markup=kb)
     checkout[uid] = {"_active": True, "_stage": "confirm"}
 
-@dp.callback_query(F.data == "checkout:start")
-async def chk_start(cb: CallbackQuery):
+@cbr.on("checkout:start")
+async def chk_start(cb: CallbackQuery, cp: Payload):
     await start_checkout(cb.from_user.id, cb.message)
 
-@dp.callback_query(F.data == "checkout:confirm")
-async def chk_confirm(cb: CallbackQuery):
+@cbr.on("checkout:confirm")
+async def chk_confirm(cb: CallbackQuery, cp: Payload):
     uid = cb.from_user.id
     if not carts[uid]:
         await cb.message.answer("Ton panier est vide.", reply_markup=clubs_kb()); return
@@ -560,14 +765,14 @@ async def got_contact(m: Message):
         checkout[uid]["_stage"] = "address"
         await m.answer("🏠 *Adresse complète* :", parse_mode="Markdown")
 
-@dp.callback_query(F.data == "order:new")
-async def order_new(cb: CallbackQuery):
+@cbr.on("order:new")
+async def order_new(cb: CallbackQuery, cp: Payload):
     empty_cart(cb.from_user.id)
     checkout.pop(cb.from_user.id, None)
     await cb.message.answer("🆕 Nouvelle commande — choisis ton *club* :", parse_mode="Markdown", reply_markup=clubs_kb())
 
 async def finalize_order(m: Message, uid: int):
-    items = carts[uid]; total = cart_total_cents(uid); oid = int(time.time())
+    items = list(carts[uid]); total = cart_total_cents(uid); oid = int(time.time())
     order = {
         "order_id": oid, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
         "user_id": uid, "name": checkout[uid].get("name", ""),
@@ -575,27 +780,19 @@ async def finalize_order(m: Message, uid: int):
         "items_json": items, "total_cents": total, "status": "new",
     }
     append_order(order)
-
-    head = (f"🆕 Commande #{oid}\n{order['name']} — {order['phone']}\n"
-            f"Adresse: {order['address']}\nTotal: {money(total)}")
-    for a in ADMINS:
-        try:
-            await bot.send_message(a, head)
-        except Exception:
-            pass
-        for it in items:
-            cap = f"{it['club']} • {it.get('color') or '—'} • {it.get('variant') or '—'} • T.{it['size']} x{int(it.get('qty',1))} — {money(int(it.get('price_cents',0))*int(it.get('qty',1)))}"
-            try:
-                p = get_product(it["id"])
-                img = get_image_for(p, color=it.get('color'), variant=it.get('variant'))
-                if img: await bot.send_photo(a, img, caption=cap)
-                else:   await bot.send_message(a, cap)
-            except Exception:
-                pass
+    # commande écrite : panier et checkout vidés tout de suite (le prochain message ne doit pas la dupliquer),
+    # puis la confirmation part quel que soit le budget restant (deadline.py)
+    empty_cart(uid); checkout.pop(uid, None)
+    notify_now = deadline.enough(deadline.NOTIFY_MIN)
+    if not notify_now:  # le client n'attend pas les notifications admin
+        deadline.defer(notify_admins(order), "admin_notify_deferred")
+    if deadline.expired():
+        deadline.fallback("order_confirm_late")
+    deadline.start(None)
 
     pay_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💸 Payer via PayPal (entre proches)", url=paypal_link(oid, total) or "https://www.paypal.me/")],
-        [InlineKeyboardButton(text="🛍️ Nouvelle commande", callback_data="order:new")],
+        [InlineKeyboardButton(text="🛍️ Nouvelle commande", callback_data=cbr.data("order:new"))],
         kb_support_row()
     ])
     await m.answer(
@@ -604,7 +801,31 @@ async def finalize_order(m: Message, uid: int):
         parse_mode="Markdown",
         reply_markup=pay_kb
     )
-    empty_cart(uid); checkout.pop(uid, None)
+    if notify_now:
+        await notify_admins(order)
+
+async def notify_admins(order: dict):
+    items = order["items_json"]
+    t = tenants.current()
+    head = (f"🆕 Commande #{order['order_id']}\n{order['name']} — {order['phone']}\n"
+            f"Adresse: {order['address']}\nTotal: {money(order['total_cents'])}")
+    for a in t.admins:
+        try:
+            await t.bot.send_message(a, head)
+        except Exception:
+            pass
+        for it in items:
+            cap = f"{it['club']} • {it.get('color') or '—'} • {it.get('variant') or '—'} • T.{it['size']} x{int(it.get('qty',1))} — {money(int(it.get('price_cents',0))*int(it.get('qty',1)))}"
+            try:
+                p = get_product(it["id"])
+                img = get_image_for(p, color=it.get('color'), variant=it.get('variant'))
+                if img and not deadline.enough(deadline.PHOTO_MIN):
+                    deadline.fallback("photo_as_text")
+                    img = None
+                if img: await t.bot.send_photo(a, img, caption=cap)
+                else:   await t.bot.send_message(a, cap)
+            except Exception:
+                pass
 
 # ------------------ Fallback texte (CAPTE le NOM, puis TEL, puis ADRESSE) ------------------
 @dp.message()  # capte tous les messages, y compris le "nom complet"
@@ -655,8 +876,57 @@ async def on_any_message(m: Message):
     )
 
 # ------------------ Run (polling si lancé en direct) ------------------
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30"))          # s de long-poll getUpdates
+POLLING_CONCURRENCY = int(os.getenv("POLLING_CONCURRENCY", "16"))  # updates traités en parallèle au plus
+POLLING_DRAIN = float(os.getenv("POLLING_DRAIN", "10"))            # s accordées aux updates en cours à l'arrêt
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))                 # 0 = pas de /metrics en polling
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")              # interface de /metrics (non authentifié)
+
+def _backoff_config() -> BackoffConfig:
+    """Reprise après erreur réseau de getUpdates : POLLING_BACKOFF="min,max,facteur,jitter" (s)."""
+    vals = [float(x) for x in os.getenv("POLLING_BACKOFF", "1,30,1.5,0.1").split(",")]
+    return BackoffConfig(*vals)
+
+def _admit_before_task(limiter: ConcurrencyLimit):
+    """handle_as_tasks=True crée une tâche par update reçu, sans limite : le flux d'updates du Dispatcher
+    (Dispatcher._listen_updates, aiogram 3.4) attend une place dans le limiteur avant de livrer le suivant.
+    Au plus POLLING_CONCURRENCY tâches ; le reste attend chez Telegram (offset de getUpdates pas avancé)."""
+    listen = dp._listen_updates
+
+    async def feed(*args, **kwargs):
+        async for update in listen(*args, **kwargs):
+            await limiter.admit()
+            yield update
+    dp._listen_updates = feed
+
 async def main():
-    await dp.start_polling(bot)
+    limiter = ConcurrencyLimit(POLLING_CONCURRENCY, name="polling")
+    dp.update.outer_middleware(UpdateCounter("polling"))
+    dp.update.outer_middleware(limiter)
+    _admit_before_task(limiter)
+    server = await metrics.serve(METRICS_PORT, METRICS_HOST) if METRICS_PORT else None
+    restock.start(send_restock)
+    allowed = dp.resolve_used_update_types()
+    logging.info("Polling: %s bot(s), updates %s, %s en parallèle max", len(TENANTS), allowed, POLLING_CONCURRENCY)
+    try:
+        await dp.start_polling(
+            *(t.bot for t in TENANTS),
+            polling_timeout=POLLING_TIMEOUT,
+            allowed_updates=allowed,
+            backoff_config=_backoff_config(),
+            handle_as_tasks=True,
+            close_bot_session=False,  # fermée après la fin des updates en cours
+        )
+    finally:
+        if not await limiter.drain(POLLING_DRAIN):
+            logging.warning("Arrêt : %s update(s) encore en cours abandonné(s)", limiter.running + limiter.waiting)
+        if server:
+            server.close()
+        await restock.stop()
+        await deadline.drain(POLLING_DRAIN)
+        await bot.session.close()
+        sheets.close()
 
 if __name__ == "__main__":
+    logconf.setup()
     asyncio.run(main())
@@ -0,0 +1,187 @@
+# metrics.py — métriques en mémoire, exposées au format texte Prometheus (route /metrics)
+# Compteurs, jauges et histogrammes étiquetés, sans dépendance externe.
+# Noms utilisés :
+#   bot_handler_seconds{handler}         latence par handler (messages, inline, callbacks)
+#   bot_api_seconds{method}              durée des appels Bot API (count = nombre d'appels)
+#   bot_api_errors_total{method}
+#   bot_api_retries_total{method,reason} (pools.RetryMiddleware)
+#   sheets_call_seconds{fn}              durée des appels Google Sheets (get_products, _load_stock, append_order)
+#   sheets_errors_total{fn}
+#   cache_requests_total{cache,result}   result = hit|miss ; ratio exposé dans cache_hit_ratio{cache}
+#   queue_depth{queue}                   profondeur des files (updates en cours, etc.)
+#   webhook_updates_total{type}, webhook_errors_total, callbacks_rejected_total{reason}
+#   polling_updates_total{type}, polling_errors_total (mode polling, main.main)
+#   snapshot_reads_total{result}, snapshot_publishes_total, snapshot_leader, snapshot_counter (snapshot.py)
+#   restock_subscriptions, restock_subscribed_total, restock_notified_total, restock_errors_total (restock.py)
+#   log_records_dropped_total{reason}    reason = sampled|queue_full (logconf.py)
+#   callbacks_coalesced_total{action}    rendus sautés (clic plus récent sur le même message, callbacks.py)
+#   callbacks_answers_dropped_total      cb.answer() d'un callback déjà acquitté par le routeur
+#   tenant_updates_total{tenant}         updates par boutique (tenants.py)
+#   deadline_fallbacks_total{kind}       solutions dégradées faute de budget (deadline.py)
+#   deadline_overruns_total{type}        updates terminés après leur échéance
+#   profile_sessions_total{mode}         sessions de profilage lancées (profiler.py)
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = {}
+_gauges: dict[tuple[str, tuple], float] = {}
+_gauge_fns: dict[tuple[str, tuple], Callable[[], float]] = {}
+_hists: dict[tuple[str, tuple], list] = {}  # -> [compteurs par bucket (+Inf inclus), somme, total]
+
+
+def _key(name: str, labels: dict) -> tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name: str, delta: float, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = _gauges.get(k, 0) + delta
+
+
+def register_gauge(name: str, fn: Callable[[], float], **labels):
+    """Jauge évaluée à la lecture (ex: taille d'une file)."""
+    _gauge_fns[_key(name, labels)] = fn
+
+
+def observe(name: str, seconds: float, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h[0][i] += 1
+                break
+        else:
+            h[0][-1] += 1
+        h[1] += seconds
+        h[2] += 1
+
+
+@contextmanager
+def timer(name: str, errors: str|None = None, **labels):
+    """Chronomètre un bloc ; si `errors` est fourni, incrémente ce compteur en cas d'exception."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if errors:
+            inc(errors, **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def timed(name: str, errors: str|None = None, **labels):
+    """Décorateur : chronomètre chaque appel de la fonction (synchrone)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, errors=errors, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def cache(name: str, hit: bool):
+    inc("cache_requests_total", cache=name, result="hit" if hit else "miss")
+
+
+# -------- Export texte Prometheus --------
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _hit_ratios() -> dict[tuple, float]:
+    tot: dict[str, list] = {}
+    for (name, labels), v in _counters.items():
+        if name != "cache_requests_total":
+            continue
+        d = dict(labels)
+        t = tot.setdefault(d.get("cache", ""), [0, 0])
+        t[0 if d.get("result") == "hit" else 1] += v
+    return {(("cache", c),): h / (h + m) for c, (h, m) in tot.items() if h + m}
+
+
+def render() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = dict(_gauges)
+        hists = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in _hists.items())
+        ratios = _hit_ratios()
+    for k, fn in list(_gauge_fns.items()):
+        try:
+            gauges[k] = float(fn())
+        except Exception:
+            pass
+    out, typed = [], set()
+
+    def _type(name: str, kind: str):
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), v in counters:
+        _type(name, "counter")
+        out.append(f"{name}{_fmt_labels(labels)} {v:g}")
+    for labels, v in sorted(ratios.items()):
+        _type("cache_hit_ratio", "gauge")
+        out.append(f"cache_hit_ratio{_fmt_labels(labels)} {v:.4f}")
+    for (name, labels), v in sorted(gauges.items()):
+        _type(name, "gauge")
+        out.append(f"{name}{_fmt_labels(labels)} {v:g}")
+    for (name, labels), (buckets, total, count) in hists:
+        _type(name, "histogram")
+        acc = 0
+        for b, n in zip(BUCKETS + (float("inf"),), buckets):
+            acc += n
+            le = "+Inf" if b == float("inf") else f"{b:g}"
+            out.append(f"{name}_bucket{_fmt_labels(labels, (('le', le),))} {acc}")
+        out.append(f"{name}_sum{_fmt_labels(labels)} {total:.6f}")
+        out.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(out) + "\n"
+
+
+async def serve(port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+    """Mini serveur HTTP pour GET /metrics (mode polling : pas d'app FastAPI). Sans authentification :
+    interface locale par défaut, à n'ouvrir (host) que sur un réseau interne."""
+    async def handle(reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            ok = line.split(b" ")[1:2] == [b"/metrics"]
+            body = render().encode() if ok else b"not found\n"
+            status = "200 OK" if ok else "404 Not Found"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
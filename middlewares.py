@@ -0,0 +1,180 @@
+# middlewares.py — middlewares aiogram (dispatcher + session Bot API)
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import AnswerCallbackQuery
+
+import callbacks
+import deadline
+import logconf
+import metrics
+import tenants
+
+log = logging.getLogger("bot.update")
+
+
+class LogContext(BaseMiddleware):
+    """Middleware externe sur les updates : contexte de log (update_id, type, user_id) et un enregistrement
+    de fin par update, avec handler et durée. Réutilise le contexte ouvert par le webhook s'il existe."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        fields = {"update_id": event.update_id, "type": event.event_type, "user_id": user.id if user else None}
+        if len(tenants.all_tenants()) > 1:
+            fields["tenant"] = tenants.current().name
+        ctx = logconf.current()
+        if ctx and ctx.get("update_id") == event.update_id:
+            ctx.update(fields)
+        else:
+            logconf.bind(**fields)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            log.info("update", extra={"duration_ms": round((time.perf_counter() - t0) * 1e3, 2)})
+
+
+class TenantContext(BaseMiddleware):
+    """Middleware externe sur les updates (à enregistrer en premier) : boutique de l'update d'après le bot qui
+    le reçoit, pour toute la suite du traitement (tenants.py). En webhook, la route l'a déjà posée."""
+
+    async def __call__(self, handler, event, data):
+        bot = data.get("bot")
+        t = tenants.by_bot_id(bot.id) if bot else None
+        if t is not None:
+            tenants.set_current(t)
+        metrics.inc("tenant_updates_total", tenant=tenants.current().name)
+        return await handler(event, data)
+
+
+class Deadline(BaseMiddleware):
+    """Middleware externe sur les updates : ouvre le budget de l'update (deadline.py) dès sa réception,
+    attente de ConcurrencyLimit comprise ; compte les updates terminés hors délai."""
+
+    def __init__(self, budget: float = deadline.BUDGET):
+        self.budget = budget
+
+    async def __call__(self, handler, event, data):
+        deadline.start(self.budget)
+        try:
+            return await handler(event, data)
+        finally:
+            if deadline.expired():
+                metrics.inc("deadline_overruns_total", type=event.event_type)
+
+
+class UpdateCounter(BaseMiddleware):
+    """Middleware externe : <prefix>_updates_total{type} et <prefix>_errors_total (mêmes noms que le webhook)."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    async def __call__(self, handler, event, data):
+        metrics.inc(f"{self.prefix}_updates_total", type=event.event_type)
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc(f"{self.prefix}_errors_total")
+            raise
+
+
+class ConcurrencyLimit(BaseMiddleware):
+    """Middleware externe sur les updates : au plus `limit` updates traités en même temps (les autres
+    attendent leur tour). Profondeurs exportées dans queue_depth{queue="<name>_running|<name>_waiting"}.
+    En polling, admit() réserve la place avant même la création de la tâche de l'update."""
+
+    def __init__(self, limit: int, name: str = "updates"):
+        self.limit = limit
+        self._sem = asyncio.Semaphore(limit)
+        self.running = self.waiting = 0
+        self._admitted = 0  # places réservées par admit(), pas encore reprises par un update
+        self._idle = asyncio.Event()
+        self._idle.set()
+        metrics.register_gauge("queue_depth", lambda: self.running, queue=f"{name}_running")
+        metrics.register_gauge("queue_depth", lambda: self.waiting, queue=f"{name}_waiting")
+
+    async def __call__(self, handler, event, data):
+        if self._admitted:  # place déjà prise par admit()
+            self._admitted -= 1
+        else:
+            await self._acquire()
+        self.waiting -= 1
+        self.running += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
+            self._sem.release()
+            self._check_idle()
+
+    async def _acquire(self):
+        self.waiting += 1
+        self._idle.clear()
+        try:
+            await self._sem.acquire()
+        except BaseException:
+            self.waiting -= 1
+            self._check_idle()
+            raise
+
+    async def admit(self):
+        """Attend une place libre et la réserve pour le prochain update (flux de polling) : l'update suivant
+        n'est pas lu, donc pas de tâche créée, tant que `limit` updates sont en cours."""
+        await self._acquire()
+        self._admitted += 1
+
+    def _check_idle(self):
+        if self.running == 0 and self.waiting == 0:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Attend la fin des updates en cours / en attente (arrêt propre). False si délai dépassé."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Latence par handler (middleware interne : `data["handler"]` est le handler retenu).
+    Les callbacks sont chronométrés par callbacks.CallbackRouter, au niveau de l'action."""
+
+    async def __call__(self, handler, event, data):
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", type(event).__name__)
+        logconf.annotate(handler=name)
+        with metrics.timer("bot_handler_seconds", handler=name):
+            return await handler(event, data)
+
+
+class BotApiMetrics(BaseRequestMiddleware):
+    """Nombre et durée des appels Bot API, par méthode."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            metrics.inc("bot_api_errors_total", method=name)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", time.perf_counter() - t0, method=name)
+
+
+class AnsweredCallbacks(BaseRequestMiddleware):
+    """Ignore les réponses à un callback déjà acquitté par callbacks.CallbackRouter (Telegram n'en accepte
+    qu'une : la seconde finirait en erreur 400)."""
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, AnswerCallbackQuery) and callbacks.acked(method.callback_query_id):
+            metrics.inc("callbacks_answers_dropped_total")
+            # une alerte perdue est un bug du handler (route "render" qui devrait éditer le message)
+            log.log(logging.WARNING if method.show_alert else logging.DEBUG,
+                    "réponse au callback ignorée (déjà acquitté)", extra={"text": method.text})
+            return True
+        return await make_request(bot, method)
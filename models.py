@@ -1,8 +1,11 @@
 # models.py
 from collections import defaultdict
 
+import tenants
+
 # panier: {user_id: [{"id":..., "name":..., "club":"", "season":"", "color":"", "size":"", "custom":{"name":"","number":""}, "qty":1, "price_cents":5999}]}
-carts = defaultdict(list)
+# un jeu de paniers par boutique (tenants.py)
+carts = tenants.scoped(lambda: defaultdict(list))
 
 def add_to_cart(user_id, item):
     for i in carts[user_id]:
@@ -0,0 +1,142 @@
+# orders.py — index local des commandes (journal JSONL append-only + index en mémoire)
+# Alimenté par sheets.append_order (hook on_order) : chaque commande écrite dans Sheets est aussi ajoutée
+# au journal ORDERS_LOG (défaut orders.jsonl). Les recherches (id, client, jour) et l'export ne lisent
+# jamais Sheets. Plusieurs workers peuvent écrire le même journal (O_APPEND, une ligne par write) :
+# chacun relit la fin du fichier avant de répondre, donc les index restent à jour.
+# Reprise de l'historique de l'onglet Orders (une fois) : python orders.py import
+# Un journal et un index par boutique (tenants.py : orders.<nom>.jsonl).
+import bisect
+import json
+import logging
+import os
+import threading
+
+import metrics
+import tenants
+from sheets import on_order
+
+PATH = os.getenv("ORDERS_LOG", "orders.jsonl")
+FIELDS = ["order_id", "timestamp", "user_id", "name", "phone", "address", "items_json", "total_cents", "status"]
+
+log = logging.getLogger("orders")
+_lock = threading.Lock()
+_orders = tenants.scoped(list)      # position (= curseur) -> commande, dans l'ordre d'écriture
+_by_id = tenants.scoped(dict)       # order_id -> positions (l'id est un timestamp : doublons possibles)
+_by_user = tenants.scoped(dict)     # user_id -> positions
+_by_day = tenants.scoped(dict)      # "AAAA-MM-JJ" -> positions
+_state = tenants.scoped(lambda: {"offset": 0})  # octets du journal déjà indexés
+
+metrics.register_gauge("orders_indexed", lambda: len(_orders))
+
+
+def _index(o: dict):
+    i = len(_orders)
+    _orders.append(o)
+    _by_id.setdefault(str(o.get("order_id", "")), []).append(i)
+    try:
+        _by_user.setdefault(int(o.get("user_id")), []).append(i)
+    except (TypeError, ValueError):
+        pass
+    _by_day.setdefault(str(o.get("timestamp", ""))[:10], []).append(i)
+
+
+def _sync():
+    """Indexe les lignes ajoutées au journal depuis la dernière lecture (par ce process ou un autre)."""
+    path = tenants.path(PATH)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if size <= _state["offset"]:
+        return
+    with _lock:
+        if size <= _state["offset"]:
+            return
+        with open(path, "rb") as f:
+            f.seek(_state["offset"])
+            chunk = f.read(size - _state["offset"])
+        end = chunk.rfind(b"\n") + 1  # une ligne en cours d'écriture sera lue au prochain passage
+        for line in chunk[:end].splitlines():
+            try:
+                _index(json.loads(line))
+            except ValueError:
+                log.warning("ligne illisible dans %s", path)
+        _state["offset"] += end
+
+
+def _append(o: dict):
+    line = (json.dumps(o, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+    fd = os.open(tenants.path(PATH), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@on_order
+def record(order: dict):
+    o = {k: order.get(k) for k in FIELDS}
+    _append(o)
+    _sync()
+    metrics.inc("orders_recorded_total")
+
+
+# -------- Lecture --------
+def get(order_id) -> list[dict]:
+    _sync()
+    return [_orders[i] for i in _by_id.get(str(order_id), [])]
+
+
+def page(cursor: int = 0, limit: int = 1000, user_id: int|None = None,
+         since: str|None = None, until: str|None = None) -> tuple[list[dict], int|None]:
+    """Commandes à partir de la position `cursor` (filtres client / jours inclusifs "AAAA-MM-JJ").
+    Renvoie (commandes, curseur suivant ou None)."""
+    _sync()
+    if user_id is not None:
+        pos = _by_user.get(user_id, [])
+    elif since or until:
+        days = sorted(d for d in _by_day if (not since or d >= since) and (not until or d <= until))
+        pos = sorted(i for d in days for i in _by_day[d])
+    else:
+        pos = range(len(_orders))
+    start = bisect.bisect_left(pos, cursor)
+    sel = []
+    for i in pos[start:]:
+        o = _orders[i]
+        day = str(o.get("timestamp", ""))[:10]
+        if (since and day < since) or (until and day > until):
+            continue
+        if len(sel) == limit:
+            return sel, i
+        sel.append(o)
+    return sel, None
+
+
+def import_from_sheet():
+    """Ajoute au journal les commandes de l'onglet Orders absentes de l'index (reprise d'historique)."""
+    import sheets
+    _sync()
+    ws = sheets._ensure_ws(sheets.ORDERS_TAB)
+    n = 0
+    for r in ws.get_all_records():
+        if not r.get("order_id") or get(r["order_id"]):
+            continue
+        o = {k: r.get(k) for k in FIELDS}
+        try:
+            o["items_json"] = json.loads(o["items_json"] or "[]")
+        except (TypeError, ValueError):
+            pass
+        _append(o)
+        n += 1
+    _sync()
+    return n
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["import"]:
+        for t in tenants.all_tenants():
+            with tenants.use(t):
+                print(f"{import_from_sheet()} commande(s) importée(s) dans {tenants.path(PATH)}")
+    else:
+        print("usage: python orders.py import")
@@ -0,0 +1,132 @@
+# pools.py — connexions HTTP partagées (keep-alive) pour Bot API (aiohttp) et Google Sheets (requests)
+#   HTTP_POOL_SIZE        connexions max par client (défaut 20)
+#   HTTP_KEEPALIVE        s de conservation d'une connexion inactive (défaut 60)
+#   HTTP_CONNECT_TIMEOUT  s (défaut 5, Sheets)
+#   HTTP_READ_TIMEOUT     s (défaut 30 : Sheets en lecture, Bot API en durée totale d'une requête)
+#   HTTP_RETRIES          tentatives supplémentaires (défaut 2)
+#   HTTP_RETRY_AFTER_MAX  attente max acceptée sur un "retry after" Telegram (défaut 5 s)
+# Pendant un update, les timeouts sont en plus bornés par son budget restant (deadline.py).
+import asyncio
+import logging
+import os
+import ssl
+
+import aiogram
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import deadline
+import metrics
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "5"))
+
+log = logging.getLogger("pools")
+
+
+# -------- Bot API --------
+class PooledSession(AiohttpSession):
+    """AiohttpSession dont la ClientSession est construite ici : pool borné, connexions gardées ouvertes, cache
+    DNS, sans toucher aux attributs internes d'aiogram (aiogram 3.4 n'expose pas ces réglages). Sans proxy.
+    La ClientSession n'est créée qu'au premier appel (donc dans la boucle du lifespan)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client: ClientSession|None = None
+
+    async def create_session(self) -> ClientSession:
+        if self._client is None or self._client.closed:
+            connector = TCPConnector(ssl=ssl.create_default_context(cafile=certifi.where()), limit=POOL_SIZE,
+                                     keepalive_timeout=KEEPALIVE, ttl_dns_cache=3600)
+            self._client = ClientSession(connector=connector, headers={"User-Agent": f"aiogram/{aiogram.__version__}"})
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+
+
+def bot_session() -> PooledSession:
+    """Session aiohttp partagée par les bots, avec RetryMiddleware."""
+    s = PooledSession(timeout=READ_TIMEOUT)
+    s.middleware(RetryMiddleware())
+    return s
+
+
+# méthodes rejouables sans risque de doublon visible par le client (pas de Send*)
+_IDEMPOTENT = ("Get", "Answer", "Edit", "Set", "Delete")
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    """Retente les flood waits courts (toute méthode : Telegram n'a rien exécuté) et, pour les méthodes
+    idempotentes, les erreurs réseau / 5xx, avec backoff exponentiel.
+    Chaque tentative est bornée par le budget restant de l'update ; plus de nouvelle tentative une fois épuisé."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        for attempt in range(RETRIES + 1):
+            try:
+                return await _bounded(make_request(bot, method), method)
+            except TelegramRetryAfter as e:
+                if attempt == RETRIES or e.retry_after > RETRY_AFTER_MAX or not deadline.enough(e.retry_after):
+                    raise
+                metrics.inc("bot_api_retries_total", method=name, reason="retry_after")
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == RETRIES or not name.startswith(_IDEMPOTENT) or deadline.expired():
+                    raise
+                metrics.inc("bot_api_retries_total", method=name, reason=type(e).__name__)
+                await asyncio.sleep(0.2 * 2 ** attempt)
+
+
+async def _bounded(call, method):
+    """Appel borné par le budget de l'update ; dépassement => TelegramNetworkError comme un timeout aiohttp.
+    Hors update (getUpdates en long-poll, tâches de fond) : timeout de la session seul."""
+    if deadline.remaining() is None:
+        return await call
+    try:
+        return await asyncio.wait_for(call, deadline.timeout(READ_TIMEOUT))
+    except asyncio.TimeoutError:
+        deadline.fallback("bot_api_timeout")
+        raise TelegramNetworkError(method=method, message="Request timeout error (budget de l'update)") from None
+
+
+# -------- Google Sheets --------
+def tune_sheets(gc):
+    """Pool + retries sur la session requests de gspread ; réponses gzip ; timeouts connexion/lecture.
+    Seuls les GET sont retentés (les écritures de commandes ne doivent pas être doublées)."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class _DeadlineAdapter(HTTPAdapter):
+        # lectures faites depuis un update : timeout = part du budget restant (toutes tentatives comprises).
+        # Les écritures gardent leur timeout : une commande coupée en vol pourrait être écrite sans être confirmée.
+        def send(self, request, timeout=None, **kwargs):
+            if request.method == "GET" and deadline.remaining() is not None:
+                t = deadline.timeout(READ_TIMEOUT) / (RETRIES + 1)
+                timeout = (min(CONNECT_TIMEOUT, t), t)
+            return super().send(request, timeout=timeout, **kwargs)
+
+    session = gc.http_client.session
+    retry = Retry(total=RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset({"GET"}), respect_retry_after_header=True, raise_on_status=False)
+    adapter = _DeadlineAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    # Google ne compresse que si l'User-Agent contient "gzip"
+    session.headers.update({"Accept-Encoding": "gzip", "User-Agent": "madsportbot (gzip)"})
+    gc.set_timeout((CONNECT_TIMEOUT, READ_TIMEOUT))
+    return gc
+
+
+def close_sheets(gc):
+    try:
+        gc.http_client.session.close()
+    except Exception:
+        log.exception("fermeture session Sheets")
@@ -0,0 +1,202 @@
+# profiler.py — profilage à la demande du trafic réel (/profile en Telegram, /admin/profile en webhook)
+# Une session couvre les N prochains updates ou T secondes (la première limite atteinte), puis s'arrête seule.
+# Modes :
+#   sample   (défaut) un thread relève les piles toutes les PROFILE_INTERVAL_MS ms ; fichier "collapsed stacks"
+#            (une ligne "racine;f1;f2 n"), prêt pour flamegraph.pl / speedscope. Racine = handler de l'update,
+#            "(to_thread)" pour les appels Sheets en thread, "(hors update)" pour les tâches de fond.
+#   cprofile profil déterministe du thread de la boucle (.prof, pstats / snakeviz) ; plus coûteux.
+# Dans les deux cas : temps par handler (nombre, total, max) mesuré par un middleware d'update.
+# Désactivé : ni middleware, ni thread, ni hook de profilage — aucun coût. Session par process (worker).
+#   PROFILE_UPDATES       nombre d'updates par défaut d'une session (défaut 100)
+#   PROFILE_INTERVAL_MS   période d'échantillonnage (défaut 5)
+#   PROFILE_MAX_SECONDS   durée max d'une session (défaut 300)
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from aiogram import BaseMiddleware
+
+import logconf
+import metrics
+
+UPDATES = int(os.getenv("PROFILE_UPDATES", "100"))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1e3
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+MODES = ("sample", "cprofile")
+
+_session: "_Session|None" = None
+_last: dict|None = None  # résultat de la dernière session terminée
+
+
+class _Session:
+    def __init__(self, dp, mode: str, updates: int|None, seconds: float, on_done):
+        self.dp, self.mode, self.updates, self.seconds, self.on_done = dp, mode, updates, seconds, on_done
+        self.t0 = time.time()
+        self.done = 0
+        self.handlers: dict[str, list] = {}  # handler -> [nombre, total s, max s]
+        self.samples: Counter[str] = Counter()  # pile repliée -> nombre d'échantillons
+        self.running: dict[int, dict] = {}  # id(frame du middleware) -> contexte de log de l'update
+        self.middleware = _Profile(self)
+        self.loop_thread = threading.get_ident()
+        self.prof = cProfile.Profile() if mode == "cprofile" else None
+        self.sampler = threading.Thread(target=self._sample, name="profiler", daemon=True) if mode == "sample" else None
+        self.timer = None
+        self.stopped = threading.Event()
+
+    # -------- échantillonnage (thread dédié) --------
+    def _sample(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(INTERVAL):
+            for tid, frame in sys._current_frames().items():
+                if tid != me:
+                    stack = self._fold(frame, tid == self.loop_thread)
+                    if stack:
+                        self.samples[stack] += 1
+
+    def _fold(self, frame, loop: bool) -> str|None:
+        names, root = [], None
+        f = frame
+        while f is not None:
+            code = f.f_code
+            if loop and code is _Profile.__call__.__code__:
+                ctx = self.running.get(id(f))
+                root = (ctx.get("handler") or ctx.get("type")) if ctx else "(update)"
+                break  # au-dessus : boucle asyncio et middlewares, communs à tous les updates
+            if not loop and code.co_name == "run" and code.co_filename.endswith("thread.py"):
+                root = "(to_thread)"  # concurrent.futures.thread._WorkItem.run : un appel en cours
+                break
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            f = f.f_back
+        if root is None:
+            # boucle inactive (attente dans selectors) ou thread au repos : pas d'échantillon
+            if not loop or frame.f_code.co_filename.endswith("selectors.py"):
+                return None
+            root = "(hors update)"
+        names.append(root)
+        return ";".join(reversed(names))
+
+    # -------- cycle de vie (thread de la boucle) --------
+    def start(self):
+        self.dp.update.outer_middleware.register(self.middleware)
+        if self.prof:
+            self.prof.enable()
+        if self.sampler:
+            self.sampler.start()
+        self.timer = asyncio.get_running_loop().call_later(self.seconds, stop, "seconds")
+
+    def stop(self, reason: str) -> dict:
+        self.stopped.set()
+        if self.prof:
+            self.prof.disable()
+        self.dp.update.outer_middleware.unregister(self.middleware)
+        if self.timer:
+            self.timer.cancel()
+        if self.sampler:
+            self.sampler.join(1)
+        return self._result(reason)
+
+    def _result(self, reason: str) -> dict:
+        handlers = sorted(({"handler": h, "count": n, "total_ms": round(tot * 1e3, 1), "avg_ms": round(tot / n * 1e3, 1),
+                            "max_ms": round(mx * 1e3, 1)} for h, (n, tot, mx) in self.handlers.items()),
+                          key=lambda r: -r["total_ms"])
+        res = {"mode": self.mode, "reason": reason, "updates": self.done, "seconds": round(time.time() - self.t0, 1),
+               "handlers": handlers}
+        if self.prof:
+            self.prof.create_stats()
+            res["data"] = marshal.dumps(self.prof.stats)
+            res["filename"] = f"profile-{int(self.t0)}.prof"
+            out = io.StringIO()
+            pstats.Stats(self.prof, stream=out).sort_stats("cumulative").print_stats(25)
+            res["top"] = out.getvalue()
+        else:
+            by_root = Counter()
+            for stack, n in self.samples.items():
+                by_root[stack.partition(";")[0]] += n
+            for r in handlers:
+                r["samples"] = by_root.pop(r["handler"], 0)
+            res["samples"] = sum(self.samples.values())
+            res["other_samples"] = dict(by_root)
+            res["data"] = "".join(f"{s} {n}\n" for s, n in self.samples.most_common()).encode()
+            res["filename"] = f"profile-{int(self.t0)}.collapsed.txt"
+            leaf = Counter()
+            for stack, n in self.samples.items():
+                leaf[stack.rpartition(";")[2]] += n
+            res["top"] = "\n".join(f"{n:>6}  {name}" for name, n in leaf.most_common(25))
+        return res
+
+
+class _Profile(BaseMiddleware):
+    """Middleware externe, enregistré seulement pendant une session : temps par handler, repère de pile
+    pour l'échantillonneur, arrêt après N updates."""
+
+    def __init__(self, session: _Session):
+        self.session = session
+
+    async def __call__(self, handler, event, data):
+        s = self.session
+        ctx = logconf.current() or {"type": event.event_type}
+        key = id(sys._getframe())
+        s.running[key] = ctx
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            dt = time.perf_counter() - t0
+            s.running.pop(key, None)
+            if _session is s:
+                st = s.handlers.setdefault(ctx.get("handler") or ctx.get("type") or event.event_type, [0, 0.0, 0.0])
+                st[0] += 1
+                st[1] += dt
+                st[2] = max(st[2], dt)
+                s.done += 1
+                if s.updates and s.done >= s.updates:
+                    stop("updates")
+
+
+def start(dp, mode: str = "sample", updates: int|None = None, seconds: float|None = None, on_done=None) -> bool:
+    """Lance une session (à appeler depuis la boucle). False si une session est déjà en cours.
+    on_done(résultat) est appelé à la fin (synchrone : planifier soi-même l'envoi du fichier)."""
+    global _session
+    if _session is not None:
+        return False
+    if mode not in MODES:
+        raise ValueError(f"mode inconnu: {mode}")
+    if not updates and not seconds:
+        updates = UPDATES
+    seconds = min(seconds or MAX_SECONDS, MAX_SECONDS)
+    _session = _Session(dp, mode, updates, seconds, on_done)
+    _session.start()
+    metrics.inc("profile_sessions_total", mode=mode)
+    return True
+
+
+def stop(reason: str = "manual") -> dict|None:
+    """Termine la session en cours ; renvoie son résultat (None si aucune)."""
+    global _session, _last
+    s, _session = _session, None
+    if s is None:
+        return None
+    _last = s.stop(reason)
+    if s.on_done:
+        s.on_done(_last)
+    return _last
+
+
+def status() -> dict:
+    """Session en cours (ou None) et résumé de la dernière terminée (sans le fichier)."""
+    s = _session
+    cur = None if s is None else {"mode": s.mode, "updates": s.done, "max_updates": s.updates,
+                                  "seconds": round(time.time() - s.t0, 1), "max_seconds": s.seconds}
+    last = None if _last is None else {k: v for k, v in _last.items() if k != "data"}
+    return {"running": cur, "last": last}
+
+
+def last() -> dict|None:
+    return _last
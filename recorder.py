@@ -0,0 +1,81 @@
+# recorder.py — enregistrement opt-in des updates reçus par le webhook (JSONL rotatif)
+# Activé si WEBHOOK_RECORD=<chemin.jsonl>. Une ligne par update : {"ts": <epoch>, "tenant": <boutique>, "update": {...}}
+#   WEBHOOK_RECORD_MAX_MB   taille max d'un fichier avant rotation (défaut 50)
+#   WEBHOOK_RECORD_BACKUPS  nombre de fichiers conservés (défaut 5)
+#   WEBHOOK_RECORD_SCRUB    1 (défaut) = données personnelles masquées, 0 = brut
+#   WEBHOOK_RECORD_SALT     sel des pseudonymes d'identifiants (stables d'un fichier à l'autre)
+# Rejouer : python replay.py run <fichier.jsonl> (voir replay.py)
+import hashlib
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+
+import logconf
+
+PATH = os.getenv("WEBHOOK_RECORD", "").strip()
+MAX_MB = float(os.getenv("WEBHOOK_RECORD_MAX_MB", "50"))
+BACKUPS = int(os.getenv("WEBHOOK_RECORD_BACKUPS", "5"))
+SCRUB = os.getenv("WEBHOOK_RECORD_SCRUB", "1") != "0"
+_SALT = os.getenv("WEBHOOK_RECORD_SALT", "madsport")
+
+enabled = bool(PATH)
+log = logging.getLogger("webhook.record")
+log.propagate = False  # jamais mélangé aux logs applicatifs
+
+if enabled:
+    _h = RotatingFileHandler(PATH, maxBytes=int(MAX_MB * 1024 * 1024), backupCount=BACKUPS, encoding="utf-8")
+    _h.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(logconf.background(_h))  # écriture disque dans le thread de logconf
+    log.setLevel(logging.INFO)
+
+
+# -------- Masquage --------
+_NAME_KEYS = {"first_name", "last_name", "username", "title", "bio"}
+_DROP_KEYS = {"location", "venue"}  # contenus personnels inutiles au rejeu
+
+
+def _pseudo(i: int) -> int:
+    """Identifiant stable mais non réversible (garde le signe : chats de groupe < 0)."""
+    h = int(hashlib.sha256(f"{_SALT}:{i}".encode()).hexdigest()[:12], 16) % 10**9
+    return (h + 10**9) * (1 if i >= 0 else -1)
+
+
+def _mask_text(t: str) -> str:
+    # les commandes pilotent le bot : on les garde ; le texte libre (nom, téléphone, adresse) est masqué
+    # en conservant sa longueur
+    if t.startswith("/"):
+        return t
+    return "x" * len(t)
+
+
+def scrub(obj, key: str = ""):
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k in _DROP_KEYS:
+                continue
+            if k in _NAME_KEYS and isinstance(v, str):
+                out[k] = "x"
+            elif k == "phone_number":
+                out[k] = "+33600000000"
+            elif k in ("text", "caption") and isinstance(v, str):
+                out[k] = _mask_text(v)
+            elif k in ("id", "user_id") and isinstance(v, int) and key in ("from", "chat", "user", "contact"):
+                out[k] = _pseudo(v)
+            else:
+                out[k] = scrub(v, k)
+        return out
+    if isinstance(obj, list):
+        return [scrub(v, key) for v in obj]
+    return obj
+
+
+def record(payload: dict, tenant: str = "default", ts: float|None = None):
+    """tenant = nom de la boutique (tenants.py) dont la route a reçu l'update : le rejeu la respecte."""
+    if not enabled:
+        return
+    body = scrub(payload) if SCRUB else payload
+    rec = {"ts": round(ts or time.time(), 4), "tenant": tenant, "update": body}
+    log.info(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
@@ -0,0 +1,196 @@
+# replay.py — rejeu déterministe d'un enregistrement webhook (recorder.py) contre les doublures locales
+# Les updates sont réinjectés dans l'app (ou le Dispatcher) à la cadence d'origine ou accélérée, en boucle
+# ouverte (comme le vrai trafic : on n'attend pas la fin d'un update pour envoyer le suivant).
+#
+#   python replay.py dump catalogue.json                       # copie Products/Stock du vrai classeur (une fois)
+#   python replay.py run rec.jsonl rec.jsonl.1 --catalog catalogue.json --speed 10 --json apres.json --compare avant.json
+#
+# --speed 1 = temps réel, 10 = dix fois plus vite, 0 = au plus vite.
+# Plusieurs boutiques (champ "tenant" des enregistrements) : une boutique factice par nom, chaque update rejoué
+# sur le bot et le classeur de la sienne. --catalog nom=fichier (répétable) pour un catalogue par boutique,
+# --catalog fichier pour toutes ; dump --tenant nom copie le classeur d'une boutique.
+# Sans --catalog, un catalogue synthétique est utilisé : les callbacks enregistrés portent alors une
+# version de catalogue différente et sont rejetés comme "expirés" (coût mesuré, mais pas le parcours réel).
+import argparse
+import asyncio
+import json
+import time
+
+from fakes import FakeSpreadsheet, fake_tenants, install_bot, install_sheets, isolate_files, make_catalog
+
+isolate_files("replay-")  # commandes rejouées hors de orders.jsonl / analytics.json
+
+
+def load_recording(paths: list[str]) -> list[tuple[float, str, dict]]:
+    """(ts, boutique, update) triés ; boutique "default" pour les enregistrements d'avant le champ tenant."""
+    out = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                    out.append((float(rec["ts"]), rec.get("tenant") or "default", rec["update"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+    out.sort(key=lambda r: r[0])  # fichiers rotatifs dans n'importe quel ordre
+    return out
+
+
+def _group(update: dict) -> str:
+    """Clé d'agrégation : type d'update, et action pour les callbacks / commande pour les messages."""
+    from callbacks import unpack
+    if "callback_query" in update:
+        return "callback:" + (unpack(update["callback_query"].get("data")).action or "invalide")
+    if "message" in update:
+        t = (update["message"].get("text") or "")
+        return "message:" + (t.split()[0] if t.startswith("/") else "texte")
+    return next((k for k in update if k != "update_id"), "inconnu")
+
+
+def dump_catalog(path: str, tenant: str|None = None):
+    """Copie Products/Stock du vrai classeur (mêmes valeurs que get_all_records => même version de catalogue)."""
+    import sheets
+    import tenants
+    t = tenants.get(tenant)
+    if t is None:
+        raise SystemExit(f"boutique inconnue : {tenant}")
+    tenants.set_current(t)
+    sh = sheets._ensure_client()
+    tabs = {}
+    for name in (sheets.PRODUCTS_TAB, sheets.STOCK_TAB):
+        ws = sh.worksheet(name)
+        recs = ws.get_all_records()
+        head = list(recs[0].keys()) if recs else ws.row_values(1)
+        tabs[name] = [head] + [[r.get(h, "") for h in head] for r in recs]
+    tabs.setdefault(sheets.ORDERS_TAB, [["order_id"]])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tabs, f, ensure_ascii=False)
+    print(f"catalogue copié dans {path}")
+
+
+def _catalogs(specs: list[str]|None, names: list[str]) -> dict[str, str|None]:
+    """--catalog fichier | nom=fichier (répétable) -> {boutique: fichier ou None (synthétique)}."""
+    default, per = None, {}
+    for spec in specs or []:
+        name, sep, path = spec.partition("=")
+        if sep:
+            per[name] = path
+        else:
+            default = spec
+    return {n: per.get(n, default) for n in names}
+
+
+async def replay(args) -> dict:
+    # importé ici : loadtest remplace BOT_TOKEN/SHEET_ID par des valeurs factices (dump a besoin des vraies)
+    from loadtest import Driver, percentile
+    records = load_recording(args.recordings)
+    if not records:
+        raise SystemExit("enregistrement vide")
+    names = sorted({t for _, t, _ in records})
+    fake_tenants(names)  # avant Driver (import de main)
+    drv = Driver(args.via)
+    import tenants
+    books, sessions = [], []
+    for name, path in _catalogs(args.catalog, names).items():
+        if path:
+            with open(path, encoding="utf-8") as f:
+                tabs = json.load(f)
+        else:
+            tabs = make_catalog(args.products)
+        with tenants.use(tenants.get(name)) as t:
+            books.append(FakeSpreadsheet(tabs, latency=args.sheets_latency, quota_error_rate=args.quota_errors))
+            install_sheets(books[-1])
+            sessions.append(install_bot(t.bot, latency=args.api_latency))
+
+    lat: dict[str, list[float]] = {}
+    lags: list[float] = []
+    errors: dict[str, int] = {}
+
+    async def one(due: float, tenant: str, update: dict):
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, time.perf_counter() - due))
+        g = _group(update)
+        t0 = time.perf_counter()
+        ok = await drv.feed(update, tenant)
+        lat.setdefault(g, []).append(time.perf_counter() - t0)
+        if not ok:
+            errors[g] = errors.get(g, 0) + 1
+
+    async with drv.app.lifespan(drv.app.app):
+        start = time.perf_counter()
+        ts0, t0 = records[0][0], start + 0.1  # 100 ms pour créer les tâches avant la première échéance
+        if args.speed > 0:
+            tasks = [asyncio.create_task(one(t0 + (ts - ts0) / args.speed, t, u)) for ts, t, u in records]
+            await asyncio.gather(*tasks)
+        else:
+            for _, t, u in records:
+                await one(time.perf_counter(), t, u)
+        elapsed = time.perf_counter() - start
+
+    all_lat = [x for v in lat.values() for x in v]
+    summarize = lambda v: {"n": len(v), "p50_ms": percentile(v, 50) * 1e3,
+                           "p95_ms": percentile(v, 95) * 1e3, "p99_ms": percentile(v, 99) * 1e3}
+    return {
+        "recordings": args.recordings, "speed": args.speed, "updates": len(records), "tenants": names,
+        "span_s": records[-1][0] - ts0, "elapsed_s": elapsed,
+        "bot_api_calls": sum(s.calls for s in sessions),
+        "sheets_calls": {k: sum(b.calls.get(k, 0) for b in books) for k in {k for b in books for k in b.calls}},
+        "lag_p99_ms": percentile(lags, 99) * 1e3,
+        "total": summarize(all_lat), "errors": errors,
+        "groups": {g: summarize(v) for g, v in sorted(lat.items())},
+    }
+
+
+def report(res: dict, base: dict|None):
+    print(f"\n{res['updates']} updates ({res['span_s']:.0f}s enregistrées) rejoués en {res['elapsed_s']:.1f}s "
+          f"à x{res['speed'] or '∞'} — retard d'envoi p99 {res['lag_p99_ms']:.1f} ms")
+    print(f"Bot API: {res['bot_api_calls']} appels — Sheets: {sum(res['sheets_calls'].values())} appels\n")
+    rows = [("TOTAL", res["total"])] + list(res["groups"].items())
+    head = f"{'groupe':<28} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(head + ("   Δp50     Δp95     Δp99" if base else ""))
+    for g, s in rows:
+        line = f"{g:<28} {s['n']:>6} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}"
+        b = base["total"] if (base and g == "TOTAL") else (base or {}).get("groups", {}).get(g)
+        if b:
+            line += "".join(f" {s[k] - b[k]:>+8.1f}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(line)
+    if res["errors"]:
+        print(f"\nerreurs: {res['errors']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Rejeu d'enregistrements webhook")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    d = sub.add_parser("dump", help="copie Products/Stock du vrai classeur dans un fichier JSON")
+    d.add_argument("out")
+    d.add_argument("--tenant", help="boutique (TENANTS) à copier ; défaut : la première")
+    r = sub.add_parser("run", help="rejoue un ou plusieurs fichiers JSONL")
+    r.add_argument("recordings", nargs="+")
+    r.add_argument("--catalog", action="append",
+                   help="fichier produit par 'dump' (sinon catalogue synthétique), ou nom=fichier par boutique")
+    r.add_argument("--products", type=int, default=200, help="taille du catalogue synthétique")
+    r.add_argument("--speed", type=float, default=1.0)
+    r.add_argument("--via", choices=("asgi", "dispatcher"), default="asgi")
+    r.add_argument("--sheets-latency", type=float, default=0.0)
+    r.add_argument("--quota-errors", type=float, default=0.0)
+    r.add_argument("--api-latency", type=float, default=0.0)
+    r.add_argument("--json", help="écrit le résultat dans ce fichier")
+    r.add_argument("--compare", help="résultat JSON d'un rejeu précédent (affiche les écarts)")
+    args = ap.parse_args()
+    if args.cmd == "dump":
+        dump_catalog(args.out, args.tenant)
+    else:
+        res = asyncio.run(replay(args))
+        base = None
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                base = json.load(f)
+        report(res, base)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(res, f, indent=2, ensure_ascii=False)
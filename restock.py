@@ -0,0 +1,222 @@
+# restock.py — alertes de retour en stock
+# - Abonnements (pid, coloris, variante, taille) -> utilisateurs, posés par le bouton 🔔 des tailles à 0.
+#   Journal JSONL append-only (RESTOCK_LOG, défaut restock.jsonl) relu en fin de fichier avant chaque usage :
+#   tous les workers voient les mêmes abonnements.
+# - sheets.on_restock signale les passages 0 -> >0 détectés à chaque reconstruction du stock ; les alertes
+#   partent par une file asynchrone à débit limité (RESTOCK_RATE messages/s), une seule fois par abonnement.
+# - Boutique sans trafic : le stock de chaque boutique ayant des abonnés est relu toutes les RESTOCK_POLL s
+#   (défaut 60 ; 0 = seulement au gré du trafic), le réassort est détecté même si personne ne navigue.
+# - Avec snapshot.py (plusieurs workers), seul le leader envoie (sinon chaque worker détecterait le même
+#   réassort).
+# - Envoi en échec (hors utilisateur ayant bloqué le bot) : nouvel essai après 30 s, 60 s… (RESTOCK_RETRIES
+#   essais au total) ; au-delà l'abonnement reste en place pour le prochain réassort.
+# - Abonnements plus vieux que RESTOCK_TTL_DAYS : ignorés partout, purgés de la mémoire à chaque relecture du stock.
+# - Abonnements par boutique (tenants.py : restock.<nom>.jsonl) ; une seule file d'envoi pour toutes.
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import metrics
+import snapshot
+import tenants
+from sheets import _norm, on_restock
+
+PATH = os.getenv("RESTOCK_LOG", "restock.jsonl")
+RATE = float(os.getenv("RESTOCK_RATE", "20"))           # messages/s (Telegram : ~30/s tous chats confondus)
+MAX_PER_USER = int(os.getenv("RESTOCK_MAX_PER_USER", "20"))
+TTL_DAYS = float(os.getenv("RESTOCK_TTL_DAYS", "30"))   # abonnement oublié après ce délai
+POLL = float(os.getenv("RESTOCK_POLL", "60"))           # s entre deux relectures du stock (0 = jamais)
+RETRIES = int(os.getenv("RESTOCK_RETRIES", "3"))        # essais d'envoi d'une alerte (erreurs hors blocage)
+RETRY_DELAY = 30.0                                      # s avant le 2e essai, doublé ensuite
+
+log = logging.getLogger("restock")
+_lock = threading.Lock()
+_subs = tenants.scoped(dict)  # (pid, coloris, variante, taille) normalisés -> {user_id: ts}
+_state = tenants.scoped(lambda: {"offset": 0})
+_sender = {"loop": None, "queue": None, "task": None, "send": None, "poll": None}
+_pending = tenants.scoped(set)  # (user_id, clé) en file : pas de doublon si le stock oscille
+
+metrics.register_gauge("restock_subscriptions", lambda: sum(len(u) for u in _subs.values()))
+
+
+def key(pid: int, color: str, variant: str, size: str) -> tuple:
+    return int(pid), _norm(color), _norm(variant), str(size).strip()
+
+
+# -------- Journal --------
+def _apply(e: dict):
+    k, u = tuple(e["k"]), int(e["u"])
+    if e["op"] == "sub":
+        _subs.setdefault(k, {})[u] = e["ts"]
+    else:  # unsub / done
+        users = _subs.get(k)
+        if users:
+            users.pop(u, None)
+            if not users:
+                del _subs[k]
+
+
+def _sync():
+    path = tenants.path(PATH)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if size <= _state["offset"]:
+        return
+    with _lock:
+        if size <= _state["offset"]:
+            return
+        with open(path, "rb") as f:
+            f.seek(_state["offset"])
+            chunk = f.read(size - _state["offset"])
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                _apply(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                log.warning("ligne illisible dans %s", path)
+        _state["offset"] += end
+
+
+def _limit() -> float:
+    return time.time() - TTL_DAYS * 86400
+
+
+def _prune():
+    """Oublie les abonnements expirés (mémoire seulement : le journal reste append-only)."""
+    limit = _limit()
+    with _lock:
+        for k, users in list(_subs.items()):
+            for u in [u for u, ts in users.items() if ts < limit]:
+                del users[u]
+            if not users:
+                del _subs[k]
+
+
+def _write(op: str, k: tuple, user_id: int):
+    line = json.dumps({"op": op, "k": list(k), "u": user_id, "ts": round(time.time())}, ensure_ascii=False) + "\n"
+    fd = os.open(tenants.path(PATH), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+    _sync()
+
+
+# -------- Abonnements --------
+def is_subscribed(k: tuple, user_id: int) -> bool:
+    _sync()
+    return _subs.get(k, {}).get(user_id, 0) >= _limit()
+
+
+def subscribed(keys: list[tuple], user_id: int) -> set[tuple]:
+    """Parmi keys, celles où user_id est abonné : un seul relevé du journal pour tout un clavier."""
+    _sync()
+    limit = _limit()
+    return {k for k in keys if _subs.get(k, {}).get(user_id, 0) >= limit}
+
+
+def toggle(k: tuple, user_id: int) -> bool|None:
+    """Abonne / désabonne. Renvoie True (abonné), False (désabonné) ou None (limite atteinte)."""
+    if is_subscribed(k, user_id):
+        _write("unsub", k, user_id)
+        return False
+    limit = _limit()
+    if sum(users.get(user_id, 0) >= limit for users in _subs.values()) >= MAX_PER_USER:
+        return None
+    _write("sub", k, user_id)
+    metrics.inc("restock_subscribed_total")
+    return True
+
+
+# -------- Envoi --------
+def start(send):
+    """Démarre l'envoi (dans la boucle courante). send(user_id, key, qty) est une coroutine fournie par main.py."""
+    _sender.update(loop=asyncio.get_running_loop(), queue=asyncio.Queue(), send=send)
+    _sender["task"] = asyncio.create_task(_run())
+    if POLL > 0:
+        _sender["poll"] = asyncio.create_task(_poll())
+    metrics.register_gauge("queue_depth", lambda: _sender["queue"].qsize(), queue="restock")
+
+
+async def stop():
+    for name in ("task", "poll"):
+        if _sender[name]:
+            _sender[name].cancel()
+            _sender[name] = None
+
+
+async def _run():
+    q = _sender["queue"]
+    while True:
+        tenant, user_id, k, qty, attempt = await q.get()
+        with tenants.use(tenant):
+            await _notify(user_id, k, qty, attempt)
+        await asyncio.sleep(1 / RATE)
+
+
+async def _poll():
+    """Relit le stock des boutiques qui ont des abonnés : la reconstruction (sheets._load_stock) compare avec
+    le stock précédent et appelle _on_restock. Avec snapshot.py, le leader seul (il lit le fichier partagé)."""
+    import sheets
+    while True:
+        await asyncio.sleep(POLL)
+        if snapshot.enabled and not snapshot.is_leader():
+            continue
+        for tenant in tenants.all_tenants():
+            with tenants.use(tenant):  # to_thread copie le contexte : _load_stock voit la boutique
+                try:
+                    _sync()
+                    _prune()
+                    if _subs:
+                        await asyncio.to_thread(sheets._load_stock)
+                except Exception:
+                    log.exception("relecture du stock (%s)", tenant.name)
+
+
+async def _notify(user_id: int, k: tuple, qty: int, attempt: int = 0):
+    if not is_subscribed(k, user_id):  # désabonné (ou expiré) entre-temps
+        _pending.discard((user_id, k))
+        return
+    while True:
+        try:
+            await _sender["send"](user_id, k, qty)
+            metrics.inc("restock_notified_total")
+            break
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError:  # bot bloqué par l'utilisateur : inutile de garder l'abonnement
+            break
+        except Exception:
+            log.exception("alerte réassort %s -> %s (essai %s/%s)", k, user_id, attempt + 1, RETRIES)
+            metrics.inc("restock_errors_total")
+            if attempt + 1 < RETRIES:  # reste dans _pending jusqu'au nouvel essai
+                _sender["loop"].call_later(RETRY_DELAY * 2 ** attempt, _sender["queue"].put_nowait,
+                                           (tenants.current(), user_id, k, qty, attempt + 1))
+            else:  # abandon : abonnement conservé, prochain réassort
+                _pending.discard((user_id, k))
+            return
+    _write("done", k, user_id)
+    _pending.discard((user_id, k))
+
+
+@on_restock
+def _on_restock(changes: list[tuple]):
+    """changes = [(pid, coloris, variante, taille, qté)] passés de 0 à >0 (peut être appelé hors boucle)."""
+    loop, q = _sender["loop"], _sender["queue"]
+    if loop is None or (snapshot.enabled and not snapshot.is_leader()):
+        return
+    _sync()
+    tenant = tenants.current()  # stock reconstruit dans le contexte de sa boutique
+    limit = _limit()
+    for *k, qty in changes:
+        for user_id, ts in list(_subs.get(tuple(k), {}).items()):
+            if ts >= limit and (user_id, tuple(k)) not in _pending:
+                _pending.add((user_id, tuple(k)))
+                loop.call_soon_threadsafe(q.put_nowait, (tenant, user_id, tuple(k), qty, 0))
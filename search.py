@@ -0,0 +1,131 @@
+# search.py — recherche produit en mémoire pour le mode inline
+# Index reconstruit à chaque nouveau snapshot Products (sheets.on_snapshot), pas à chaque requête :
+# - préfixes de mots (nom, club, saison, coloris, variante) -> documents
+# - trigrammes de mots -> documents (tolère fautes de frappe / sous-chaînes)
+# Un document = une déclinaison affichable : (index produit, index coloris, index variante).
+# Les images ne sont résolues que pour la page renvoyée (les maps d'images des produits restent non parsées).
+import re
+import unicodedata
+from typing import NamedTuple
+
+import tenants
+from sheets import catalog_version, get_image_for, get_products, get_variants_for, on_snapshot
+
+_RX_TOKEN = re.compile(r"[a-z0-9]+")
+_MAX_PREFIX = 12
+_FUZZY_MIN = 0.6  # part minimale des trigrammes d'un mot de la requête à retrouver
+
+
+class Doc(NamedTuple):
+    pi: int
+    ci: int
+    vi: int
+    title: str
+    description: str
+    image: str
+    thumb: str
+
+
+# index de la boutique courante (tenants.py)
+_index = tenants.scoped(lambda: {"version": 0, "docs": [], "tokens": [], "prefix": {}, "grams": {}})
+
+
+def _fold(s: str) -> str:
+    return unicodedata.normalize("NFKD", s or "").encode("ascii", "ignore").decode().lower()
+
+
+def _tokens(s: str) -> list[str]:
+    return _RX_TOKEN.findall(_fold(s))
+
+
+def _grams(tok: str) -> set[str]:
+    t = f" {tok} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def _thumb(url: str) -> str:
+    # miniatures servies redimensionnées par Google (lh3) : pas de pleine image pour la liste inline
+    if url and url.startswith("https://lh3.googleusercontent.com/") and "=" not in url:
+        return url + "=s160"
+    return url
+
+
+def _docs_for(p: dict) -> list[Doc]:
+    base = [p.get("name", ""), p.get("club", ""), p.get("season", "")]
+    colors = p.get("colors") or []
+    out = []
+    if not colors:
+        out.append(Doc(p["idx"], -1, -1, p["name"], " • ".join(filter(None, base[1:])), "", ""))
+    for ci, c in enumerate(colors):
+        variants = get_variants_for(p, c)
+        for vi, v in (list(enumerate(variants)) or [(-1, None)]):
+            desc = " • ".join(filter(None, [p.get("club"), p.get("season"), c, v]))
+            out.append(Doc(p["idx"], ci, vi, p["name"], desc, "", ""))
+    return out
+
+
+def _with_image(d: Doc, prods: list) -> Doc:
+    p = prods[d.pi]
+    c = p["colors"][d.ci] if d.ci >= 0 else None
+    v = get_variants_for(p, c)[d.vi] if d.vi >= 0 else None
+    img = get_image_for(p, c, v)
+    return d._replace(image=img, thumb=_thumb(img))
+
+
+@on_snapshot
+def build(products: list, version: int):
+    docs, toks, prefix, grams = [], [], {}, {}
+    for p in products:
+        for d in _docs_for(p):
+            di = len(docs)
+            docs.append(d)
+            words = set(_tokens(f"{d.title} {d.description}"))
+            toks.append(words)
+            for w in words:
+                for n in range(1, min(len(w), _MAX_PREFIX) + 1):
+                    prefix.setdefault(w[:n], set()).add(di)
+                for g in _grams(w):
+                    grams.setdefault(g, set()).add(di)
+    # swap atomique : une requête en cours voit l'ancien index complet ou le nouveau
+    _index.swap({"version": version, "docs": docs, "tokens": toks, "prefix": prefix, "grams": grams})
+
+
+def _match(tok: str, idx: dict) -> dict[int, float]:
+    """doc -> score pour un mot de la requête (2 = mot exact, 1 = préfixe, <1 = approché)."""
+    tok_p = tok[:_MAX_PREFIX]
+    hits = idx["prefix"].get(tok_p)
+    if hits:
+        toks = idx["tokens"]
+        return {d: (2.0 if tok in toks[d] else 1.0) for d in hits}
+    qg = _grams(tok)
+    counts: dict[int, int] = {}
+    for g in qg:
+        for d in idx["grams"].get(g, ()):
+            counts[d] = counts.get(d, 0) + 1
+    need = max(1, int(len(qg) * _FUZZY_MIN))
+    return {d: c / len(qg) for d, c in counts.items() if c >= need}
+
+
+def search(query: str, offset: int = 0, limit: int = 50) -> tuple[list[Doc], int]:
+    """Renvoie (documents, offset suivant ou -1). Tous les mots de la requête doivent matcher."""
+    prods = get_products()  # rafraîchit le snapshot si TTL dépassé (=> build via on_snapshot)
+    if _index["version"] != catalog_version():
+        build(prods, catalog_version())
+    idx = _index.unwrap()
+    words = _tokens(query)
+    if not words:
+        ranked = range(len(idx["docs"]))
+    else:
+        scores = None
+        for w in words:
+            m = _match(w, idx)
+            if scores is None:
+                scores = m
+            else:
+                scores = {d: s + m[d] for d, s in scores.items() if d in m}
+            if not scores:
+                return [], -1
+        ranked = sorted(scores, key=lambda d: (-scores[d], d))
+    page = [_with_image(idx["docs"][d], prods) for d in ranked[offset:offset + limit]]
+    nxt = offset + limit if offset + limit < len(ranked) else -1
+    return page, nxt
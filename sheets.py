@@ -1,25 +1,36 @@
 # sheets.py — Products/Orders/Stock
 # - Stock par coloris+variante+taille depuis l'onglet "Stock"
 # - Le bot n'utilise plus 'sizes' de Products pour l'affichage : l'ordre des tailles vient des en-têtes de Stock
-import os, time, json, re
-import gspread
-from google.oauth2.service_account import Credentials
+# - Un classeur et un cache par boutique (tenants.py) ; le client gspread (pool HTTP) est partagé
+import os, time, json, re, hashlib, logging
 from dotenv import load_dotenv
-from gspread.exceptions import WorksheetNotFound
+# gspread / google-auth (~0,2 s d'import) sont chargés au premier accès au classeur : voir _ensure_client
+
+import deadline
+import metrics
+import snapshot
+import tenants
 
 load_dotenv()
-SHEET_ID      = os.getenv("SHEET_ID")
 PRODUCTS_TAB  = os.getenv("PRODUCTS_TAB", "Products")
 ORDERS_TAB    = os.getenv("ORDERS_TAB", "Orders")
 STOCK_TAB     = os.getenv("STOCK_TAB",  "Stock")
 
 _SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
-_gc = _sh = None
+_gc = None  # client gspread partagé par toutes les boutiques
 
-_cache = {
+_cache = tenants.scoped(lambda: {
+    "sh":       None,  # classeur de la boutique (gspread.Spreadsheet)
     "products": ([], 0),
+    "digest":   0,   # empreinte 64 bits du contenu de Products (détection de changement)
+    "version":  0,   # ses 16 bits de poids faible (datage des callback_data)
+    "by_id":    {},  # id -> produit
+    "slices":   {},  # (club, season|None) -> [index produit] ; (None, None) = tout le catalogue
+    "seasons":  {},  # club -> [saisons triées]
+    "clubs":    [],  # clubs triés
     "stock":    ({}, [], 0),  # (stock_map, size_headers, ts)
-}
+    "stock_src": 0,  # compteur du snapshot partagé (snapshot.py) dont vient le stock, 0 = lecture directe
+})
 TTL = 5  # s
 
 # --------- helpers ---------
@@ -81,11 +92,21 @@ def _parse_nested_price_map(val: str):
         out = {}
         for color, sub in data.items():
             if isinstance(sub, dict):
-                out[str(color).strip()] = {str(v).strip(): _parse_price_value(p) for v, p in sub.items() if _parse_price_value(p) is not None}
+                out[str(color).strip()] = {str(v).strip(): c for v, p in sub.items() if (c := _parse_price_value(p)) is not None}
         return out
     except Exception:
         return {}
 
+def _parse_nested_imgmap(val: str):
+    """color -> { variant -> url directe }"""
+    if not val: return {}
+    try:
+        data = json.loads(val)
+        return {str(c).strip(): {str(v).strip(): _to_direct(str(u).strip()) for v, u in sub.items()}
+                for c, sub in data.items() if isinstance(sub, dict)}
+    except Exception:
+        return {}
+
 def _parse_color_variant_list_map(val: str):
     """color -> [variants]"""
     if not val: return {}
@@ -99,6 +120,42 @@ def _parse_color_variant_list_map(val: str):
     except Exception:
         return {}
 
+# colonnes JSON parsées à la demande : clé produit -> (colonne, parseur)
+_LAZY_COLUMNS = {
+    "image_color_map": ("image_color_map_json", _parse_imgmap),
+    "color_variant_map": ("color_variant_map_json", _parse_color_variant_list_map),
+    "color_variant_price_map": ("color_variant_price_map_json", _parse_nested_price_map),
+    "image_color_variant_map": ("image_color_variant_map_json", _parse_nested_imgmap),
+}
+
+class Product(dict):
+    """Produit d'un snapshot. Les colonnes JSON restent brutes jusqu'au premier accès, puis le résultat
+    parsé est mémorisé dans le dict (donc pour la durée du snapshot : un snapshot inchangé est réutilisé)."""
+    __slots__ = ("_raw",)
+
+    def __init__(self, fields: dict, raw: dict):
+        super().__init__(fields)
+        self._raw = raw  # clé produit -> chaîne JSON brute
+
+    def _parse(self, key):
+        val = _LAZY_COLUMNS[key][1](self._raw.get(key))
+        dict.__setitem__(self, key, val)
+        self._raw.pop(key, None)
+        return val
+
+    def __getitem__(self, key):
+        if key in self._raw:
+            return self._parse(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self._raw:
+            return self._parse(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key in self._raw or dict.__contains__(self, key)
+
 def _ci_get_map(m: dict, key: str|None):
     if not key or not m: return None
     needle = key.strip().lower()
@@ -115,21 +172,39 @@ def _ci_get_nested(m: dict, k1: str|None, k2: str|None):
 
 # -------- Sheets client --------
 def _ensure_client():
-    global _gc, _sh
+    """Classeur de la boutique courante (client partagé créé au premier accès)."""
+    global _gc
+    sheet_id = tenants.current().sheet_id
+    if not sheet_id:
+        raise RuntimeError("SHEET_ID manquant dans .env")
     if _gc is None:
-        if not SHEET_ID:
-            raise RuntimeError("SHEET_ID manquant dans .env")
+        import gspread
+        from google.oauth2.service_account import Credentials
         creds = Credentials.from_service_account_file("service_account.json", scopes=_SCOPES)
-        _gc = gspread.authorize(creds)
-    if _sh is None:
-        _sh = _gc.open_by_key(SHEET_ID)
+        from pools import tune_sheets
+        _gc = tune_sheets(gspread.authorize(creds))
+    if _cache["sh"] is None:
+        _cache["sh"] = _gc.open_by_key(sheet_id)
+    return _cache["sh"]
+
+def close():
+    """Ferme le pool HTTP du client (arrêt de l'app) ; il sera recréé au prochain accès."""
+    global _gc
+    if _gc is not None and hasattr(_gc, "http_client"):
+        from pools import close_sheets
+        close_sheets(_gc)
+    _gc = None
+    for t in tenants.all_tenants():
+        with tenants.use(t):
+            _cache["sh"] = None
 
 def _ensure_ws(name: str, headers: list[str]|None=None, cols: int=12, init_rows: int=2000):
-    _ensure_client()
+    from gspread.exceptions import WorksheetNotFound
+    sh = _ensure_client()
     try:
-        ws = _sh.worksheet(name)
+        ws = sh.worksheet(name)
     except WorksheetNotFound:
-        ws = _sh.add_worksheet(title=name, rows=init_rows, cols=max(cols, 26))
+        ws = sh.add_worksheet(title=name, rows=init_rows, cols=max(cols, 26))
         if headers:
             ws.update(f"A1:{chr(64+len(headers))}1", [headers])
     return ws
@@ -138,18 +213,30 @@ def _ensure_ws(name: str, headers: list[str]|None=None, cols: int=12, init_rows:
 def get_products(force: bool=False):
     now = time.time()
     if not force and now - _cache["products"][1] < TTL:
+        metrics.cache("products", True)
+        return _cache["products"][0]
+    metrics.cache("products", False)
+
+    shared = snapshot.read()
+    if shared:
+        rows, digest = shared[1]["products"], shared[1]["digest"]
+    else:
+        fetched = _direct_or_stale("products", _fetch_products_direct, _cache["products"][0])
+        if fetched is None:
+            _cache["products"] = (_cache["products"][0], now)
+            return _cache["products"][0]
+        rows, digest = fetched
+    if digest == _cache["digest"] and _cache["products"][0]:
+        # contenu inchangé : on garde le snapshot courant (mêmes index, mêmes objets)
+        _cache["products"] = (_cache["products"][0], now)
         return _cache["products"][0]
-
-    _ensure_client()
-    ws = _sh.worksheet(PRODUCTS_TAB)
-    rows = ws.get_all_records()
     out = []
     for raw in rows:
         r = _normalize_row_keys(raw)
         active = str(r.get("active", 1)).lower() in ("1","true","vrai","yes","oui")
         if not active: continue
         try:
-            out.append({
+            out.append(Product({
                 "id": int(r.get("id")),
                 "name": str(r.get("name","")).strip(),
                 "club": str(r.get("club","")).strip(),
@@ -159,31 +246,101 @@ def get_products(force: bool=False):
                 "sizes": str(r.get("sizes","")).strip(),
                 "colors": _parse_list(r.get("colors","")),
                 "image": _to_direct(str(r.get("image_url","")).strip()),
-                "image_color_map": _parse_imgmap(r.get("image_color_map_json","")),
-                "image_color_variant_map": _parse_nested_price_map(None),  # placeholder pour compat
-                "color_variant_map": _parse_color_variant_list_map(r.get("color_variant_map_json","")),
-                "color_variant_price_map": _parse_nested_price_map(r.get("color_variant_price_map_json","")),
-                "image_color_variant_map": _parse_imgmap(r.get("image_color_variant_map_json","")) if r.get("image_color_variant_map_json") else {},
                 "stock": int(r.get("stock",0) or 0),
-            })
+            }, {k: r.get(col) or "" for k, (col, _) in _LAZY_COLUMNS.items()}))
         except Exception:
             continue
+    _build_index(out)
+    version = _version_tag(digest)
     _cache["products"] = (out, now)
+    _cache["digest"], _cache["version"] = digest, version
+    for fn in _snapshot_listeners:
+        try:
+            fn(out, version)
+        except Exception:
+            logging.exception("listener snapshot %r", fn)
     return out
 
+def _direct_or_stale(name: str, fetch, cached):
+    """Lecture Sheets directe, ou None (=> l'appelant garde son cache périmé pour un TTL) si un cache existe et
+    que le budget de l'update ne permet pas l'appel (deadline.SHEETS_MIN) ou que l'appel échoue."""
+    if cached and not deadline.enough(deadline.SHEETS_MIN):
+        deadline.fallback(f"{name}_stale")
+        return None
+    try:
+        return fetch()
+    except Exception:
+        if not cached:
+            raise
+        logging.exception("lecture %s : cache périmé servi", name)
+        deadline.fallback(f"{name}_stale")
+        return None
+
+def _fetch_products_direct():
+    with metrics.timer("sheets_call_seconds", errors="sheets_errors_total", fn="get_products"):
+        ws = _ensure_client().worksheet(PRODUCTS_TAB)
+        rows = ws.get_all_records()
+    return rows, _digest(rows)
+
+_snapshot_listeners = []
+
+def on_snapshot(fn):
+    """Enregistre fn(products, version), appelé à chaque NOUVEAU snapshot Products."""
+    _snapshot_listeners.append(fn)
+    return fn
+
+def _build_index(out: list):
+    """Index précalculés une fois par snapshot : navigation club/saison en O(1) par clic."""
+    slices, seasons = {(None, None): list(range(len(out)))}, {}
+    for i, p in enumerate(out):
+        p["idx"] = i  # position dans le snapshot (référencée par les callback_data)
+        club, season = p["club"], p["season"]
+        slices.setdefault((club, None), []).append(i)
+        slices.setdefault((club, season), []).append(i)
+        slices.setdefault((None, season), []).append(i)
+        if club and season:
+            seasons.setdefault(club, set()).add(season)
+    _cache["by_id"] = {p["id"]: p for p in reversed(out)}  # premier gagnant en cas de doublon
+    _cache["slices"] = slices
+    _cache["seasons"] = {c: sorted(s, reverse=True) for c, s in seasons.items()}  # plus récente d'abord
+    _cache["clubs"] = sorted(c for (c, s) in slices if c and s is None)
+
+def _digest(rows) -> int:
+    """Empreinte 64 bits des lignes (en-têtes + valeurs, sans sérialisation JSON complète), stable d'un process
+    à l'autre : les workers sans snapshot partagé datent leurs boutons de la même façon."""
+    h = hashlib.blake2b(digest_size=8)
+    if rows:
+        h.update("\x1f".join(map(str, rows[0])).encode())
+    h.update("\x1e".join("\x1f".join(map(str, r.values())) for r in rows).encode())
+    return int.from_bytes(h.digest(), "big")
+
+def _version_tag(digest: int) -> int:
+    """Version portée par les callback_data : 16 bits de l'empreinte (0 est réservé aux boutons statiques)."""
+    return digest & 0xFFFF or 1
+
+def catalog_version() -> int:
+    get_products()
+    return _cache["version"]
+
 def list_clubs():
-    return sorted({p["club"] for p in get_products() if p.get("club")})
+    get_products()
+    return _cache["clubs"]
+
+def list_seasons(club: str):
+    get_products()
+    return _cache["seasons"].get(club, [])
 
 def list_products(club=None, season=None):
     prods = get_products()
-    if club: prods = [p for p in prods if p["club"] == club]
-    if season: prods = [p for p in prods if p["season"] == season]
-    return prods
+    return [prods[i] for i in _cache["slices"].get((club or None, season or None), [])]
 
 def get_product(pid: int):
-    for p in get_products():
-        if p["id"] == pid: return p
-    return None
+    get_products()
+    return _cache["by_id"].get(pid)
+
+def get_product_at(idx: int):
+    prods = get_products()
+    return prods[idx] if 0 <= idx < len(prods) else None
 
 # ---------- VARIANTS / PRICE / IMAGE ----------
 def get_variants_for(product: dict, color: str|None):
@@ -215,15 +372,33 @@ def get_image_for(product: dict, color: str|None = None, variant: str|None = Non
 def _norm(s):
     return (s or "").strip().lower()
 
+def _fetch_stock_direct():
+    with metrics.timer("sheets_call_seconds", errors="sheets_errors_total", fn="_load_stock"):
+        ws = _ensure_client().worksheet(STOCK_TAB)
+        return ws.row_values(1), ws.get_all_records()
+
 def _load_stock(force: bool=False):
     now = time.time()
     stock_map, size_headers, ts = _cache["stock"]
     if not force and now - ts < TTL and size_headers:
+        metrics.cache("stock", True)
         return stock_map, size_headers
+    metrics.cache("stock", False)
 
-    _ensure_client()
-    ws = _sh.worksheet(STOCK_TAB)
-    headers_orig = ws.row_values(1)
+    shared = snapshot.read()
+    if shared and shared[0] == _cache["stock_src"] and size_headers:
+        # snapshot partagé inchangé : le stock déjà construit reste valable
+        _cache["stock"] = (stock_map, size_headers, now)
+        return stock_map, size_headers
+    if shared:
+        headers_orig, rows = shared[1]["stock_headers"], shared[1]["stock"]
+    else:
+        fetched = _direct_or_stale("stock", _fetch_stock_direct, size_headers)
+        if fetched is None:
+            _cache["stock"] = (stock_map, size_headers, now)
+            return stock_map, size_headers
+        headers_orig, rows = fetched
+    _cache["stock_src"] = shared[0] if shared else 0
     headers_norm = [_norm(h) for h in headers_orig]
 
     # repérage des colonnes clés
@@ -245,8 +420,6 @@ def _load_stock(force: bool=False):
 
     size_headers = [headers_orig[i].strip() for i in range(len(headers_orig)) if i not in skip]
 
-    # lecture des lignes
-    rows = ws.get_all_records()
     stock_map = {}  # (pid, color_norm, variant_norm) -> { size_label -> qty_int }
     for r in rows:
         try:
@@ -269,9 +442,27 @@ def _load_stock(force: bool=False):
             sizes[sh.strip()] = sizes.get(sh.strip(), 0) + q  # si doublon de ligne, on additionne
         stock_map[key] = sizes
 
+    prev_map = _cache["stock"][0]
     _cache["stock"] = (stock_map, size_headers, now)
+    if prev_map and _restock_listeners:
+        # réassorts : tailles passées de 0 (ou absentes) à >0 depuis la reconstruction précédente
+        changes = [(*k, sz, q) for k, sizes in stock_map.items() for sz, q in sizes.items()
+                   if q > 0 and prev_map.get(k, {}).get(sz, 0) <= 0]
+        if changes:
+            for fn in _restock_listeners:
+                try:
+                    fn(changes)
+                except Exception:
+                    logging.exception("listener réassort %r", fn)
     return stock_map, size_headers
 
+_restock_listeners = []
+
+def on_restock(fn):
+    """Enregistre fn(changes), changes = [(pid, coloris normalisé, variante normalisée, taille, qté)]."""
+    _restock_listeners.append(fn)
+    return fn
+
 def get_stock_sizes():
     _, size_headers = _load_stock()
     return size_headers
@@ -315,6 +506,7 @@ def _ensure_row_capacity(ws, row_idx: int, buffer: int = 100):
     if row_idx > ws.row_count:
         ws.add_rows(row_idx - ws.row_count + buffer)
 
+@metrics.timed("sheets_call_seconds", errors="sheets_errors_total", fn="append_order")
 def append_order(order: dict):
     headers = ["order_id","timestamp","user_id","name","phone","address","items_json","total_cents","status"]
     ws = _ensure_ws(ORDERS_TAB, headers=headers, cols=len(headers)+2, init_rows=2000)
@@ -335,3 +527,15 @@ def append_order(order: dict):
         order.get("status","new"),
     ]
     ws.update(f"A{row_idx}:I{row_idx}", [row], value_input_option="USER_ENTERED")
+    for fn in _order_listeners:
+        try:
+            fn(order)
+        except Exception:
+            logging.exception("listener commande %r", fn)
+
+_order_listeners = []
+
+def on_order(fn):
+    """Enregistre fn(order), appelé après chaque commande écrite dans l'onglet Orders."""
+    _order_listeners.append(fn)
+    return fn
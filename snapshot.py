@@ -0,0 +1,164 @@
+# snapshot.py — catalogue + stock partagés entre workers uvicorn (un seul lecteur de Google Sheets)
+# Activé si SNAPSHOT_DIR est défini (ex: /dev/shm/madsport, même machine pour tous les workers).
+# - Un worker devient "leader" en prenant un verrou fcntl.flock non bloquant sur <dir>/leader.lock
+#   (libéré automatiquement si le process meurt ; les autres retentent à chaque cycle).
+# - Le leader relit Products/Stock toutes les TTL s et publie les lignes brutes dans <dir>/catalog.bin :
+#   fichier temporaire puis os.replace (swap atomique ; un lecteur en cours garde l'ancien inode).
+#   En-tête : magic, compteur de version, empreinte Products (sheets._digest, 64 bits), taille du JSON.
+#   Contenu inchangé => seul le mtime est rafraîchi (battement de cœur).
+# - Chaque worker (leader compris) relit l'en-tête quand son cache sheets.py expire ; (inode, compteur)
+#   inchangés => rien n'est relu ni reconstruit. Fichier absent ou plus vieux que SNAPSHOT_STALE s => lecture
+#   Sheets directe.
+# Seul l'appel Sheets est partagé (quota, réseau) : pas de mémoire partagée. Chaque worker refait json.loads
+# du contenu et reconstruit ses propres Product / stock ; le mmap évite juste une copie à la lecture.
+# Plusieurs boutiques (tenants.py) : un fichier par boutique (catalog.<nom>.bin), un seul leader et une seule
+# tâche de publication pour toutes.
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import metrics
+import tenants
+
+DIR = os.getenv("SNAPSHOT_DIR", "").strip()
+STALE = float(os.getenv("SNAPSHOT_STALE", "60"))  # s sans battement du leader => lecture directe
+enabled = bool(DIR)
+
+_HDR = struct.Struct("!4sQQI")  # magic, compteur, empreinte Products, taille JSON
+_MAGIC = b"MSC2"
+PATH = os.path.join(DIR, "catalog.bin") if DIR else ""
+LOCK = os.path.join(DIR, "leader.lock") if DIR else ""
+
+log = logging.getLogger("snapshot")
+_lock_fd: int|None = None
+_read = tenants.scoped(lambda: {"ino": None, "counter": 0, "data": None})
+_pub = tenants.scoped(lambda: {"counter": 0, "key": None})
+
+
+# -------- Lecture (tous les workers) --------
+def read() -> tuple[int, dict]|None:
+    """(compteur, {"products", "digest", "stock_headers", "stock"}) ou None si pas de snapshot frais."""
+    if not enabled:
+        return None
+    path = tenants.path(PATH)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        metrics.inc("snapshot_reads_total", result="missing")
+        return None
+    if time.time() - st.st_mtime > STALE:
+        metrics.inc("snapshot_reads_total", result="stale")
+        return None
+    try:
+        with open(path, "rb") as f:
+            magic, counter, digest, n = _HDR.unpack(f.read(_HDR.size))
+            if magic != _MAGIC:
+                raise ValueError("en-tête invalide")
+            ino = os.fstat(f.fileno()).st_ino
+            if (ino, counter) == (_read["ino"], _read["counter"]):
+                metrics.inc("snapshot_reads_total", result="unchanged")
+                return counter, _read["data"]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                data = json.loads(m[_HDR.size:_HDR.size + n])
+    except Exception:
+        log.exception("lecture snapshot %s", path)
+        metrics.inc("snapshot_reads_total", result="error")
+        return None
+    data["digest"] = digest
+    _read.update(ino=ino, counter=counter, data=data)
+    metrics.inc("snapshot_reads_total", result="reload")
+    metrics.set_gauge("snapshot_counter", counter)
+    return counter, data
+
+
+# -------- Publication (leader) --------
+def is_leader() -> bool:
+    """Ce worker détient-il le verrou de leader (publication, tâches à faire une seule fois) ?"""
+    return _lock_fd is not None
+
+
+def _try_lead() -> bool:
+    global _lock_fd
+    if _lock_fd is not None:
+        return True
+    import fcntl
+    fd = os.open(LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _lock_fd = fd
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    log.info("worker %s leader du snapshot", os.getpid())
+    return True
+
+
+def publish():
+    """Relit Sheets et publie si le contenu a changé (sinon simple battement)."""
+    import sheets
+    rows, digest = sheets._fetch_products_direct()
+    headers, stock = sheets._fetch_stock_direct()
+    body = json.dumps({"products": rows, "stock_headers": headers, "stock": stock},
+                      ensure_ascii=False, default=str).encode()
+    key = (digest, zlib.crc32(body))
+    path = tenants.path(PATH)
+    if key == _pub["key"] and os.path.exists(path):
+        os.utime(path)
+        return False
+    if not _pub["counter"]:
+        cur = _read["counter"] or 0
+        try:
+            with open(path, "rb") as f:
+                cur = max(cur, _HDR.unpack(f.read(_HDR.size))[1])
+        except Exception:
+            pass
+        _pub["counter"] = cur  # un nouveau leader continue la numérotation
+    _pub["counter"] += 1
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HDR.pack(_MAGIC, _pub["counter"], digest, len(body)))
+        f.write(body)
+    os.replace(tmp, path)
+    _pub["key"] = key
+    metrics.inc("snapshot_publishes_total")
+    return True
+
+
+async def run(interval: float):
+    """Tâche de fond de chaque worker : devient leader dès que possible, puis publie toutes les `interval` s."""
+    os.makedirs(DIR, exist_ok=True)
+    while True:
+        try:
+            leader = _try_lead()
+            metrics.set_gauge("snapshot_leader", 1 if leader else 0)
+            if leader:
+                await _publish_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("publication snapshot")
+        await asyncio.sleep(interval)
+
+
+async def _publish_all():
+    for t in tenants.all_tenants():
+        with tenants.use(t):  # to_thread copie le contexte : publish() voit la boutique
+            try:
+                with metrics.timer("snapshot_publish_seconds"):
+                    await asyncio.to_thread(publish)
+            except Exception:  # une boutique en échec ne bloque pas les autres
+                log.exception("publication snapshot (%s)", t.name)
+
+
+def release():
+    global _lock_fd
+    if _lock_fd is not None:
+        os.close(_lock_fd)  # libère le verrou : un autre worker prend le relais
+        _lock_fd = None
@@ -0,0 +1,173 @@
+# tenants.py — plusieurs boutiques (bot + classeur) servies par un seul process
+# TENANTS (JSON) : liste des boutiques, ex.
+#   [{"name": "psg", "bot_token": "123:AA…", "sheet_id": "1x…", "webhook_secret": "s3cr3t",
+#     "admins": [111, 222], "admin_username": "vendeur", "paypal_me": "vendeur"}, …]
+# Absent : une seule boutique "default" décrite par les variables habituelles (BOT_TOKEN, SHEET_ID,
+# WEBHOOK_SECRET, ADMINS, ADMIN_USERNAME, PAYPAL_ME) — comportement inchangé.
+# - Boutique courante : contextvar posée par le webhook (route /webhook/<secret>) ou par
+#   middlewares.TenantContext (polling : d'après le bot de l'update) ; les tâches de fond bouclent avec use().
+# - État par boutique : scoped(factory) se comporte comme le dict / la liste de la boutique courante
+#   (caches sheets, index de recherche, paniers, journaux…), créé au premier accès.
+# - Partagé : session aiohttp des bots et client gspread (un seul compte de service, qui doit avoir accès
+#   à tous les classeurs), Dispatcher, tâches de fond, exécuteur de asyncio.to_thread.
+# - Fichiers locaux (journaux, snapshot) : nom de la boutique inséré avant l'extension, sauf "default".
+import contextvars
+import json
+import os
+import re
+from contextlib import contextmanager
+
+_RX_NAME = re.compile(r"^[a-z0-9_-]{1,32}$")
+
+
+def _parse_admins(val) -> list[int]:
+    out = []
+    for x in (val.split(",") if isinstance(val, str) else val or []):
+        try:
+            out.append(int(str(x).strip()))
+        except ValueError:
+            pass
+    return out
+
+
+class Tenant:
+    """Une boutique : configuration, bot (créé par main.py sur la session partagée) et état propre."""
+    __slots__ = ("name", "bot_token", "sheet_id", "webhook_secret", "admins", "admin_username", "paypal_me",
+                 "bot", "state")
+
+    def __init__(self, name: str, bot_token: str|None = None, sheet_id: str|None = None, webhook_secret: str|None = None,
+                 admins=(), admin_username: str = "", paypal_me: str = ""):
+        if not _RX_NAME.match(name):
+            raise RuntimeError(f"TENANTS : nom de boutique invalide {name!r} (a-z, 0-9, _ et -)")
+        self.name, self.bot_token, self.sheet_id = name, bot_token, sheet_id
+        self.webhook_secret = webhook_secret or bot_token
+        self.admins = _parse_admins(admins)
+        self.admin_username = (admin_username or "").lstrip("@").strip()
+        self.paypal_me = (paypal_me or "").strip().replace("https://paypal.me/", "").replace("paypal.me/", "").lstrip("/")
+        self.bot = None
+        self.state: dict[int, object] = {}  # id(scoped) -> instance de la boutique
+
+    def __repr__(self):
+        return f"Tenant({self.name})"
+
+
+_tenants: list[Tenant] = []
+_current: contextvars.ContextVar[Tenant|None] = contextvars.ContextVar("tenant", default=None)
+
+
+def _load() -> list[Tenant]:
+    """Lu au premier usage (après load_dotenv de main.py)."""
+    if not _tenants:
+        raw = os.getenv("TENANTS", "").strip()
+        if raw:
+            out = [Tenant(**cfg) for cfg in json.loads(raw)]
+        else:
+            out = [Tenant("default", os.getenv("BOT_TOKEN"), os.getenv("SHEET_ID"),
+                          os.getenv("WEBHOOK_SECRET") or os.getenv("BOT_TOKEN") or "MISSING_SECRET",
+                          os.getenv("ADMINS", ""), os.getenv("ADMIN_USERNAME", ""), os.getenv("PAYPAL_ME", ""))]
+        names = [t.name for t in out]
+        secrets = [t.webhook_secret for t in out]
+        if not out or len(set(names)) < len(names) or len(set(secrets)) < len(secrets):
+            raise RuntimeError("TENANTS : au moins une boutique, noms et webhook_secret uniques")
+        _tenants.extend(out)
+    return _tenants
+
+
+def all_tenants() -> list[Tenant]:
+    return _load()
+
+
+def get(name: str|None) -> Tenant|None:
+    """Boutique par nom (None : la première, boutique par défaut)."""
+    ts = _load()
+    return ts[0] if name is None else next((t for t in ts if t.name == name), None)
+
+
+def by_secret(secret: str) -> Tenant|None:
+    return next((t for t in _load() if t.webhook_secret == secret), None)
+
+
+def by_bot_id(bot_id: int) -> Tenant|None:
+    return next((t for t in _load() if t.bot is not None and t.bot.id == bot_id), None)
+
+
+def current() -> Tenant:
+    t = _current.get()
+    return t if t is not None else _load()[0]
+
+
+def set_current(t: Tenant):
+    """Pose la boutique pour la suite du contexte courant (update en cours)."""
+    _current.set(t)
+
+
+@contextmanager
+def use(t: Tenant):
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+
+
+def path(p: str) -> str:
+    """Fichier local de la boutique courante : orders.jsonl -> orders.<nom>.jsonl (inchangé pour "default")."""
+    name = current().name
+    if not p or name == "default":
+        return p
+    root, ext = os.path.splitext(p)
+    return f"{root}.{name}{ext}"
+
+
+class _Scoped:
+    """Se comporte comme l'objet (dict, list, set…) de la boutique courante."""
+    __slots__ = ("_factory",)
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def _obj(self):
+        st = current().state
+        try:
+            return st[id(self)]
+        except KeyError:
+            return st.setdefault(id(self), self._factory())
+
+    def unwrap(self):
+        """L'objet de la boutique courante lui-même (lecture cohérente malgré un swap concurrent)."""
+        return self._obj()
+
+    def swap(self, value):
+        """Remplace l'objet de la boutique courante d'un coup (les lecteurs voient l'ancien ou le nouveau)."""
+        current().state[id(self)] = value
+
+    def __getattr__(self, name):
+        return getattr(self._obj(), name)
+
+    def __getitem__(self, k):
+        return self._obj()[k]
+
+    def __setitem__(self, k, v):
+        self._obj()[k] = v
+
+    def __delitem__(self, k):
+        del self._obj()[k]
+
+    def __contains__(self, k):
+        return k in self._obj()
+
+    def __iter__(self):
+        return iter(self._obj())
+
+    def __len__(self):
+        return len(self._obj())
+
+    def __bool__(self):
+        return bool(self._obj())
+
+    def __repr__(self):
+        return repr(self._obj())
+
+
+def scoped(factory) -> _Scoped:
+    return _Scoped(factory)
@@ -0,0 +1,32 @@
+# conftest.py — environnement des tests : doublures de fakes.py, aucun vrai token, classeur ou journal
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FAKE_TOKEN, FakeSpreadsheet, install_sheets, isolate_files, make_catalog
+
+os.environ.update(BOT_TOKEN=FAKE_TOKEN, SHEET_ID="tests", TENANTS="", SNAPSHOT_DIR="")
+isolate_files("pytest-")  # avant tout import d'orders / analytics / restock
+
+import pytest
+
+import tenants
+
+
+@pytest.fixture(autouse=True)
+def fresh_tenant():
+    """Chaque test part d'une boutique vide : tout l'état tenants.scoped (caches, index, journaux relus) est oublié."""
+    tenants.current().state.clear()
+    yield
+    tenants.current().state.clear()
+
+
+
+@pytest.fixture
+def book():
+    """Classeur en mémoire branché sur sheets.py : 20 produits, 4 tailles, 2 coloris x 2 variantes, ~30 % de
+    tailles à 0."""
+    b = FakeSpreadsheet(make_catalog(20, n_sizes=4, n_colors=2, n_variants=2, zero_rate=0.3))
+    install_sheets(b)
+    return b
@@ -0,0 +1,94 @@
+import asyncio
+import base64
+import struct
+
+import pytest
+
+import callbacks
+from callbacks import INVALID, CallbackRouter, Payload, pack, unpack
+
+
+class FakeCallback:
+    """Juste ce que CallbackRouter.dispatch lit : data, message (None : pas de coalescence), answer()."""
+
+    def __init__(self, data):
+        self.data, self.message, self.answers = data, None, []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+
+@pytest.mark.parametrize("p", [
+    Payload("help"),
+    Payload("club", 0, 3, 1, -1, -1, 2),
+    Payload("size_ok", 0xFFFF, 40000, 200, 254, 0, 65535),
+    Payload("notify", 7, 0, 0, 0, 19),
+])
+def test_pack_round_trip(p):
+    data = pack(p)
+    assert len(data) == 16 and "=" not in data
+    assert unpack(data) == p
+
+
+@pytest.mark.parametrize("data", [None, "", "abc", "A" * 17, "!" * 16, "cart:view"])
+def test_unpack_rejects_garbage(data):
+    assert unpack(data) is INVALID
+
+
+def test_unpack_rejects_unknown_action():
+    raw = struct.pack("!BHiBBBH", len(callbacks.ACTIONS), 0, -1, 255, 255, 255, 0)
+    assert unpack(base64.urlsafe_b64encode(raw).rstrip(b"=").decode()) is INVALID
+
+
+def test_buttons_from_signed_format_still_decode():
+    raw = struct.pack("!BHibbbH", callbacks.ACTIONS.index("size_ok"), 7, 5, -1, 3, -1, 0)
+    assert unpack(base64.urlsafe_b64encode(raw).rstrip(b"=").decode()) == Payload("size_ok", 7, 5, -1, 3, -1, 0)
+
+
+def test_data_is_dated_only_with_a_product_index():
+    r = CallbackRouter(version=lambda: 42)
+    assert unpack(r.data("size_ok", pi=1, ci=2, vi=0, si=3)).ver == 42
+    assert unpack(r.data("clubs")).ver == 0
+
+
+@pytest.mark.parametrize("field, value", [("ci", 255), ("vi", 300), ("si", -2), ("pi", -5), ("pg", 70000)])
+def test_data_out_of_range(field, value):
+    r = CallbackRouter()
+    with pytest.raises(ValueError, match=field):
+        r.data("size_ok", **{"pi": 0, field: value})
+
+
+def test_dispatch_rejects_stale_and_invalid():
+    version = [1]
+    r = CallbackRouter(version=lambda: version[0])
+    seen = []
+
+    @r.on("size_ok")
+    async def size_ok(cb, p):
+        seen.append(p)
+
+    fresh = r.data("size_ok", pi=4, ci=1, vi=0, si=2)
+    asyncio.run(r.dispatch(FakeCallback(fresh)))
+    assert seen == [Payload("size_ok", 1, 4, 1, 0, 2)]
+
+    version[0] = 2  # catalogue modifié : le bouton déjà envoyé est périmé
+    stale, garbage = FakeCallback(fresh), FakeCallback("n'importe quoi")
+    asyncio.run(r.dispatch(stale))
+    asyncio.run(r.dispatch(garbage))
+    assert len(seen) == 1
+    assert stale.answers and garbage.answers
+
+
+def test_static_buttons_survive_catalog_updates():
+    version = [1]
+    r = CallbackRouter(version=lambda: version[0])
+    seen = []
+
+    @r.on("clubs")
+    async def clubs(cb, p):
+        seen.append(p.action)
+
+    data = r.data("clubs")
+    version[0] = 9
+    asyncio.run(r.dispatch(FakeCallback(data)))
+    assert seen == ["clubs"]
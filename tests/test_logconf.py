@@ -0,0 +1,56 @@
+import contextvars
+import json
+import logging
+import queue
+
+import logconf
+import metrics
+
+
+def _record(level=logging.INFO, msg="update", **extra):
+    r = logging.LogRecord("bot.update", level, __file__, 1, msg, None, None)
+    r.__dict__.update(extra)
+    return r
+
+
+def _dropped(reason: str) -> float:
+    return metrics._counters.get(metrics._key("log_records_dropped_total", {"reason": reason}), 0)
+
+
+def test_parse_rates_clamps_and_skips_garbage():
+    assert logconf._parse_rates("callback_query=0.2, inline_query=3,bad,message=-1") == {
+        "callback_query": 0.2, "inline_query": 1.0, "message": 0.0}
+
+
+def test_context_is_copied_and_sampling_decided_once(monkeypatch):
+    monkeypatch.setattr(logconf, "SAMPLE", {"inline_query": 0.0})
+    f = logconf._ContextFilter()
+
+    def run():
+        logconf.bind(update_id=7, type="inline_query")
+        logconf.annotate(handler="inline_search")
+        before = _dropped("sampled")
+        info, warning = _record(), _record(logging.WARNING)
+        assert not f.filter(info)
+        assert _dropped("sampled") == before + 1
+        assert f.filter(warning)  # WARNING et plus : toujours gardés
+        assert warning.ctx == {"update_id": 7, "type": "inline_query", "handler": "inline_search"}
+
+    contextvars.copy_context().run(run)
+    assert f.filter(_record())  # hors update : ni contexte ni échantillonnage
+
+
+def test_json_formatter_merges_context_and_extras():
+    r = _record(ctx={"update_id": 3, "user_id": 9}, duration_ms=1.5)
+    out = json.loads(logconf.JsonFormatter().format(r))
+    assert out["msg"] == "update" and out["level"] == "INFO"
+    assert out["update_id"] == 3 and out["user_id"] == 9 and out["duration_ms"] == 1.5
+
+
+def test_full_queue_drops_instead_of_blocking():
+    h = logconf._Handler(queue.Queue(1))
+    before = _dropped("queue_full")
+    h.handle(_record())
+    h.handle(_record())  # file pleine : abandonné, pas d'attente
+    assert h.queue.qsize() == 1
+    assert _dropped("queue_full") == before + 1
@@ -0,0 +1,56 @@
+import pytest
+
+import orders
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """Journal vide ; 30 commandes sur 3 jours et 4 clients (positions 0..29)."""
+    monkeypatch.setattr(orders, "PATH", str(tmp_path / "orders.jsonl"))
+    for i in range(30):
+        orders.record({"order_id": f"o{i}", "timestamp": f"2026-10-{10 + i // 10:02d} 12:00:{i:02d}",
+                       "user_id": 100 + i % 4, "items_json": [], "total_cents": 1000 + i, "status": "new"})
+    return tmp_path / "orders.jsonl"
+
+
+def _walk(limit: int, **filters) -> list[str]:
+    out, cursor = [], 0
+    while cursor is not None:
+        rows, cursor = orders.page(cursor, limit, **filters)
+        assert len(rows) <= limit
+        out += [o["order_id"] for o in rows]
+    return out
+
+
+@pytest.mark.parametrize("limit", [1, 7, 10, 30, 1000])
+def test_cursor_pagination(journal, limit):
+    assert _walk(limit) == [f"o{i}" for i in range(30)]
+
+
+def test_next_cursor_points_at_first_unsent_order(journal):
+    rows, cursor = orders.page(0, 10)
+    assert cursor == 10 and rows[-1]["order_id"] == "o9"
+    rows, cursor = orders.page(25, 10)
+    assert [o["order_id"] for o in rows] == [f"o{i}" for i in range(25, 30)] and cursor is None
+
+
+def test_filters_by_user_and_day(journal):
+    assert _walk(3, user_id=101) == [f"o{i}" for i in range(1, 30, 4)]
+    assert _walk(4, since="2026-10-11") == [f"o{i}" for i in range(10, 30)]
+    assert _walk(4, since="2026-10-11", until="2026-10-11") == [f"o{i}" for i in range(10, 20)]
+    assert _walk(5, user_id=999) == []
+
+
+def test_cursor_with_day_filter_resumes_after_gap(journal):
+    rows, cursor = orders.page(0, 5, until="2026-10-10")
+    assert cursor == 5
+    rows, cursor = orders.page(cursor, 5, until="2026-10-10")
+    assert [o["order_id"] for o in rows] == [f"o{i}" for i in range(5, 10)] and cursor is None
+
+
+def test_orders_written_by_another_worker_are_seen(journal):
+    orders.page(0, 1)
+    with open(journal, "a", encoding="utf-8") as f:  # autre process : simple ajout au journal
+        f.write('{"order_id":"ext","timestamp":"2026-10-13 09:00:00","user_id":7}\n{"order_id":"partiel"')
+    assert [o["order_id"] for o in orders.get("ext")] == ["ext"]
+    assert _walk(100)[-1] == "ext"  # ligne incomplète : ignorée jusqu'à son \n
@@ -0,0 +1,45 @@
+import sheets
+
+
+def test_json_columns_parsed_on_first_access_only(book):
+    p = sheets.get_products()[0]
+    assert "color_variant_price_map" in p._raw  # pas encore parsée
+    prices = p["color_variant_price_map"]
+    assert prices == {"Domicile": {"Fan": 5999, "Player": 6999}, "Extérieur": {"Fan": 5999, "Player": 6999}}
+    assert "color_variant_price_map" not in p._raw
+    assert p["color_variant_price_map"] is prices  # mémorisée dans le produit
+    assert "image_color_map" in p and "image_color_map" in p._raw  # `in` ne parse pas
+
+
+def test_lazy_maps_feed_the_lookup_helpers(book):
+    p = sheets.get_products()[0]
+    assert sheets.get_variants_for(p, "domicile") == ["Fan", "Player"]
+    assert sheets.get_price_for(p, "Player", "Extérieur") == 6999
+    assert sheets.get_image_for(p, "Domicile", "Player").endswith("000001DomPlaXXXXXXXXXXXXXXXX")
+
+
+def test_unchanged_sheet_keeps_snapshot_and_parsed_maps(book):
+    before = sheets.get_products()
+    before[0]["color_variant_map"]
+    version = sheets.catalog_version()
+    after = sheets.get_products(force=True)
+    assert after is before and sheets.catalog_version() == version
+    assert "color_variant_map" not in after[0]._raw
+
+
+def test_changed_sheet_rebuilds_with_new_version(book):
+    before = sheets.get_products()
+    version = sheets.catalog_version()
+    rows = book.tabs["Products"].rows
+    rows[1][rows[0].index("name")] = "Maillot renommé"
+    after = sheets.get_products(force=True)
+    assert after is not before and after[0]["name"] == "Maillot renommé"
+    assert sheets.catalog_version() != version
+
+
+def test_malformed_json_column_gives_empty_map(book):
+    rows = book.tabs["Products"].rows
+    rows[1][rows[0].index("color_variant_map_json")] = "{pas du json"
+    p = sheets.get_products(force=True)[0]
+    assert p["color_variant_map"] == {}
+    assert sheets.get_variants_for(p, "Domicile") == []
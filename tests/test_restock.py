@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+
+import restock
+import sheets
+
+
+@pytest.fixture
+def changes(book, monkeypatch):
+    """Réassorts signalés par sheets._load_stock (listeners remplacés par un simple relevé)."""
+    seen = []
+    monkeypatch.setattr(sheets, "_restock_listeners", [seen.extend])
+    return seen
+
+
+@pytest.fixture
+def subs(tmp_path, monkeypatch):
+    monkeypatch.setattr(restock, "PATH", str(tmp_path / "restock.jsonl"))
+    monkeypatch.setattr(restock, "RETRY_DELAY", 0.01)
+
+
+def _cell(book, row: int, size: str):
+    rows = book.tabs["Stock"].rows
+    return rows[row], rows[0].index(size)
+
+
+def test_only_zero_to_positive_is_reported(book, changes):
+    rows = book.tabs["Stock"].rows
+    head = rows[0]
+    sheets._load_stock(force=True)
+    assert changes == []  # premier stock construit : pas de référence
+
+    zero = next((r, s) for r in range(1, len(rows)) for s in head[4:] if rows[r][head.index(s)] == 0)
+    full = next((r, s) for r in range(1, len(rows)) for s in head[4:] if rows[r][head.index(s)] > 0)
+    row, col = _cell(book, *zero)
+    row[col] = 5
+    row2, col2 = _cell(book, *full)
+    row2[col2] = 0  # épuisé : pas un réassort
+    sheets._load_stock(force=True)
+    pid, color, variant = row[0], row[2], row[3]
+    assert changes == [(pid, sheets._norm(color), sheets._norm(variant), zero[1], 5)]
+
+    changes.clear()
+    row[col] = 8  # déjà en stock : rien de nouveau
+    sheets._load_stock(force=True)
+    assert changes == []
+
+
+def test_expired_subscriptions_are_ignored_and_pruned(subs, monkeypatch):
+    k1, k2 = restock.key(1, "Domicile", "Fan", "M"), restock.key(2, "Domicile", "Fan", "L")
+    assert restock.toggle(k1, 7) is True
+    assert restock.toggle(k2, 7) is True
+    assert restock.subscribed([k1, k2, restock.key(3, "x", "y", "S")], 7) == {k1, k2}
+
+    restock._subs[k1][7] = time.time() - (restock.TTL_DAYS + 1) * 86400  # abonnement ancien
+    assert not restock.is_subscribed(k1, 7)
+    assert restock.subscribed([k1, k2], 7) == {k2}
+    monkeypatch.setattr(restock, "MAX_PER_USER", 2)
+    assert restock.toggle(restock.key(4, "a", "b", "S"), 7) is True  # l'expiré ne compte plus
+    assert restock.toggle(restock.key(5, "a", "b", "S"), 7) is None
+    restock._prune()
+    assert k1 not in restock._subs and k2 in restock._subs
+
+
+def _run_alert(send) -> tuple:
+    """Abonne l'utilisateur 7, signale un réassort et laisse la file d'envoi travailler."""
+    k = restock.key(1, "Domicile", "Fan", "M")
+    restock.toggle(k, 7)
+
+    async def go():
+        restock.start(send)
+        try:
+            restock._on_restock([(*k, 3)])
+            await asyncio.sleep(0.3)
+        finally:
+            await restock.stop()
+            restock._sender["loop"] = None  # envoi arrêté : _on_restock ignore les réassorts suivants
+    asyncio.run(go())
+    return k
+
+
+def test_sent_alert_closes_subscription(subs):
+    sent = []
+
+    async def send(user_id, k, qty):
+        sent.append((user_id, k, qty))
+    k = _run_alert(send)
+    assert sent == [(7, k, 3)]
+    assert not restock.is_subscribed(k, 7)
+
+
+def test_blocked_user_closes_subscription(subs):
+    async def send(user_id, k, qty):
+        raise TelegramForbiddenError(method=None, message="bot was blocked by the user")
+    k = _run_alert(send)
+    assert not restock.is_subscribed(k, 7)
+
+
+def test_failed_alert_is_retried_then_kept(subs):
+    calls = []
+
+    async def send(user_id, k, qty):
+        calls.append(user_id)
+        raise RuntimeError("réseau")
+    k = _run_alert(send)
+    assert len(calls) == restock.RETRIES
+    assert restock.is_subscribed(k, 7)  # prochain réassort
+    assert not restock._pending
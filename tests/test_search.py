@@ -0,0 +1,51 @@
+import sheets
+from search import search
+
+
+def _all(query: str) -> list:
+    docs, nxt, out = [], 0, []
+    while nxt != -1:
+        docs, nxt = search(query, nxt, 7)
+        out += docs
+    return out
+
+
+def test_every_word_must_match(book):
+    docs = _all("om player")
+    assert docs
+    for d in docs:
+        text = f"{d.title} {d.description}".lower()
+        assert "om" in text.split() and "player" in text
+
+
+def test_prefix_accents_and_typos(book):
+    n = len(_all(""))
+    assert n == 20 * 2 * 2  # une déclinaison par (produit, coloris, variante)
+    assert len(_all("mail")) == n  # préfixe de "Maillot"
+    assert _all("exterieur") == _all("Extérieur")
+    assert {d.ci for d in _all("domicle")} == {0}  # faute de frappe : Domicile seulement
+
+
+def test_pages_cover_results_once(book):
+    full, nxt = search("maillot", 0, 1000)
+    assert nxt == -1
+    first, nxt = search("maillot", 0, 30)
+    rest, end = search("maillot", nxt, 1000)
+    assert nxt == 30 and end == -1
+    assert [d[:3] for d in first + rest] == [d[:3] for d in full]
+
+
+def test_images_resolved_for_returned_page_only(book):
+    docs, _ = search("player", 0, 3)
+    assert all(d.image.startswith("https://") for d in docs)
+    unparsed = sum("image_color_variant_map" in p._raw for p in sheets.get_products())
+    assert unparsed >= len(sheets.get_products()) - 3
+
+
+def test_index_follows_catalog_updates(book):
+    assert search("zidane", 0, 10) == ([], -1)
+    rows = book.tabs["Products"].rows
+    rows[1][rows[0].index("name")] = "Maillot Zidane 1998"
+    sheets.get_products(force=True)  # nouveau snapshot => index reconstruit (on_snapshot)
+    docs, _ = search("zidane", 0, 10)
+    assert docs and {d.pi for d in docs} == {0}
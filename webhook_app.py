@@ -1,48 +1,142 @@
 # webhook_api.py — FastAPI webhook pour aiogram v3 (Render) — sans allowed_updates
+# Plusieurs boutiques possibles (tenants.py) : une route /webhook/<webhook_secret> par bot, même Dispatcher.
 import os
+import csv
+import hmac
+import io
+import json
+import time
+_T0 = time.perf_counter()
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import Response, JSONResponse
-from aiogram.types import Update
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, StreamingResponse
 
-logging.basicConfig(level=logging.INFO)
+import deadline
+import logconf
+import metrics
+import recorder
+import snapshot
+import tenants
 
-bot = None
+logconf.setup()
+
+bot = None  # bot de la boutique par défaut ; les autres : tenants.all_tenants()
 dp = None
-BOT_TOKEN = None
+Update = None  # aiogram.types.Update, importé avec main.py (en arrière-plan)
 
+# boutique unique : chemin du webhook de la configuration par variables d'environnement
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or os.getenv("BOT_TOKEN") or "MISSING_SECRET"
 WEBHOOK_BASE = os.getenv("WEBHOOK_BASE") or os.getenv("RENDER_EXTERNAL_URL")  # ex: https://ton-bot.onrender.com
 WEBHOOK_PATH = f"/webhook/{WEBHOOK_SECRET}"
 WEBHOOK_URL = f"{WEBHOOK_BASE}{WEBHOOK_PATH}" if WEBHOOK_BASE else None
+WEBHOOK_FORCE = os.getenv("WEBHOOK_FORCE") == "1"  # ré-enregistre même si l'URL est déjà la bonne
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # routes /admin/* (désactivées si vide)
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "20"))  # s d'attente max d'un update reçu pendant le démarrage
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global bot, dp, BOT_TOKEN
+_in_flight = 0  # updates en cours de traitement
+metrics.register_gauge("queue_depth", lambda: _in_flight, queue="webhook_updates")
+
+# -------- Démarrage --------
+# L'app répond aux health checks dès que uvicorn écoute ; main.py (aiogram, ~1-2 s) est importé dans un
+# thread et le webhook vérifié ensuite. Les updates arrivés entre-temps attendent _ready (READY_TIMEOUT).
+_ready: asyncio.Event|None = None  # créé par lifespan (lié à la boucle courante)
+_tasks: list[asyncio.Task] = []  # démarrage + tâches de fond, annulées à l'arrêt
+_startup = {"app_import_ms": round((time.perf_counter() - _T0) * 1e3, 1)}
+
+
+def _import_main():
+    import main
+    from aiogram.types import Update
+    return main, Update
+
+
+async def _ensure_webhook(t: tenants.Tenant):
+    """N'appelle set_webhook que si l'URL enregistrée diffère (le secret fait partie du chemin).
+    Pas de drop_pending_updates : les updates en attente côté Telegram sont livrés après le redémarrage."""
+    url = f"{WEBHOOK_BASE}/webhook/{t.webhook_secret}"
+    info = await t.bot.get_webhook_info()
+    if info.url == url and not WEBHOOK_FORCE:
+        logging.info("✅ Webhook %s déjà en place (%s updates en attente)", t.name, info.pending_update_count)
+        return False
+    await t.bot.set_webhook(url=url, secret_token=t.webhook_secret)
+    logging.info("✅ Webhook %s installé", t.name)
+    return True
+
+
+async def _start():
+    global bot, dp, Update
+    t = time.perf_counter()
     try:
-        from main import bot as _bot, dp as _dp, BOT_TOKEN as _TOKEN
-        bot, dp, BOT_TOKEN = _bot, _dp, _TOKEN
+        main, Update = await asyncio.to_thread(_import_main)
+        bot, dp = main.bot, main.dp
         logging.info("✅ Import main.py OK")
+        import restock
+        restock.start(main.send_restock)
     except Exception as e:
+        _startup["error"] = repr(e)
         logging.exception("❌ Échec import main.py (env manquante ?): %s", e)
-        raise
+        return
+    finally:
+        _startup["import_main_ms"] = round((time.perf_counter() - t) * 1e3, 1)
+        _ready.set()
 
     # IMPORTANT: ne pas restreindre allowed_updates => Telegram enverra aussi 'message'
     if WEBHOOK_URL:
-        try:
-            await bot.delete_webhook(drop_pending_updates=True)
-            await bot.set_webhook(
-                url=WEBHOOK_URL,
-                secret_token=WEBHOOK_SECRET,
-            )
-            logging.info(f"✅ Webhook installé: {WEBHOOK_URL}")
-        except Exception as e:
-            logging.exception("❌ set_webhook a échoué: %s", e)
+        t = time.perf_counter()
+        _startup["webhook_set"] = []
+        for tenant in tenants.all_tenants():
+            try:
+                if await _ensure_webhook(tenant):
+                    _startup["webhook_set"].append(tenant.name)
+            except Exception as e:
+                logging.exception("❌ set_webhook a échoué (%s): %s", tenant.name, e)
+        _startup["webhook_ms"] = round((time.perf_counter() - t) * 1e3, 1)
     else:
         logging.warning("⚠️ WEBHOOK_BASE/RENDER_EXTERNAL_URL absent -> pas de set_webhook.")
+    _startup["total_ms"] = round((time.perf_counter() - _T0) * 1e3, 1)
+    for k, v in _startup.items():
+        if k.endswith("_ms"):
+            metrics.set_gauge("startup_seconds", v / 1e3, phase=k[:-3])
+    logging.info("🚀 Démarrage", extra={"startup": _startup})
+
+    import sheets
+    if snapshot.enabled:
+        # un worker (leader) relit Sheets et publie pour tous ; les autres lisent le fichier partagé
+        _tasks.append(asyncio.create_task(snapshot.run(sheets.TTL)))
+
+    # préchauffage : connexion TLS au pool Sheets + catalogue de chaque boutique en cache (hors chemin des
+    # premiers updates) ; to_thread copie le contexte, donc la boutique courante
+    t = time.perf_counter()
+    for tenant in tenants.all_tenants():
+        with tenants.use(tenant):
+            try:
+                await asyncio.to_thread(sheets.get_products)
+            except Exception as e:
+                logging.warning("préchauffage Sheets impossible (%s): %s", tenant.name, e)
+    _startup["sheets_warmup_ms"] = round((time.perf_counter() - t) * 1e3, 1)
+    metrics.set_gauge("startup_seconds", _startup["sheets_warmup_ms"] / 1e3, phase="sheets_warmup")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ready
+    _ready = asyncio.Event()
+    _tasks.append(asyncio.create_task(_start()))
     yield
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    snapshot.release()
+    if bot:
+        import restock
+        await restock.stop()
+        await deadline.drain(10)
+        await bot.session.close()
+        import sheets
+        sheets.close()
+    logconf.shutdown()
 
 app = FastAPI(title="Telegram Bot (Webhook)", lifespan=lifespan)
 
@@ -76,16 +170,136 @@ async def debug_info():
         "webhook_path": WEBHOOK_PATH,
         "webhook_base": WEBHOOK_BASE,
         "webhook_url": WEBHOOK_URL,
-        "env_ok": bool(os.getenv("BOT_TOKEN")) and bool(os.getenv("SHEET_ID")),
+        "env_ok": bool(os.getenv("BOT_TOKEN") or os.getenv("TENANTS")) and bool(os.getenv("SHEET_ID") or os.getenv("TENANTS")),
+        "tenants": [t.name for t in tenants.all_tenants()] if bot else None,
+        "ready": bool(_ready and _ready.is_set()),
+        "startup": _startup,
     }
 
-# -------- Webhook Telegram --------
-@app.post(WEBHOOK_PATH)
-async def telegram_webhook(request: Request):
-    logging.info("📩 POST webhook reçu")
+# -------- Métriques (format Prometheus) --------
+# Protégées comme /admin (ADMIN_TOKEN, en-tête X-Admin-Token ou "Authorization: Bearer" côté Prometheus) :
+# noms de boutiques, volumes et erreurs ne sont pas publics.
+@app.get("/metrics")
+async def metrics_get(request: Request):
+    _require_admin(request)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# -------- Admin : commandes (index local, jamais Sheets) --------
+def _require_admin(request: Request):
+    tok = request.headers.get("X-Admin-Token") or request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not ADMIN_TOKEN or not hmac.compare_digest(tok.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+def _use_tenant(name: str|None):
+    """?tenant=<nom> des routes admin (défaut : première boutique) ; posée pour la suite de la requête."""
+    t = tenants.get(name)
+    if t is None:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    tenants.set_current(t)
 
+@app.get("/admin/orders")
+async def admin_orders(request: Request, format: str = "ndjson", cursor: int = 0, limit: int = 1000,
+                       user_id: int|None = None, since: str|None = None, until: str|None = None,
+                       tenant: str|None = None):
+    """Export paginé : suivre l'en-tête X-Next-Cursor (absent = dernière page). since/until = AAAA-MM-JJ."""
+    _require_admin(request)
+    _use_tenant(tenant)
+    import orders
+    rows, nxt = orders.page(cursor, max(1, min(limit, 10000)), user_id=user_id, since=since, until=until)
+
+    def ndjson():
+        for o in rows:
+            yield json.dumps(o, ensure_ascii=False) + "\n"
+
+    def as_csv():
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(orders.FIELDS)
+        for i, o in enumerate(rows):
+            w.writerow([json.dumps(o.get(k), ensure_ascii=False) if k == "items_json" else o.get(k, "") for k in orders.FIELDS])
+            if i % 200 == 199:
+                yield buf.getvalue()
+                buf.seek(0); buf.truncate()
+        yield buf.getvalue()
+
+    headers = {"X-Next-Cursor": str(nxt)} if nxt is not None else {}
+    if format == "csv":
+        return StreamingResponse(as_csv(), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
+
+@app.get("/admin/orders/{order_id}")
+async def admin_order(order_id: str, request: Request, tenant: str|None = None):
+    _require_admin(request)
+    _use_tenant(tenant)
+    import orders
+    found = orders.get(order_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Unknown order")
+    return found
+
+@app.get("/admin/stats")
+async def admin_stats(request: Request, top: int = 10, tenant: str|None = None):
+    _require_admin(request)
+    _use_tenant(tenant)
+    import analytics
+    return await asyncio.to_thread(analytics.summary, max(1, min(top, 100)))  # relit le stock : hors boucle
+
+# -------- Admin : profilage à la demande (profiler.py, ce worker seulement) --------
+@app.get("/admin/profile")
+async def admin_profile_status(request: Request):
+    _require_admin(request)
+    import profiler
+    return profiler.status()
+
+@app.post("/admin/profile")
+async def admin_profile_start(request: Request, mode: str = "sample", updates: int|None = None,
+                              seconds: float|None = None):
+    """Profile les `updates` prochains updates ou `seconds` s ; résultat : GET /admin/profile/download."""
+    _require_admin(request)
+    if not dp:
+        raise HTTPException(status_code=503, detail="Bot not ready")
+    import profiler
+    if mode not in profiler.MODES:
+        raise HTTPException(status_code=400, detail=f"mode: {'|'.join(profiler.MODES)}")
+    if not profiler.start(dp, mode, updates=updates, seconds=seconds):
+        raise HTTPException(status_code=409, detail="Profiling already running")
+    return profiler.status()
+
+@app.post("/admin/profile/stop")
+async def admin_profile_stop(request: Request):
+    _require_admin(request)
+    import profiler
+    profiler.stop()
+    return profiler.status()
+
+@app.get("/admin/profile/download")
+async def admin_profile_download(request: Request):
+    """Fichier de la dernière session : .prof (pstats) ou piles repliées (flamegraph.pl, speedscope)."""
+    _require_admin(request)
+    import profiler
+    res = profiler.last()
+    if not res:
+        raise HTTPException(status_code=404, detail="No profile yet")
+    return Response(res["data"], media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{res["filename"]}"'})
+
+# -------- Webhook Telegram --------
+@app.post("/webhook/{secret}")
+async def telegram_webhook(secret: str, request: Request):
+    # boutiques connues une fois main.py importé (.env chargé) : on attend le démarrage avant de router
+    if _ready and not _ready.is_set():
+        try:
+            await asyncio.wait_for(_ready.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    if not bot or not dp:
+        logging.error("❌ Bot/Dispatcher non initialisés")
+        raise HTTPException(status_code=500, detail="Bot not ready")
+    tenant = tenants.by_secret(secret)
+    if tenant is None:
+        raise HTTPException(status_code=404, detail="Not Found")
     token_hdr = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
-    if token_hdr and token_hdr != WEBHOOK_SECRET:
+    if token_hdr and token_hdr != tenant.webhook_secret:
         logging.warning("❌ Mauvais secret header: %s", token_hdr)
         raise HTTPException(status_code=403, detail="Bad secret header")
 
@@ -94,19 +308,22 @@ async def telegram_webhook(request: Request):
     except Exception:
         logging.warning("❌ JSON invalide")
         raise HTTPException(status_code=400, detail="Bad JSON")
+    recorder.record(payload, tenant.name)
+    ut = next((k for k in ("message","callback_query","inline_query","my_chat_member","chat_member") if payload.get(k) is not None), "inconnu")
+    logconf.bind(update_id=payload.get("update_id"), type=ut)
+    tenants.set_current(tenant)
 
-    if not bot or not dp:
-        logging.error("❌ Bot/Dispatcher non initialisés")
-        raise HTTPException(status_code=500, detail="Bot not ready")
-
+    global _in_flight
+    _in_flight += 1
     try:
         update = Update.model_validate(payload)
-        # Log du type d'update
-        ut = next((k for k in ("message","callback_query","inline_query","my_chat_member","chat_member") if payload.get(k) is not None), "inconnu")
-        logging.info(f"➡️ Type d'update: {ut}")
-        await dp.feed_update(bot, update)
+        metrics.inc("webhook_updates_total", type=ut)
+        await dp.feed_update(tenant.bot, update)
     except Exception as e:
         logging.exception("❌ Erreur pendant le traitement du webhook: %s", e)
+        metrics.inc("webhook_errors_total")
         return JSONResponse({"ok": False}, status_code=200)
+    finally:
+        _in_flight -= 1
 
     return {"ok": True}